@@ -0,0 +1,35 @@
+# coding: utf-8
+# This script is used to import users in bulk (onboarding of a customer).
+
+import sys
+import json
+import argparse
+from user_api.helpers import import_users
+
+parser = argparse.ArgumentParser(description=u'Import users from a CSV or JSON lines file.')
+parser.add_argument(u'db_url', help=u"The connection URL to the database where to perform operations.")
+parser.add_argument(u'customer_id', type=int, help=u"The customer of the imported users.")
+parser.add_argument(u'path', help=u"The file to import (columns email, name, password, active, roles for a CSV).")
+parser.add_argument(u'--format', choices=[u"csv", u"jsonl"], default=None, help=u'The file format (guessed from the extension by default).')
+parser.add_argument(u'--chunk-size', type=int, default=500, help=u'How many users are hashed and saved at once.')
+parser.add_argument(u'--hash-workers', type=int, default=None, help=u'Number of processes hashing the passwords (number of CPUs by default).')
+args = parser.parse_args()
+
+
+def print_progress(processed, created, rejected):
+    sys.stderr.write(u"{} processed, {} created, {} rejected\n".format(processed, created, rejected))
+
+
+report = import_users(
+    db_url=args.db_url,
+    customer_id=args.customer_id,
+    path=args.path,
+    file_format=args.format,
+    chunk_size=args.chunk_size,
+    hash_workers=args.hash_workers,
+    progress_callback=print_progress
+)
+# One line per rejected user, to fix and import again.
+for error in report[u"errors"]:
+    print(json.dumps(error))
+sys.exit(1 if report[u"errors"] else 0)
@@ -3,23 +3,29 @@
 
 import argparse
 import user_api
-from user_api.helpers import init_db, add_user, add_customer
+from user_api.helpers import init_db, upgrade_db, add_user, add_customer
 
 parser = argparse.ArgumentParser(description=u'Init the API.')
 parser.add_argument(u'db_url', help=u"The connection URL to the database where to perform operations.")
-parser.add_argument(u"jwt_secret", help=u"The JWT secret to generate passwords.")
-parser.add_argument(u'admin_password', help=u'The password for the default admin.')
+parser.add_argument(u"jwt_secret", nargs=u"?", help=u"The JWT secret to generate passwords.")
+parser.add_argument(u'admin_password', nargs=u"?", help=u'The password for the default admin.')
 parser.add_argument(u'--drop-before', action='store_true', default=False, help='Do drop the database if it already exists.')
+parser.add_argument(u'--upgrade', action='store_true', default=False, help='Only upgrade the schema of an existing database.')
 args = parser.parse_args()
+if not args.upgrade and (args.jwt_secret is None or args.admin_password is None):
+    parser.error(u"jwt_secret and admin_password are required to init the database.")
 
-init_db(db_url=args.db_url, drop_before=args.drop_before)
-customer_id = add_customer(args.db_url)
-add_user(
-    db_url=args.db_url, 
-    jwt_secret=args.jwt_secret,
-    username="admin",
-    email="admin",
-    password=args.admin_password,
-    customer_id=customer_id
-)
+if args.upgrade:
+    upgrade_db(db_url=args.db_url)
+else:
+    init_db(db_url=args.db_url, drop_before=args.drop_before)
+    customer_id = add_customer(args.db_url)
+    add_user(
+        db_url=args.db_url, 
+        jwt_secret=args.jwt_secret,
+        username="admin",
+        email="admin",
+        password=args.admin_password,
+        customer_id=customer_id
+    )
 
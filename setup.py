@@ -7,8 +7,10 @@ setup(
     packages=[
         "user_api",
         "user_api.adapter",
+        "user_api.adapter.asgi",
         "user_api.adapter.flask",
         "user_api.auth",
+        "user_api.cache",
         "user_api.db"
     ],
     install_requires=[
@@ -19,5 +21,14 @@ setup(
         "Cerberus>=1.2,<2",
         "pycryptodome>=3.6,<4",
         "mysql-connector>=2.1.6,<3"
-    ]
+    ],
+    extras_require={
+        "async": [
+            "SQLAlchemy[asyncio]>=1.4,<2"
+        ],
+        "asgi": [
+            "SQLAlchemy[asyncio]>=1.4,<2",
+            "starlette"
+        ]
+    }
 )
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+import base64
+import pytest
+from mock import AsyncMock, Mock
+from pytest import fixture
+from user_api.user_api_exception import ApiForbidden
+
+pytest.importorskip(u"starlette")
+from starlette.testclient import TestClient  # noqa: E402
+from user_api.adapter.asgi import AsgiUserApi  # noqa: E402
+
+TOKEN_DATA = {
+    u"id": 1,
+    u"email": u"admin",
+    u"customer": {
+        u"id": 1
+    },
+    u"roles": [
+        {u"id": 1, u"code": u"admin", u"name": u"Admin"}
+    ]
+}
+
+
+@fixture(scope=u"function")
+def mock_user_api():
+    mock = Mock()
+    mock.get_token_data = AsyncMock(return_value=TOKEN_DATA)
+    # In-memory check: called, not awaited.
+    mock.token_has_roles = Mock(return_value=True)
+    mock.list_users = AsyncMock(return_value={u"users": [], u"has_next": False})
+    mock.authenticate = AsyncMock(return_value=({u"id": 1, u"exp": 4102444800}, b"TOKEN"))
+    mock.logout = AsyncMock(return_value=None)
+    return mock
+
+
+@fixture(scope=u"function")
+def client(mock_user_api):
+    return TestClient(AsgiUserApi(mock_user_api).construct_user_api_app())
+
+
+def test_login_sets_cookie(client, mock_user_api):
+    response = client.post(u"/login", json={u"email": u"admin", u"password": u"1234"})
+    assert response.status_code == 200
+    assert response.json() == {u"id": 1, u"exp": 4102444800}
+    assert response.cookies[u"user-api-credentials"].strip(u"\"") == base64.b64encode(b"TOKEN").decode()
+    mock_user_api.authenticate.assert_awaited_once_with(email=u"admin", password=u"1234")
+
+
+def test_token_decoded_once_per_request(client, mock_user_api):
+    # has_roles, then the route reads the customer ID.
+    response = client.get(u"/", headers={u"Authorization": u"Bearer TOKEN"})
+    assert response.status_code == 200
+    mock_user_api.get_token_data.assert_awaited_once_with(u"TOKEN")
+    mock_user_api.token_has_roles.assert_called_once_with(
+        token=TOKEN_DATA,
+        roles=frozenset([u"admin"]),
+        any_of=False
+    )
+    mock_user_api.list_users.assert_awaited_once()
+
+
+def test_token_route_reads_cookie(client, mock_user_api):
+    client.cookies.set(u"user-api-credentials", base64.b64encode(b"TOKEN").decode())
+    response = client.get(u"/token")
+    assert response.json() == TOKEN_DATA
+    mock_user_api.get_token_data.assert_awaited_once_with(b"TOKEN")
+
+
+def test_is_connected_checks_token(client, mock_user_api):
+    mock_user_api.get_token_data = AsyncMock(return_value=None)
+    assert client.get(u"/token", headers={u"Authorization": u"Bearer TOKEN"}).status_code == 401
+    assert client.get(u"/token", headers={u"Authorization": u"TOKEN"}).status_code == 401
+    assert client.get(u"/token").status_code == 401
+
+
+def test_has_roles_forbidden(client, mock_user_api):
+    mock_user_api.token_has_roles = Mock(side_effect=ApiForbidden(u"You don't have the admin role(s)."))
+    response = client.get(u"/", headers={u"Authorization": u"Bearer TOKEN"})
+    assert response.status_code == 403
+    assert response.json()[u"message"] == u"You don't have the admin role(s)."
+    mock_user_api.list_users.assert_not_awaited()
+
+
+def test_logout_clears_cookie(client, mock_user_api):
+    response = client.get(u"/logout", headers={u"Authorization": u"Bearer TOKEN"})
+    assert response.status_code == 200
+    assert u"user-api-credentials=\"\";" in response.headers[u"set-cookie"]
+    mock_user_api.logout.assert_awaited_once_with(TOKEN_DATA)
+
+
+def test_export_streams_ndjson(client, mock_user_api):
+    async def iter_users(customer_id, **kwargs):
+        for user_id in range(3):
+            yield {u"id": user_id}
+
+    mock_user_api.iter_users = Mock(side_effect=iter_users)
+    response = client.get(u"/export", headers={u"Authorization": u"Bearer TOKEN"})
+    assert response.status_code == 200
+    assert response.text == u'{"id": 0}\n{"id": 1}\n{"id": 2}\n'
@@ -0,0 +1,84 @@
+# coding: utf-8
+
+import asyncio
+import pytest
+from pytest import fixture
+from user_api.helpers import create_async_user_api
+from user_api.db.models import Base, Customer, Role
+from user_api.user_api_exception import ApiConflict, ApiUnauthorized
+
+
+@fixture(scope=u"module")
+def async_user_api(tmpdir_factory):
+    db_path = tmpdir_factory.mktemp(u"async").join(u"user_api.db")
+    user_api = create_async_user_api(
+        u"sqlite+aiosqlite:///{}".format(db_path),
+        jwt_secret=u"SECRET",
+        hash_workers=1,
+        hash_iterations=1000
+    )
+
+    async def init_db():
+        async with user_api._session_registry.async_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        await user_api._session_registry.run(add_fixtures, user_api._session_registry)
+
+    asyncio.run(init_db())
+    yield user_api
+    user_api.get_user_api()._auth_manager._hash_executor.shutdown()
+
+
+def add_fixtures(session_registry):
+    with session_registry.session_scope() as session:
+        session.add(Customer(id=1))
+        session.add(Role(id=1, code=u"admin", name=u"Admin"))
+        session.commit()
+
+
+def test_register_and_authenticate(async_user_api):
+    async def scenario():
+        user = await async_user_api.register(1, {
+            u"email": u"dumb@laposte.net",
+            u"name": u"Dummer",
+            u"active": True,
+            u"password": u"1234",
+            u"roles": [{u"id": 1}]
+        })
+        with pytest.raises(ApiConflict):
+            await async_user_api.register(1, {
+                u"email": u"dumb@laposte.net",
+                u"name": u"Dummer",
+                u"active": True,
+                u"password": u"1234",
+                u"roles": []
+            })
+        # Concurrent logins share the loop.
+        results = await asyncio.gather(*[
+            async_user_api.authenticate(u"dumb@laposte.net", u"1234") for _ in range(5)
+        ])
+        with pytest.raises(ApiUnauthorized):
+            await async_user_api.authenticate(u"dumb@laposte.net", u"4321")
+        return user, results
+
+    user, results = asyncio.run(scenario())
+    assert user[u"roles"] == [{u"id": 1, u"code": u"admin", u"name": u"Admin"}]
+    token_payload, token = results[0]
+    assert token_payload[u"id"] == user[u"id"]
+    token_data = asyncio.run(async_user_api.get_token_data(token))
+    assert token_data[u"email"] == u"dumb@laposte.net"
+    assert async_user_api.token_has_roles(token_data, [u"admin"])
+
+
+def test_list_and_iter_users(async_user_api):
+    async def scenario():
+        await async_user_api.register_many(1, [
+            {u"email": u"user{}@laposte.net".format(index), u"name": u"User", u"password": u"1234"}
+            for index in range(3)
+        ])
+        page = await async_user_api.list_users(1, limit=2, email=u"user")
+        users = [user async for user in async_user_api.iter_users(1, email=u"user", with_roles=True)]
+        return page, users
+
+    page, users = asyncio.run(scenario())
+    assert page[u"has_next"]
+    assert [user[u"email"] for user in users] == [u"user{}@laposte.net".format(index) for index in range(3)]
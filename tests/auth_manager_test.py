@@ -0,0 +1,192 @@
+# coding: utf-8
+
+import time
+import timeit
+import jwt
+import mock
+import pytest
+import binascii
+import Crypto.Protocol.KDF
+from pytest import fixture
+from user_api.auth.auth_manager import AuthManager, compute_hash, LEGACY_HASH_PARAMETERS
+from user_api.auth.hash_executor import HashExecutor
+from user_api.auth.auth_exception import AuthHashQueueFull, AuthHashTimeout
+from user_api.auth.key_ring import ALGORITHMS, KeyRing
+from user_api.cache import MemoryCache
+
+
+def slow_hash(password, salt):
+    time.sleep(0.5)
+    return compute_hash(password, salt, *LEGACY_HASH_PARAMETERS)
+
+
+@fixture(scope=u"module")
+def hash_executor():
+    executor = HashExecutor(max_workers=1, max_queue_depth=0, timeout=5)
+    yield executor
+    executor.shutdown()
+
+
+@fixture(scope=u"function")
+def auth_manager():
+    return AuthManager(jwt_secret=u"SECRET", jwt_lifetime=3600)
+
+
+def test_generate_hash_in_executor(auth_manager, hash_executor):
+    pooled_auth_manager = AuthManager(u"SECRET", 3600, hash_executor=hash_executor)
+    assert pooled_auth_manager.generate_hash(u"1234", u"SALT") == auth_manager.generate_hash(u"1234", u"SALT")
+
+
+def test_generate_hashes_in_executor(auth_manager, hash_executor):
+    pooled_auth_manager = AuthManager(u"SECRET", 3600, hash_executor=hash_executor)
+    hashes = pooled_auth_manager.generate_hashes([u"1234", u"5678"], [u"SALT", u"SALT"])
+    assert hashes == [auth_manager.generate_hash(u"1234", u"SALT"), auth_manager.generate_hash(u"5678", u"SALT")]
+    assert auth_manager.generate_hashes([u"1234", u"5678"], [u"SALT", u"SALT"]) == hashes
+
+
+def test_generate_hash_async_without_executor(auth_manager):
+    future = auth_manager.generate_hash_async(u"1234", u"SALT")
+    assert future.done()
+    assert future.result() == auth_manager.generate_hash(u"1234", u"SALT")
+
+
+@fixture(scope=u"function")
+def strong_auth_manager():
+    return AuthManager(u"SECRET", 3600, hash_algorithm=u"pbkdf2_sha256", hash_iterations=2000, hash_length=32)
+
+
+def test_generate_hash_records_parameters(auth_manager, strong_auth_manager):
+    assert auth_manager.generate_hash(u"1234", u"SALT").startswith(u"pbkdf2_sha1$1000$16$")
+    hash = strong_auth_manager.generate_hash(u"1234", u"SALT")
+    assert hash.startswith(u"pbkdf2_sha256$2000$32$")
+    assert auth_manager.verify_hash(u"1234", u"SALT", hash)
+    assert not auth_manager.verify_hash(u"4321", u"SALT", hash)
+    assert not strong_auth_manager.needs_rehash(hash)
+
+
+def test_verify_legacy_hash(auth_manager, strong_auth_manager):
+    legacy_hash = binascii.hexlify(Crypto.Protocol.KDF.PBKDF2(u"1234", u"SALT")).decode()
+    assert auth_manager.verify_hash(u"1234", u"SALT", legacy_hash)
+    assert not auth_manager.verify_hash(u"4321", u"SALT", legacy_hash)
+    # The default parameters are the legacy ones.
+    assert not auth_manager.needs_rehash(legacy_hash)
+    assert strong_auth_manager.needs_rehash(legacy_hash)
+
+
+def test_needs_rehash_on_parameters_change(auth_manager, strong_auth_manager):
+    hash = auth_manager.generate_hash(u"1234", u"SALT")
+    assert strong_auth_manager.needs_rehash(hash)
+    assert strong_auth_manager.verify_hash(u"1234", u"SALT", hash)
+
+
+@pytest.mark.parametrize(u"saved_hash", [u"pbkdf2_md5$1000$16$abcd", u"pbkdf2_sha1$many$16$abcd", u"a$b"])
+def test_malformed_hash_fails_check(auth_manager, saved_hash):
+    assert not auth_manager.verify_hash(u"1234", u"SALT", saved_hash)
+    assert not auth_manager.needs_rehash(saved_hash)
+
+
+def test_hash_executor_queue_full(hash_executor):
+    future = hash_executor.submit(slow_hash, u"1234", u"SALT")
+    with pytest.raises(AuthHashQueueFull):
+        hash_executor.submit(slow_hash, u"1234", u"SALT")
+    assert hash_executor.result(future) == compute_hash(u"1234", u"SALT", *LEGACY_HASH_PARAMETERS)
+
+
+def test_hash_executor_timeout():
+    executor = HashExecutor(max_workers=1, timeout=0.01)
+    try:
+        with pytest.raises(AuthHashTimeout):
+            executor.result(executor.submit(slow_hash, u"1234", u"SALT"))
+    finally:
+        executor.shutdown()
+
+
+def test_token_cache_skips_verification():
+    auth_manager = AuthManager(u"SECRET", 3600, token_cache=MemoryCache())
+    token = auth_manager.generate_token({u"id": 1})
+    assert auth_manager.get_token_data(token)[u"id"] == 1
+    with mock.patch(u"jwt.decode", side_effect=AssertionError):
+        assert auth_manager.get_token_data(token)[u"id"] == 1
+    assert auth_manager.get_token_data(token + b"x") is None
+
+
+def test_token_cache_returns_copies():
+    auth_manager = AuthManager(u"SECRET", 3600, token_cache=MemoryCache())
+    token = auth_manager.generate_token({u"id": 1, u"roles": [{u"id": 1, u"code": u"admin"}]})
+    claims = auth_manager.get_token_data(token)
+    claims[u"roles"].append({u"id": 2, u"code": u"auditor"})
+    claims[u"roles"][0][u"code"] = u"auditor"
+    cached_claims = auth_manager.get_token_data(token)
+    assert cached_claims[u"roles"] == [{u"id": 1, u"code": u"admin"}]
+    cached_claims[u"roles"].clear()
+    assert auth_manager.get_token_data(token)[u"roles"] == [{u"id": 1, u"code": u"admin"}]
+
+
+def test_token_cache_hit_cheaper_than_decode():
+    auth_manager = AuthManager(u"SECRET", 3600, token_cache=MemoryCache())
+    token = auth_manager.generate_token({
+        u"id": 1,
+        u"customer": {u"id": 1},
+        u"roles": [{u"id": role_id, u"code": u"role{}".format(role_id), u"name": u"Role"} for role_id in range(10)]
+    })
+    auth_manager.get_token_data(token)
+    hit_time = min(timeit.repeat(lambda: auth_manager.get_token_data(token), number=200, repeat=5))
+    decode_time = min(timeit.repeat(
+        lambda: jwt.decode(token, u"SECRET", algorithms=[u"HS256"]), number=200, repeat=5
+    ))
+    assert hit_time < decode_time / 2
+
+
+@pytest.mark.parametrize(u"algorithm", [
+    u"RS256",
+    pytest.param(u"EdDSA", marks=pytest.mark.skipif(
+        u"EdDSA" not in ALGORITHMS, reason=u"Ed25519 requires pycryptodome >= 3.15"
+    ))
+])
+def test_key_ring_signs_with_kid(algorithm):
+    key_ring = KeyRing()
+    key = key_ring.generate_key(algorithm)
+    auth_manager = AuthManager(None, 3600, key_ring=key_ring)
+    token = auth_manager.generate_token({u"id": 1})
+    assert jwt.get_unverified_header(token) == {u"typ": u"JWT", u"alg": algorithm, u"kid": key.kid}
+    assert auth_manager.get_token_data(token)[u"id"] == 1
+    assert auth_manager.get_token_data(token[:-4] + b"AAAA") is None
+    assert auth_manager.get_jwks() == {u"keys": [key.to_jwk()]}
+
+
+def test_token_cache_rejects_retired_key():
+    key_ring = KeyRing()
+    key = key_ring.generate_key(u"RS256")
+    auth_manager = AuthManager(None, 3600, key_ring=key_ring, token_cache=MemoryCache())
+    token = auth_manager.generate_token({u"id": 1})
+    assert auth_manager.get_token_data(token)[u"id"] == 1
+    # Compromised key: its cached tokens are rejected too.
+    key_ring.retire_key(key.kid)
+    assert auth_manager.get_token_data(token) is None
+
+
+def test_key_ring_rotation():
+    key_ring = KeyRing()
+    old_key = key_ring.generate_key(u"RS256")
+    new_key = key_ring.generate_key(u"RS256", not_before=time.time() + 60)
+    auth_manager = AuthManager(None, 3600, key_ring=key_ring)
+    old_token = auth_manager.generate_token({u"id": 1})
+    assert jwt.get_unverified_header(old_token)[u"kid"] == old_key.kid
+
+    new_key.not_before = time.time()
+    new_token = auth_manager.generate_token({u"id": 1})
+    assert jwt.get_unverified_header(new_token)[u"kid"] == new_key.kid
+    assert auth_manager.get_token_data(old_token)[u"id"] == 1
+
+    key_ring.retire_key(old_key.kid)
+    assert auth_manager.get_token_data(old_token) is None
+    assert auth_manager.get_token_data(new_token)[u"id"] == 1
+    assert [jwk[u"kid"] for jwk in auth_manager.get_jwks()[u"keys"]] == [new_key.kid]
+
+
+def test_key_ring_rejects_shared_secret_tokens(auth_manager):
+    key_ring = KeyRing()
+    key_ring.generate_key(u"RS256")
+    ring_auth_manager = AuthManager(u"SECRET", 3600, key_ring=key_ring)
+    assert ring_auth_manager.get_token_data(auth_manager.generate_token({u"id": 1})) is None
+    assert auth_manager.get_jwks() is None
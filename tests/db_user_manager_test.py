@@ -0,0 +1,473 @@
+# coding: utf-8
+
+import time
+import pytest
+from pytest import fixture
+from sqlalchemy import event, exc
+from user_api.db.models import Base, Customer, Role, User
+from user_api.db.db_user_manager import DBUserManager
+from user_api.db.db_role_manager import DBRoleManager
+from user_api.db.db_session_registry import DBSessionRegistry
+from user_api.db.role_catalogue import RoleCatalogue
+from user_api.db.revocation_list import RevocationList
+from user_api.db.db_token_manager import DBTokenManager
+from user_api.db.db_exception import DBRoleNotFound, DBTokenNotFound, DBUserNotFound
+from user_api.cache import MemoryCache
+from user_api.db import migrations
+from user_api.db.migrations import upgrade_schema, get_schema_version, SCHEMA_VERSION
+
+
+@fixture(scope=u"function")
+def session_registry():
+    registry = DBSessionRegistry(u"sqlite://")
+    Base.metadata.create_all(bind=registry.engine)
+    session = registry.create_session()
+    session.add(Customer(id=1))
+    session.add(Customer(id=2))
+    session.add(Role(id=1, code=u"admin", name=u"Admin"))
+    session.add(Role(id=2, code=u"auditor", name=u"Auditor"))
+    session.commit()
+    session.close()
+    return registry
+
+
+@fixture(scope=u"function")
+def role_catalogue(session_registry):
+    return RoleCatalogue(session_registry)
+
+
+@fixture(scope=u"function")
+def db_user_manager(session_registry, role_catalogue):
+    return DBUserManager(session_registry=session_registry, role_catalogue=role_catalogue)
+
+
+@fixture(scope=u"function")
+def db_role_manager(session_registry, role_catalogue):
+    return DBRoleManager(session_registry=session_registry, role_catalogue=role_catalogue)
+
+
+@fixture(scope=u"function")
+def saved_user(db_user_manager):
+    return db_user_manager.save_new_user(
+        email=u"dumb@laposte.net",
+        name=u"Dummer",
+        active=True,
+        hash=u"HASH",
+        salt=u"SALT",
+        roles=[{u"id": 1}],
+        customer_id=1
+    )
+
+
+def test_save_new_user(saved_user):
+    assert saved_user[u"email"] == u"dumb@laposte.net"
+    assert saved_user[u"customer"] == {u"id": 1}
+    assert saved_user[u"roles"] == [{u"id": 1, u"code": u"admin", u"name": u"Admin"}]
+
+
+def test_get_user_information_not_found(db_user_manager):
+    with pytest.raises(DBUserNotFound):
+        db_user_manager.get_user_information(42)
+
+
+def test_session_scope_is_released(session_registry, db_user_manager, saved_user):
+    checked_out = []
+    event.listen(session_registry.engine, u"checkout", lambda *args: checked_out.append(1))
+    event.listen(session_registry.engine, u"checkin", lambda *args: checked_out.pop())
+    db_user_manager.get_user_information(saved_user[u"id"])
+    db_user_manager.get_user_salt(saved_user[u"email"])
+    assert checked_out == []
+
+
+def test_session_scope_is_shared(session_registry, db_user_manager, db_role_manager, saved_user):
+    with session_registry.session_scope() as session:
+        db_user_manager.get_user_information(saved_user[u"id"])
+        with db_role_manager.session_scope() as nested_session:
+            assert nested_session is session
+    # Released once the outer scope is closed.
+    with session_registry.session_scope() as session_after:
+        assert session_after is not session
+
+
+def test_close_scope_rolls_back(session_registry, db_user_manager, saved_user):
+    session_registry.open_scope()
+    with db_user_manager.session_scope() as session:
+        session.execute(u"UPDATE _user SET name = 'Changed'")
+    session_registry.close_scope(ValueError())
+    assert db_user_manager.get_user_information(saved_user[u"id"])[u"name"] == u"Dummer"
+
+
+def test_get_user_credentials_single_query(session_registry, db_user_manager, saved_user):
+    statements = []
+    event.listen(
+        session_registry.engine,
+        u"before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+    user, salt, hash = db_user_manager.get_user_credentials(saved_user[u"email"])
+    assert len(statements) == 1
+    assert user == saved_user
+    assert (salt, hash) == (u"SALT", u"HASH")
+
+
+def add_users(db_user_manager, count, customer_id=1, prefix=u"user"):
+    return [
+        db_user_manager.save_new_user(
+            email=u"{}{}@laposte.net".format(prefix, index),
+            name=u"{} {}".format(prefix, index),
+            active=True,
+            hash=u"HASH",
+            salt=u"SALT",
+            roles=[],
+            customer_id=customer_id
+        )
+        for index in range(count)
+    ]
+
+
+def test_list_users_after_id(db_user_manager):
+    users = add_users(db_user_manager, 3)
+    page, has_next = db_user_manager.list_users(1, limit=2)
+    assert [user[u"id"] for user in page] == [users[0][u"id"], users[1][u"id"]]
+    assert has_next
+    page, has_next = db_user_manager.list_users(1, limit=2, after_id=users[1][u"id"])
+    assert [user[u"id"] for user in page] == [users[2][u"id"]]
+    assert not has_next
+
+
+def test_list_users_single_query(session_registry, db_user_manager):
+    add_users(db_user_manager, 3)
+    statements = []
+    event.listen(
+        session_registry.engine,
+        u"before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+    page, has_next = db_user_manager.list_users(1, limit=2)
+    assert len(page) == 2
+    assert has_next
+    assert len(statements) == 1
+
+
+def test_count_users_cache(session_registry):
+    db_user_manager = DBUserManager(session_registry=session_registry, count_cache=MemoryCache())
+    add_users(db_user_manager, 3)
+    assert db_user_manager.count_users(1) == 3
+    add_users(db_user_manager, 1, prefix=u"other")
+    assert db_user_manager.count_users(1) == 3
+    assert db_user_manager.count_users(2) == 0
+
+
+def test_list_users_filters_stay_in_customer(db_user_manager):
+    users = add_users(db_user_manager, 2)
+    add_users(db_user_manager, 2, customer_id=2, prefix=u"other")
+    page, _ = db_user_manager.list_users(1, email=u"other")
+    assert page == []
+    page, _ = db_user_manager.list_users(1, email=u"user1", name=u"nobody")
+    assert [user[u"id"] for user in page] == [users[1][u"id"]]
+
+
+def test_list_users_match_modes(db_user_manager):
+    users = add_users(db_user_manager, 2)
+    page, _ = db_user_manager.list_users(1, email=u"user", match=u"prefix")
+    assert len(page) == 2
+    page, _ = db_user_manager.list_users(1, email=u"laposte", match=u"prefix")
+    assert page == []
+    page, _ = db_user_manager.list_users(1, name=u"USER 0", match=u"search")
+    assert [user[u"id"] for user in page] == [users[0][u"id"]]
+    page, _ = db_user_manager.list_users(1, email=u"%", match=u"contains")
+    assert page == []
+
+
+def test_upgrade_schema(session_registry):
+    engine = session_registry.engine
+    assert upgrade_schema(engine)[-1] == SCHEMA_VERSION
+    assert upgrade_schema(engine) == []
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+
+
+def test_upgrade_schema_user_has_role_key():
+    registry = DBSessionRegistry(u"sqlite://")
+    with registry.engine.begin() as connection:
+        Base.metadata.create_all(bind=connection, tables=[Customer.__table__, User.__table__, Role.__table__])
+        connection.execute(u"CREATE TABLE user_has_role (user_id INTEGER, role_id INTEGER)")
+        connection.execute(u"INSERT INTO user_has_role VALUES (1, 1), (1, 1), (1, 2), (NULL, 2), (2, 2), (2, 2), (2, 2)")
+    upgrade_schema(registry.engine)
+    with registry.engine.connect() as connection:
+        assert connection.execute(
+            u"SELECT user_id, role_id FROM user_has_role ORDER BY user_id, role_id"
+        ).fetchall() == [(1, 1), (1, 2), (2, 2)]
+        assert connection.execute(u"SELECT name FROM sqlite_master WHERE name LIKE '%dedup%'").fetchall() == []
+        with pytest.raises(exc.IntegrityError):
+            connection.execute(u"INSERT INTO user_has_role VALUES (1, 1)")
+
+
+def test_upgrade_schema_user_has_role_key_rerun(monkeypatch):
+    registry = DBSessionRegistry(u"sqlite://")
+    with registry.engine.begin() as connection:
+        Base.metadata.create_all(bind=connection, tables=[Customer.__table__, User.__table__, Role.__table__])
+        connection.execute(u"CREATE TABLE user_has_role (user_id INTEGER, role_id INTEGER)")
+        connection.execute(u"INSERT INTO user_has_role VALUES (1, 1), (1, 1), (1, 2)")
+
+    def fail(connection):
+        raise RuntimeError(u"Interrupted.")
+
+    # A failure after the deduplication keeps the associations, and the upgrade can run again.
+    monkeypatch.setattr(migrations, u"MIGRATIONS", migrations.MIGRATIONS[:2] + [(u"1.3.0", fail)])
+    with pytest.raises(RuntimeError):
+        upgrade_schema(registry.engine)
+    with registry.engine.connect() as connection:
+        assert connection.execute(u"SELECT COUNT(*) FROM user_has_role").scalar() == 3
+    monkeypatch.undo()
+    upgrade_schema(registry.engine)
+    with registry.engine.connect() as connection:
+        assert connection.execute(
+            u"SELECT user_id, role_id FROM user_has_role ORDER BY user_id, role_id"
+        ).fetchall() == [(1, 1), (1, 2)]
+
+
+@fixture(scope=u"function")
+def cached_db_user_manager(session_registry):
+    return DBUserManager(session_registry=session_registry, user_cache=MemoryCache())
+
+
+def test_user_cache_read_through(cached_db_user_manager, saved_user):
+    user = cached_db_user_manager.get_user_information(saved_user[u"id"], with_roles=True)
+    user[u"name"] = u"Mutated"
+    assert cached_db_user_manager.get_user_information(saved_user[u"id"], with_roles=True) == saved_user
+    assert cached_db_user_manager.get_cache_stats()[u"users"] == {
+        u"hits": 1, u"misses": 1, u"evictions": 0, u"size": 1
+    }
+
+
+def test_user_cache_invalidated_on_update(cached_db_user_manager, saved_user):
+    cached_db_user_manager.get_user_information(saved_user[u"id"])
+    cached_db_user_manager.update_user_information(
+        saved_user[u"email"], u"New name", True, saved_user[u"id"]
+    )
+    assert cached_db_user_manager.get_user_information(saved_user[u"id"])[u"name"] == u"New name"
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(
+        engine,
+        u"before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+    return statements
+
+
+def test_role_catalogue_serves_roles(session_registry, role_catalogue, db_role_manager):
+    role_catalogue.load()
+    statements = count_statements(session_registry.engine)
+    assert db_role_manager.list_roles(limit=1) == ([{u"id": 1, u"code": u"admin", u"name": u"Admin"}], True)
+    assert db_role_manager.count_roles() == 2
+    assert role_catalogue.get_role_id(u"auditor") == 2
+    assert [role[u"id"] for role in db_role_manager.get_roles_by_codes([u"auditor", u"admin", u"ghost"])] == [1, 2]
+    assert statements == []
+
+
+def test_role_catalogue_reloads(session_registry, role_catalogue):
+    role_catalogue.load()
+    with session_registry.session_scope() as session:
+        session.add(Role(id=3, code=u"viewer", name=u"Viewer"))
+        session.commit()
+    assert role_catalogue.get_role(3) is None
+    role_catalogue.invalidate()
+    assert role_catalogue.get_role(3)[u"code"] == u"viewer"
+    assert role_catalogue.get_version() == 2
+
+
+def test_role_catalogue_miss_after_invalidate(session_registry, role_catalogue):
+    role_catalogue.load()
+    with session_registry.session_scope() as session:
+        session.add(Role(id=3, code=u"viewer", name=u"Viewer"))
+        session.commit()
+    # Invalidated by another thread between the lookup and the miss check.
+    role_catalogue.invalidate()
+    assert role_catalogue._reload_on_miss()
+    assert role_catalogue.get_role(3)[u"code"] == u"viewer"
+
+
+def test_save_and_update_user_roles(session_registry, db_user_manager, db_role_manager, saved_user):
+    user = db_user_manager.update_user_information(
+        saved_user[u"email"], saved_user[u"name"], True, saved_user[u"id"], roles=[{u"id": 2}, {u"id": 42}]
+    )
+    assert [role[u"id"] for role in user[u"roles"]] == [2]
+    assert db_role_manager.get_user_roles(saved_user[u"id"]) == [{u"id": 2, u"code": u"auditor", u"name": u"Auditor"}]
+
+
+def test_save_new_users(session_registry, db_user_manager, saved_user):
+    statements = count_statements(session_registry.engine)
+    users = [
+        {
+            u"email": email,
+            u"name": u"Imported",
+            u"active": True,
+            u"hash": u"HASH",
+            u"salt": u"SALT",
+            u"roles": [{u"id": 2}]
+        }
+        for email in [u"new1@laposte.net", saved_user[u"email"], u"new2@laposte.net", u"new1@laposte.net"]
+    ]
+    created, errors = db_user_manager.save_new_users(1, users)
+    assert [user[u"email"] for user in created] == [u"new1@laposte.net", u"new2@laposte.net"]
+    assert [index for index, _ in errors] == [1, 3]
+    assert len([statement for statement in statements if statement.startswith(u"INSERT")]) == 2
+    assert db_user_manager.get_user_information(created[1][u"id"], with_roles=True) == created[1]
+
+
+def test_iter_users_by_batches(session_registry, db_user_manager, saved_user):
+    users = add_users(db_user_manager, 4)
+    add_users(db_user_manager, 1, customer_id=2, prefix=u"other")
+    statements = count_statements(session_registry.engine)
+    exported = list(db_user_manager.iter_users(1, with_roles=True, batch_size=2))
+    assert [user[u"id"] for user in exported] == [saved_user[u"id"]] + [user[u"id"] for user in users]
+    assert exported[0][u"roles"] == saved_user[u"roles"]
+    # One users query and one roles query per batch.
+    assert len(statements) == 6
+
+
+def test_iter_users_releases_connection_between_batches(session_registry, db_user_manager, saved_user):
+    add_users(db_user_manager, 4)
+    checkins = []
+    event.listen(session_registry.engine, u"checkin", lambda *args: checkins.append(args))
+    # As in a request: one session bound for the whole export.
+    session_registry.open_scope()
+    try:
+        exported = db_user_manager.iter_users(1, batch_size=2)
+        next(exported)
+        assert len(checkins) == 1
+        assert len(list(exported)) == 4
+        assert len(checkins) == 3
+    finally:
+        session_registry.close_scope()
+
+
+def test_get_users_information(session_registry, cached_db_user_manager, saved_user):
+    users = add_users(cached_db_user_manager, 2)
+    other_user = add_users(cached_db_user_manager, 1, customer_id=2, prefix=u"other")[0]
+    cached_db_user_manager.get_user_information(users[0][u"id"], with_roles=True)
+    statements = count_statements(session_registry.engine)
+    found = cached_db_user_manager.get_users_information(
+        1, [saved_user[u"id"], users[0][u"id"], users[1][u"id"], other_user[u"id"], 42], with_roles=True
+    )
+    assert found == {
+        saved_user[u"id"]: saved_user,
+        users[0][u"id"]: users[0],
+        users[1][u"id"]: users[1]
+    }
+    # The cached user isn't read again: one users query, one roles query.
+    assert len(statements) == 2
+
+
+def test_assign_and_revoke_role(session_registry, db_user_manager, db_role_manager, saved_user):
+    users = add_users(db_user_manager, 2)
+    other_user = add_users(db_user_manager, 1, customer_id=2, prefix=u"other")[0]
+    user_ids = [saved_user[u"id"], users[0][u"id"], users[1][u"id"], other_user[u"id"]]
+    assert db_role_manager.assign_role(1, 1, user_ids) == 2
+    assert db_role_manager.assign_role(1, 1, user_ids) == 0
+    assert db_role_manager.get_user_roles(other_user[u"id"]) == []
+    assert db_role_manager.revoke_role(1, 1, user_ids) == 3
+    assert db_role_manager.get_user_roles(saved_user[u"id"]) == []
+    with pytest.raises(DBRoleNotFound):
+        db_role_manager.assign_role(1, 42, user_ids)
+
+
+def test_update_user_information_statements(session_registry, db_user_manager, saved_user):
+    statements = count_statements(session_registry.engine)
+    user = db_user_manager.update_user_information(
+        saved_user[u"email"], u"New name", True, saved_user[u"id"], roles=[{u"id": 1}]
+    )
+    # Read the user and their roles, then update: no role change, no re-read.
+    assert len(statements) == 2
+    assert user == dict(saved_user, name=u"New name")
+    assert db_user_manager.get_user_information(saved_user[u"id"], with_roles=True) == user
+
+
+def test_update_user_information_not_found(db_user_manager):
+    with pytest.raises(DBUserNotFound):
+        db_user_manager.update_user_information(u"dumb@laposte.net", u"Dummer", True, 42)
+
+
+def test_revocation_list(session_registry, saved_user):
+    revocation_list = RevocationList(session_registry, token_lifetime=3600, sync_interval=0)
+    other_worker = RevocationList(session_registry, token_lifetime=3600, sync_interval=3600)
+    user_id = saved_user[u"id"]
+    now = int(time.time())
+    token = {u"id": user_id, u"jti": u"JTI", u"iat": now - 10, u"exp": now + 3600}
+    assert not other_worker.is_revoked(token)
+
+    revocation_list.revoke_token(u"JTI", now + 3600)
+    revocation_list.revoke_user_tokens(42, issued_before=now - 5)
+    assert revocation_list.is_revoked(token)
+    # Checked in memory until the next sync.
+    statements = count_statements(session_registry.engine)
+    assert not other_worker.is_revoked(token)
+    assert statements == []
+
+    other_worker.sync()
+    assert other_worker.is_revoked(token)
+    assert other_worker.is_revoked({u"id": 42, u"iat": now - 10})
+    assert not other_worker.is_revoked({u"id": 42, u"iat": now - 4})
+    # Only the new entries are read.
+    other_worker.sync()
+    assert other_worker._last_id == 2
+
+
+def test_revocation_list_prune(session_registry):
+    revocation_list = RevocationList(session_registry, token_lifetime=3600)
+    now = int(time.time())
+    revocation_list.revoke_token(u"EXPIRED", now - 1)
+    revocation_list.revoke_token(u"JTI", now + 3600)
+    assert revocation_list.prune() == 1
+    revocation_list.sync(full=True)
+    assert not revocation_list.is_revoked({u"jti": u"EXPIRED"})
+    assert revocation_list.is_revoked({u"jti": u"JTI"})
+
+
+def test_rotate_refresh_token(session_registry, role_catalogue, saved_user):
+    db_token_manager = DBTokenManager(session_registry=session_registry, role_catalogue=role_catalogue)
+    now = int(time.time())
+    db_token_manager.save_refresh_token(saved_user[u"id"], u"HASH", now + 60)
+    db_token_manager.save_refresh_token(saved_user[u"id"], u"EXPIRED", now - 1)
+    role_catalogue.load()
+
+    statements = count_statements(session_registry.engine)
+    user = db_token_manager.rotate_refresh_token(u"HASH", u"NEW_HASH", now + 60)
+    # Read the user and roles, delete the used token, insert the new one.
+    assert len(statements) == 3
+    assert user == saved_user
+    with pytest.raises(DBTokenNotFound):
+        db_token_manager.rotate_refresh_token(u"HASH", u"OTHER_HASH", now + 60)
+    with pytest.raises(DBTokenNotFound):
+        db_token_manager.rotate_refresh_token(u"EXPIRED", u"OTHER_HASH", now + 60)
+
+    assert db_token_manager.delete_expired_refresh_tokens() == 1
+    assert db_token_manager.delete_user_refresh_tokens(saved_user[u"id"]) == 1
+
+
+def test_rotate_refresh_token_inactive_user(session_registry, role_catalogue, saved_user):
+    db_token_manager = DBTokenManager(session_registry=session_registry, role_catalogue=role_catalogue)
+    db_token_manager.save_refresh_token(saved_user[u"id"], u"HASH", int(time.time()) + 60)
+    with session_registry.session_scope() as session:
+        session.query(User).filter(User.id == saved_user[u"id"]).update({User.active: False})
+        session.commit()
+
+    with pytest.raises(DBTokenNotFound):
+        db_token_manager.rotate_refresh_token(u"HASH", u"NEW_HASH", int(time.time()) + 60)
+    # Nothing written: the token is still the only one.
+    assert db_token_manager.delete_user_refresh_tokens(saved_user[u"id"]) == 1
+
+
+def test_revocation_list_never_waits_for_sync(session_registry):
+    revocation_list = RevocationList(session_registry, token_lifetime=3600)
+    revocation_list.revoke_token(u"JTI", int(time.time()) + 3600)
+    # Another caller is reading: the current copy is served without waiting.
+    revocation_list._sync_lock.acquire()
+    statements = count_statements(session_registry.engine)
+    assert revocation_list.is_revoked({u"jti": u"JTI"})
+    assert not revocation_list.is_revoked({u"jti": u"OTHER"})
+    assert statements == []
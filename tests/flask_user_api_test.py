@@ -0,0 +1,84 @@
+# coding: utf-8
+
+import base64
+from mock import Mock
+from flask import Flask, g
+from pytest import fixture
+from user_api.adapter.flask import FlaskUserApi
+
+TOKEN_DATA = {
+    u"id": 1,
+    u"email": u"admin",
+    u"customer": {
+        u"id": 1
+    },
+    u"roles": [
+        {u"id": 1, u"code": u"admin", u"name": u"Admin"}
+    ]
+}
+
+
+@fixture(scope=u"function")
+def mock_user_api():
+    mock = Mock()
+    mock.get_token_data = Mock(return_value=TOKEN_DATA)
+    mock.token_has_roles = Mock(return_value=True)
+    mock.list_users = Mock(return_value={u"users": [], u"has_next": False})
+    return mock
+
+
+@fixture(scope=u"function")
+def app(mock_user_api):
+    flask_user_api = FlaskUserApi(mock_user_api)
+    app = Flask(__name__)
+    app.register_blueprint(flask_user_api.construct_user_api_blueprint(), url_prefix=u"/api/users")
+    return app
+
+
+@fixture(scope=u"function")
+def client(app):
+    return app.test_client()
+
+
+def test_token_decoded_once_per_request(client, mock_user_api):
+    # has_roles, then the route reads the customer ID.
+    response = client.get(u"/api/users/", headers={u"Authorization": u"Bearer TOKEN"})
+    assert response.status_code == 200
+    mock_user_api.get_token_data.assert_called_once_with(u"TOKEN")
+
+    # Resolved again by the next request.
+    client.get(u"/api/users/", headers={u"Authorization": u"Bearer TOKEN"})
+    assert mock_user_api.get_token_data.call_count == 2
+
+
+def test_token_route_reads_context(client, mock_user_api):
+    client.set_cookie(u"localhost", u"user-api-credentials", base64.b64encode(b"TOKEN").decode())
+    response = client.get(u"/api/users/token")
+    assert response.get_json() == TOKEN_DATA
+    mock_user_api.get_token_data.assert_called_once_with(b"TOKEN")
+    assert client.get(u"/api/users/token", headers={u"Authorization": u"Bearer OTHER"}).status_code == 200
+
+
+def test_is_connected_checks_token(client, mock_user_api):
+    mock_user_api.get_token_data = Mock(return_value=None)
+    assert client.get(u"/api/users/token", headers={u"Authorization": u"Bearer TOKEN"}).status_code == 401
+    assert client.get(u"/api/users/token").status_code == 401
+
+
+def test_logout_with_invalid_token_clears_cookie(client, mock_user_api):
+    mock_user_api.get_token_data = Mock(return_value=None)
+    client.set_cookie(u"localhost", u"user-api-credentials", base64.b64encode(b"EXPIRED").decode())
+    response = client.get(u"/api/users/logout")
+    assert response.status_code == 200
+    assert u"user-api-credentials=;" in response.headers[u"Set-Cookie"]
+    mock_user_api.logout.assert_not_called()
+
+
+def test_auth_context_cleared_on_teardown(app, mock_user_api):
+    client = app.test_client()
+    with app.app_context():
+        # The requests reuse the pushed app context (and so its g).
+        assert client.get(u"/api/users/token", headers={u"Authorization": u"Bearer TOKEN"}).status_code == 200
+        assert u"user_api_token" not in g
+        mock_user_api.get_token_data = Mock(return_value=None)
+        assert client.get(u"/api/users/token", headers={u"Authorization": u"Bearer OTHER"}).status_code == 401
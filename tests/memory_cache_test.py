@@ -0,0 +1,66 @@
+# coding: utf-8
+
+import time
+from user_api.cache import MemoryCache, RedisCache
+
+
+def test_lru_eviction():
+    cache = MemoryCache(max_size=2)
+    cache.set(1, u"one")
+    cache.set(2, u"two")
+    assert cache.get(1) == u"one"
+    cache.set(3, u"three")
+    assert cache.get(2) is None
+    assert cache.get(1) == u"one"
+    assert cache.get_stats() == {u"hits": 2, u"misses": 1, u"evictions": 1, u"size": 2}
+
+
+def test_expiration():
+    cache = MemoryCache(ttl=60)
+    cache.set(1, u"one", ttl=0.01)
+    cache.set(2, u"two")
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    assert cache.get(2) == u"two"
+
+
+def test_delete_and_clear():
+    cache = MemoryCache()
+    cache.set(1, u"one")
+    cache.set(2, u"two")
+    cache.delete(1)
+    assert cache.get(1) is None
+    cache.clear()
+    assert cache.get(2) is None
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.values) if key.startswith(match.rstrip(u"*"))]
+
+
+def test_redis_cache():
+    client = FakeRedis()
+    cache = RedisCache(client)
+    cache.set((u"user", 1, True), {u"id": 1})
+    assert client.values == {u"user_api:user:1:True": u'{"id": 1}'}
+    assert cache.get((u"user", 1, True)) == {u"id": 1}
+    cache.delete((u"user", 1, True))
+    assert cache.get((u"user", 1, True)) is None
+    cache.set(u"other", 2)
+    cache.clear()
+    assert client.values == {}
+    assert cache.get_stats() == {u"hits": 1, u"misses": 1}
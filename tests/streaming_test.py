@@ -0,0 +1,31 @@
+# coding: utf-8
+
+import asyncio
+from user_api.adapter.streaming import CsvChunks, NdjsonChunks, aiter_chunks, iter_chunks
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def as_async(items):
+    for item in items:
+        yield item
+
+
+def test_ndjson_chunks():
+    items = [{u"id": index} for index in range(5)]
+    chunks = list(iter_chunks(items, NdjsonChunks(chunk_size=2)))
+    assert chunks == [u'{"id": 0}\n{"id": 1}\n', u'{"id": 2}\n{"id": 3}\n', u'{"id": 4}\n']
+    # The async wrapper writes the same chunks.
+    assert asyncio.run(collect(aiter_chunks(as_async(items), NdjsonChunks(chunk_size=2)))) == chunks
+    assert list(iter_chunks([], NdjsonChunks())) == []
+
+
+def test_csv_chunks():
+    rows = [[index, u"user{}".format(index)] for index in range(4)]
+    chunks = list(iter_chunks(rows, CsvChunks([u"id", u"email"], chunk_size=2)))
+    assert chunks == [u"id,email\r\n0,user0\r\n1,user1\r\n", u"2,user2\r\n3,user3\r\n"]
+    assert asyncio.run(collect(aiter_chunks(as_async(rows), CsvChunks([u"id", u"email"], chunk_size=2)))) == chunks
+    # The header alone for an empty export.
+    assert list(iter_chunks([], CsvChunks([u"id", u"email"]))) == [u"id,email\r\n"]
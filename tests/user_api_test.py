@@ -3,23 +3,36 @@
 import calendar
 import datetime
 import pytest
+from contextlib import contextmanager
 from mock import Mock
 from pytest import fixture
-from user_api.user_api import UserApi
+from user_api.user_api import UserApi, MAX_BATCH_SIZE
 from user_api.user_api_exception import (
     ApiNotFound,
     ApiConflict,
+    ApiForbidden,
     ApiUnauthorized,
+    ApiServiceUnavailable,
     ApiUnprocessableEntity
 )
 from user_api.db.db_exception import (
+    DBRoleNotFound,
+    DBTokenNotFound,
     DBUserNotFound,
     DBUserConflict
 )
+from user_api.auth.auth_exception import AuthHashQueueFull
+from user_api.auth.auth_manager import AuthManager
 
 NOW = datetime.datetime.now()
 MOCK_EXPIRATION = int(calendar.timegm(NOW.utctimetuple()))
 
+
+@contextmanager
+def _yield(value):
+    yield value
+
+
 @fixture(scope=u"function")
 def mock_dummy_user():
     return {
@@ -36,8 +49,7 @@ def mock_dummy_user():
 @fixture(scope=u"function")
 def mock_db_user_manager(mock_dummy_user):
     mock = Mock()
-    mock.get_user_salt = Mock(return_value=u"SALT")
-    mock.is_user_hash_valid = Mock(return_value=True)
+    mock.get_user_credentials = Mock(return_value=(mock_dummy_user, u"SALT", u"HASH"))
     mock.get_user_information = Mock(return_value=mock_dummy_user)
     mock.modify_hash_salt = Mock(return_value=None)
     mock.save_new_user = Mock(return_value=mock_dummy_user)
@@ -55,6 +67,8 @@ def mock_auth_manager(mock_dummy_user):
     mock = Mock()
     mock.generate_salt = Mock(return_value=u"SALT")
     mock.generate_hash = Mock(return_value=u"HASH")
+    mock.verify_hash = Mock(return_value=True)
+    mock.needs_rehash = Mock(return_value=False)
     mock.generate_token = Mock(return_value=u"TOKEN")
     mock_dummy_user[u"exp"] = MOCK_EXPIRATION
     mock.get_token_data = Mock(return_value=mock_dummy_user)
@@ -84,8 +98,24 @@ def test_authenticate_user(stubbed_user_api, mock_dummy_user):
     assert token == token
 
 
+def test_authenticate_releases_connection_while_hashing(
+        mock_db_user_manager, mock_db_role_manager, mock_auth_manager, mock_dummy_user):
+    session = Mock()
+    session_registry = Mock()
+    session_registry.session_scope = Mock(side_effect=lambda: _yield(session))
+    mock_auth_manager.verify_hash = Mock(side_effect=lambda *args: session.commit.called)
+    mock_auth_manager.needs_rehash = Mock(return_value=True)
+    mock_auth_manager.generate_hash = Mock(side_effect=lambda *args: session_registry.session_scope.call_count == 1)
+    user_api = UserApi(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, session_registry=session_registry)
+
+    user_api.authenticate(mock_dummy_user[u"email"], u"PASSWORD")
+    # Read in a first scope, hashes out of any scope, rehash saved in a second one.
+    assert session_registry.session_scope.call_count == 2
+    mock_db_user_manager.modify_hash_salt.assert_called_once_with(mock_dummy_user[u"email"], True, u"SALT")
+
+
 def test_authenticate_user_not_found(stubbed_user_api, mock_dummy_user):
-    stubbed_user_api._db_user_manager.get_user_salt = Mock(side_effect=DBUserNotFound)
+    stubbed_user_api._db_user_manager.get_user_credentials = Mock(side_effect=DBUserNotFound)
     with pytest.raises(ApiNotFound):
         stubbed_user_api.authenticate(
             mock_dummy_user[u"email"],
@@ -94,7 +124,28 @@ def test_authenticate_user_not_found(stubbed_user_api, mock_dummy_user):
 
 
 def test_authenticate_invalid_token(stubbed_user_api, mock_dummy_user):
-    stubbed_user_api._db_user_manager.is_user_hash_valid = Mock(return_value=False)
+    stubbed_user_api._auth_manager.verify_hash = Mock(return_value=False)
+    with pytest.raises(ApiUnauthorized):
+        stubbed_user_api.authenticate(
+            mock_dummy_user[u"email"],
+            u"1234"
+        )
+
+
+def test_authenticate_rehash(stubbed_user_api, mock_dummy_user):
+    stubbed_user_api._auth_manager.needs_rehash = Mock(return_value=True)
+    stubbed_user_api.authenticate(
+        mock_dummy_user[u"email"],
+        u"1234"
+    )
+    stubbed_user_api._auth_manager.verify_hash.assert_called_once_with(u"1234", u"SALT", u"HASH")
+    stubbed_user_api._db_user_manager.modify_hash_salt.assert_called_once_with(
+        mock_dummy_user[u"email"], u"HASH", u"SALT"
+    )
+
+
+def test_authenticate_inactive_user(stubbed_user_api, mock_dummy_user):
+    mock_dummy_user[u"active"] = False
     with pytest.raises(ApiUnauthorized):
         stubbed_user_api.authenticate(
             mock_dummy_user[u"email"],
@@ -134,6 +185,18 @@ def test_register(stubbed_user_api, mock_dummy_user):
     assert user == mock_dummy_user
 
 
+def test_register_hash_queue_full(stubbed_user_api, mock_dummy_user):
+    stubbed_user_api._auth_manager.generate_hash = Mock(side_effect=AuthHashQueueFull)
+    with pytest.raises(ApiServiceUnavailable):
+        stubbed_user_api.register(1, {
+            u"email": mock_dummy_user[u"email"],
+            u"name": mock_dummy_user[u"name"],
+            u"active": True,
+            u"password": 1234,
+            u"roles": []
+        })
+
+
 def test_register_conflict(stubbed_user_api, mock_dummy_user):
     stubbed_user_api._db_user_manager.save_new_user = Mock(side_effect=DBUserConflict)
     with pytest.raises(ApiConflict):
@@ -146,6 +209,54 @@ def test_register_conflict(stubbed_user_api, mock_dummy_user):
         })
 
 
+def test_register_many(stubbed_user_api, mock_dummy_user):
+    stubbed_user_api._auth_manager.generate_hashes = Mock(side_effect=lambda passwords, salts: [u"HASH"] * len(passwords))
+    stubbed_user_api._db_user_manager.save_new_users = Mock(side_effect=[
+        ([mock_dummy_user], [(1, DBUserConflict())]),
+        ([mock_dummy_user], [])
+    ])
+    progress = []
+    report = stubbed_user_api.register_many(1, iter([
+        {u"email": u"a@laposte.net", u"name": u"A", u"password": u"1234"},
+        {u"email": u"b@laposte.net", u"name": u"B", u"password": u""},
+        {u"email": u"c@laposte.net", u"name": u"C", u"password": u"1234"},
+        {u"email": u"d@laposte.net", u"name": u"D", u"password": 1234},
+        ApiUnprocessableEntity(u"Line 6 is not valid JSON.", api_error_code=u"WRONG_ROW"),
+        {u"email": u"f@laposte.net", u"name": u"F", u"password": u"1234", u"roles": [{u"id": u"x"}]},
+        {u"email": u"g@laposte.net", u"name": u"G", u"password": u"1234"}
+    ]), chunk_size=3, progress_callback=lambda *args: progress.append(args))
+
+    assert report[u"created"] == 2
+    assert [(error[u"index"], error[u"email"], error[u"code"]) for error in report[u"errors"]] == [
+        (1, u"b@laposte.net", u"UNPROCESSABLE_ENTITY"),
+        (2, u"c@laposte.net", u"CONFLICT"),
+        (3, u"d@laposte.net", u"WRONG_PAYLOAD"),
+        (4, None, u"WRONG_ROW"),
+        (5, u"f@laposte.net", u"WRONG_PAYLOAD")
+    ]
+    assert report[u"errors"][2][u"payload"] == {u"password": [u"must be of string type"]}
+    # Only the valid users are hashed.
+    assert stubbed_user_api._auth_manager.generate_hashes.call_count == 2
+    assert progress == [(3, 1, 2), (6, 1, 5), (7, 2, 5)]
+
+
+def test_get_users_information_batch_too_large(stubbed_user_api):
+    with pytest.raises(ApiUnprocessableEntity):
+        stubbed_user_api.get_users_information(1, list(range(MAX_BATCH_SIZE + 1)))
+
+
+def test_assign_role_invalidates_profiles(stubbed_user_api):
+    stubbed_user_api._db_role_manager.assign_role = Mock(return_value=2)
+    assert stubbed_user_api.assign_role(1, 2, [3, 4]) == {u"assigned": 2}
+    stubbed_user_api._db_user_manager.invalidate_users.assert_called_once_with([3, 4])
+
+
+def test_revoke_role_not_found(stubbed_user_api):
+    stubbed_user_api._db_role_manager.revoke_role = Mock(side_effect=DBRoleNotFound)
+    with pytest.raises(ApiNotFound):
+        stubbed_user_api.revoke_role(1, 42, [3])
+
+
 def test_get_token_data(stubbed_user_api, mock_dummy_user):
     data = stubbed_user_api.get_token_data(u"TOKEN")
     mock_dummy_user.update({
@@ -154,6 +265,92 @@ def test_get_token_data(stubbed_user_api, mock_dummy_user):
     assert data == mock_dummy_user
 
 
+@pytest.mark.parametrize(u"claims_profile", [u"codes", u"bitmask"])
+def test_compact_claims(mock_db_user_manager, mock_db_role_manager, mock_dummy_user, claims_profile):
+    roles = [{u"id": 1, u"code": u"admin", u"name": u"Admin"}, {u"id": 70, u"code": u"user", u"name": u"User"}]
+    mock_db_role_manager.get_user_roles = Mock(return_value=roles)
+    mock_db_role_manager.get_roles = Mock(return_value=roles)
+    mock_db_role_manager.get_roles_by_codes = Mock(return_value=roles)
+    auth_manager = AuthManager(u"SECRET", 3600)
+    user_api = UserApi(mock_db_user_manager, mock_db_role_manager, auth_manager, claims_profile=claims_profile)
+
+    payload, token = user_api.authenticate_no_password(mock_dummy_user[u"email"])
+    claims = auth_manager.get_token_data(token)
+    assert u"roles" not in claims and u"name" not in claims
+    assert claims[u"exp"] == payload[u"exp"]
+
+    token_data = user_api.get_token_data(token)
+    assert token_data == {
+        u"id": 3,
+        u"email": u"dumb@laposte.net",
+        u"customer": {u"id": 1},
+        u"roles": roles,
+        u"iat": claims[u"iat"],
+        u"exp": payload[u"exp"],
+        u"jti": claims[u"jti"]
+    }
+    if claims_profile == u"codes":
+        mock_db_role_manager.get_roles_by_codes.assert_called_once_with([u"admin", u"user"])
+    else:
+        # The bits are the role IDs, not ranks which change when a role is deleted.
+        assert claims[u"rm"] == format(1 << 1 | 1 << 70, u"x")
+        assert list(mock_db_role_manager.get_roles.call_args[0][0]) == [1, 70]
+
+
+def test_unknown_claims_profile(mock_db_user_manager, mock_db_role_manager, mock_auth_manager):
+    with pytest.raises(ValueError):
+        UserApi(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, claims_profile=u"tiny")
+
+
+def test_logout_revokes_token(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, mock_dummy_user):
+    revocation_list = Mock()
+    revocation_list.is_revoked = Mock(return_value=True)
+    user_api = UserApi(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, revocation_list=revocation_list)
+    user_api.logout({u"id": 3, u"jti": u"JTI", u"exp": MOCK_EXPIRATION})
+    revocation_list.revoke_token.assert_called_once_with(u"JTI", MOCK_EXPIRATION)
+    assert user_api.get_token_data(u"TOKEN") is None
+    assert not user_api.is_token_valid(u"TOKEN")
+
+
+def test_deactivation_revokes_tokens(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, mock_dummy_user):
+    revocation_list = Mock()
+    mock_db_user_manager.update_user_information = Mock(return_value=dict(mock_dummy_user, active=False))
+    user_api = UserApi(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, revocation_list=revocation_list)
+    user_api.update(1, 3, dict(mock_dummy_user, active=False))
+    revocation_list.revoke_user_tokens.assert_called_once_with(3)
+
+    # Editing an already inactive user revokes nothing more.
+    mock_db_user_manager.get_user_information = Mock(return_value=dict(mock_dummy_user, active=False))
+    user_api.update(1, 3, dict(mock_dummy_user, active=False, name=u"Other"))
+    revocation_list.revoke_user_tokens.assert_called_once_with(3)
+
+
+def test_refresh(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, mock_dummy_user):
+    db_token_manager = Mock()
+    db_token_manager.rotate_refresh_token = Mock(return_value=dict(mock_dummy_user))
+    mock_auth_manager.generate_refresh_token = Mock(side_effect=[u"REFRESH", u"NEW_REFRESH", u"LAST_REFRESH"])
+    mock_auth_manager.hash_refresh_token = Mock(side_effect=lambda token: u"#" + token)
+    user_api = UserApi(mock_db_user_manager, mock_db_role_manager, mock_auth_manager, db_token_manager=db_token_manager)
+
+    payload, _ = user_api.authenticate(mock_dummy_user[u"email"], u"PASSWORD")
+    assert payload[u"refresh_token"] == u"REFRESH"
+    assert db_token_manager.save_refresh_token.call_args[0][:2] == (3, u"#REFRESH")
+
+    payload, token = user_api.refresh(u"REFRESH")
+    assert (payload[u"refresh_token"], token) == (u"NEW_REFRESH", u"TOKEN")
+    assert db_token_manager.rotate_refresh_token.call_args[0][:2] == (u"#REFRESH", u"#NEW_REFRESH")
+    mock_auth_manager.verify_hash.assert_called_once()
+
+    db_token_manager.rotate_refresh_token = Mock(side_effect=DBTokenNotFound)
+    with pytest.raises(ApiUnauthorized):
+        user_api.refresh(u"REFRESH")
+
+
+def test_refresh_disabled(stubbed_user_api):
+    with pytest.raises(ApiNotFound):
+        stubbed_user_api.refresh(u"REFRESH")
+
+
 def test_is_token_valid(stubbed_user_api):
     assert stubbed_user_api.is_token_valid(u"TOKEN")
     stubbed_user_api._auth_manager.is_token_valid.assert_called_once_with(u"TOKEN")
@@ -167,7 +364,46 @@ def test_list_users(stubbed_user_api, mock_dummy_user):
         u"has_next": False
     }
     stubbed_user_api._db_user_manager.list_users.assert_called_once_with(
-        1, 10, 5, u"dumb@laposte.net", u"Dummer"
+        1, 10, 5, u"dumb@laposte.net", u"Dummer", after_id=None, match=u"contains"
+    )
+
+
+def test_list_users_with_cursor(stubbed_user_api, mock_dummy_user):
+    stubbed_user_api._db_user_manager.list_users = Mock(return_value=([mock_dummy_user], True))
+    page = stubbed_user_api.list_users(1, 1)
+    assert page[u"has_next"]
+
+    stubbed_user_api.list_users(1, 1, cursor=page[u"next_cursor"])
+    stubbed_user_api._db_user_manager.list_users.assert_called_with(
+        1, 1, 0, None, None, after_id=mock_dummy_user[u"id"], match=u"contains"
     )
 
 
+def test_list_users_total_count(stubbed_user_api):
+    stubbed_user_api._db_user_manager.count_users = Mock(return_value=42)
+    assert stubbed_user_api.list_users(1, 10, total_count=True)[u"total_count"] == 42
+    stubbed_user_api._db_user_manager.count_users.assert_called_once_with(1, None, None, u"contains")
+
+
+def test_list_users_wrong_match(stubbed_user_api):
+    with pytest.raises(ApiUnprocessableEntity):
+        stubbed_user_api.list_users(1, 10, email=u"dumb", match=u"regex")
+
+
+def test_list_users_wrong_cursor(stubbed_user_api):
+    with pytest.raises(ApiUnprocessableEntity):
+        stubbed_user_api.list_users(1, 10, cursor=u"not a cursor")
+
+
+def test_token_has_roles(stubbed_user_api):
+    token = {u"roles": [{u"id": 1, u"code": u"admin", u"name": u"Admin"}]}
+    assert stubbed_user_api.token_has_roles(token, [u"admin"])
+    with pytest.raises(ApiForbidden):
+        stubbed_user_api.token_has_roles(token, [u"admin", u"auditor"])
+
+
+def test_token_has_any_role(stubbed_user_api):
+    token = {u"roles": [{u"id": 1, u"code": u"admin", u"name": u"Admin"}]}
+    assert stubbed_user_api.token_has_roles(token, frozenset([u"admin", u"auditor"]), any_of=True)
+    with pytest.raises(ApiForbidden):
+        stubbed_user_api.token_has_roles(token, [u"auditor"], any_of=True)
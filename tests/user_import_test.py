@@ -0,0 +1,52 @@
+# coding: utf-8
+
+import io
+from mock import Mock
+from pytest import fixture
+from user_api.user_api import UserApi
+from user_api.user_import import read_users_csv, read_users_jsonl
+
+
+@fixture(scope=u"function")
+def user_api():
+    auth_manager = Mock()
+    auth_manager.generate_salt = Mock(return_value=u"SALT")
+    auth_manager.generate_hashes = Mock(side_effect=lambda passwords, salts: [u"HASH"] * len(passwords))
+    db_user_manager = Mock()
+    db_user_manager.save_new_users = Mock(side_effect=lambda customer_id, users: (users, []))
+    return UserApi(db_user_manager, Mock(), auth_manager)
+
+
+def test_csv_wrong_row_is_reported(user_api):
+    stream = io.StringIO(
+        u"email,name,password,active,roles\n"
+        u"a@laposte.net,A,1234,true,1 2\n"
+        u"b@laposte.net,B,1234,true,admin\n"
+        u"c@laposte.net,C,1234,false,\n"
+    )
+    report = user_api.register_many(1, read_users_csv(stream))
+    assert report[u"created"] == 2
+    assert [(error[u"index"], error[u"email"], error[u"code"]) for error in report[u"errors"]] == [
+        (1, u"b@laposte.net", u"WRONG_PAYLOAD")
+    ]
+    saved = user_api._db_user_manager.save_new_users.call_args[0][1]
+    assert [(user[u"email"], user[u"active"], user[u"roles"]) for user in saved] == [
+        (u"a@laposte.net", True, [{u"id": 1}, {u"id": 2}]),
+        (u"c@laposte.net", False, [])
+    ]
+
+
+def test_jsonl_wrong_line_is_reported(user_api):
+    stream = io.StringIO(
+        u'{"email": "a@laposte.net", "name": "A", "password": "1234"}\n'
+        u'{"email": "b@laposte.net", "name": \n'
+        u'\n'
+        u'["c@laposte.net"]\n'
+        u'{"email": "d@laposte.net", "name": "D", "password": "1234", "roles": [{"id": 1}]}\n'
+    )
+    report = user_api.register_many(1, read_users_jsonl(stream))
+    assert report[u"created"] == 2
+    assert [(error[u"index"], error[u"code"], error[u"message"]) for error in report[u"errors"]] == [
+        (1, u"WRONG_ROW", u"Line 2 is not valid JSON."),
+        (2, u"WRONG_ROW", u"Line 4 is not a JSON object.")
+    ]
@@ -5,5 +5,6 @@ from .user_api_exception import (
     ApiForbidden,
     ApiNotFound,
     ApiRoleMissing,
+    ApiServiceUnavailable,
     ApiUnauthorized
 )
\ No newline at end of file
@@ -0,0 +1 @@
+from .asgi_user_api import AsgiUserApi
@@ -0,0 +1,144 @@
+# coding: utf-8
+
+import re
+import base64
+from functools import wraps
+from starlette.responses import RedirectResponse
+from user_api.user_api_exception import (
+    ApiUnauthorized
+)
+from .user_api_app import construct_user_api_app
+from .role_api_app import construct_role_api_app
+
+BEARER_TOKEN_REGEX = re.compile(u"Bearer (\\S+)")
+
+
+class AsgiUserApi(object):
+
+    def __init__(self, user_api):
+        """
+        Construct the object.
+        Args:
+            user_api (AsyncUserApi): Injected asyncio User API
+        """
+        self._user_api = user_api
+
+    @staticmethod
+    def get_request_token(request):
+        """
+        Read the token of a request, from the Authorization header or the credentials cookie.
+        Args:
+            request (Request): The request.
+
+        Returns:
+            (unicode|bytes): The token, None if there are no credentials.
+        """
+        if u"Authorization" in request.headers:
+            m = BEARER_TOKEN_REGEX.search(request.headers[u"Authorization"])
+            if m is None:
+                raise ApiUnauthorized(u"Invalid token.")
+            return m.group(1)
+        if u"user-api-credentials" in request.cookies:
+            return base64.b64decode(request.cookies[u"user-api-credentials"])
+        return None
+
+    async def check_token(self, request):
+        """
+        Verify the token of a request and return its claims. The token is decoded once per
+        request: the claims are kept in the request state.
+        Args:
+            request (Request): The request.
+
+        Returns:
+            (dict): The token claims.
+
+        Raises:
+            (ApiUnauthorized): If there is no valid token.
+        """
+        token_data = getattr(request.state, u"user_api_token", None)
+        if token_data is not None:
+            return token_data
+
+        token = self.get_request_token(request)
+        if token is None:
+            raise ApiUnauthorized()
+        token_data = await self._user_api.get_token_data(token)
+        if token_data is None:
+            raise ApiUnauthorized(u"Invalid token.")
+        request.state.user_api_token = token_data
+        return token_data
+
+    def is_connected(self, login_url=None, inject_token: bool = False):
+        """
+        Decorator checking the request has a valid token.
+        Args:
+            login_url (unicode): Where to redirect if there are no credentials (401 if None).
+            inject_token (boolean): Give the token claims to the endpoint (token kwarg).
+
+        Returns:
+            (callable): The decorator.
+        """
+        def decorator(funct):
+
+            @wraps(funct)
+            async def wrapper(request, **kwargs):
+                if login_url and self.get_request_token(request) is None:
+                    return RedirectResponse(login_url, 302)
+                token = await self.check_token(request)
+                if inject_token:
+                    kwargs[u"token"] = token
+                return await funct(request, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def has_roles(self, roles, inject_token: bool = False, inject_roles: bool = False, any_of: bool = False):
+        """
+        Decorator checking the token of the request has the roles.
+        Args:
+            roles (list of unicode): The role codes to check.
+            inject_token (boolean): Give the token claims to the endpoint (token kwarg).
+            inject_roles (boolean): Give the checked roles to the endpoint (roles kwarg).
+            any_of (boolean): Only require one of the roles instead of all of them.
+
+        Returns:
+            (callable): The decorator.
+        """
+        # Computed once, when the decorator is applied.
+        required_roles = frozenset(roles)
+
+        def decorator(funct):
+
+            @wraps(funct)
+            async def wrapper(request, **kwargs):
+                token = await self.check_token(request)
+                self._user_api.token_has_roles(token=token, roles=required_roles, any_of=any_of)
+                if inject_token:
+                    kwargs[u"token"] = token
+                if inject_roles:
+                    kwargs[u"roles"] = roles
+                return await funct(request, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def has_any_role(self, roles, inject_token: bool = False, inject_roles: bool = False):
+        """
+        Decorator checking the token of the request has at least one of the roles.
+        Args:
+            roles (list of unicode): The role codes to check.
+            inject_token (boolean): Give the token claims to the endpoint (token kwarg).
+            inject_roles (boolean): Give the checked roles to the endpoint (roles kwarg).
+
+        Returns:
+            (callable): The decorator.
+        """
+        return self.has_roles(roles, inject_token=inject_token, inject_roles=inject_roles, any_of=True)
+
+    def construct_user_api_app(self):
+        return construct_user_api_app(self)
+
+    def construct_role_api_app(self):
+        return construct_role_api_app(self)
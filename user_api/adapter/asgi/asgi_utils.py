@@ -0,0 +1,113 @@
+# coding: utf-8
+"""
+ASGI (Starlette) utils methods
+"""
+
+import json
+from cerberus import Validator
+from starlette.responses import JSONResponse
+from user_api.user_api_exception import ApiUnprocessableEntity
+from ..streaming import CsvChunks, NdjsonChunks, aiter_chunks
+
+
+def construct_response(item, code=200):
+    """
+    Construct Json response returned.
+    """
+    return JSONResponse(item, status_code=code)
+
+
+def api_error_handler(request, exception):
+    """
+    Construct the Json error returned for an ApiException.
+    Args:
+        request (Request): The request which failed.
+        exception (ApiException): The error.
+
+    Returns:
+        (JSONResponse): The error response.
+    """
+    payload = {
+        u"message": exception.message
+    }
+    if exception.payload:
+        payload[u"payload"] = exception.payload
+    if exception.api_error_code:
+        payload[u"error_code"] = exception.api_error_code
+    return JSONResponse(payload, status_code=exception.status_code)
+
+
+def check_args(request, validation_schema):
+    """
+    Validate the query string of a request.
+    Args:
+        request (Request): The request.
+        validation_schema (dict): The schema the args have to follow.
+
+    Returns:
+        (dict): The validated (and coerced) args.
+
+    Raises:
+        (ApiUnprocessableEntity): If the args are wrong.
+    """
+    validator = Validator(validation_schema)
+    if not validator.validate(dict(request.query_params)):
+        raise ApiUnprocessableEntity(u"Wrong args.", api_error_code=u"WRONG_ARGS", payload=validator.errors)
+    return validator.document
+
+
+async def check_payload(request, validation_schema):
+    """
+    Read and validate the Json payload of a request.
+    Args:
+        request (Request): The request.
+        validation_schema (dict): The schema the payload has to follow.
+
+    Returns:
+        (dict): The payload.
+
+    Raises:
+        (ApiUnprocessableEntity): If the payload is missing or wrong.
+    """
+    if u"application/json" not in request.headers.get(u"Content-Type", u""):
+        raise ApiUnprocessableEntity(u"The payload format is unknown.", api_error_code=u"WRONG_PAYLOAD_FORMAT")
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise ApiUnprocessableEntity(u"Wrong payload.", api_error_code=u"WRONG_PAYLOAD")
+
+    validator = Validator(validation_schema)
+    if not isinstance(payload, dict) or not validator.validate(payload):
+        raise ApiUnprocessableEntity(
+            u"The submitted document doesn't have the right format.",
+            api_error_code=u"WRONG_DOCUMENT_FORMAT",
+            payload=validator.errors if isinstance(payload, dict) else None
+        )
+    return payload
+
+
+def stream_ndjson(items, chunk_size=500):
+    """
+    Serialize items as JSON lines, chunk by chunk (to stream a response body).
+    Args:
+        items (async iterable of dict): The items to serialize.
+        chunk_size (int): How many items are written in each chunk.
+
+    Returns:
+        (async generator of unicode): The chunks.
+    """
+    return aiter_chunks(items, NdjsonChunks(chunk_size))
+
+
+def stream_csv(rows, header, chunk_size=500):
+    """
+    Serialize rows as CSV, chunk by chunk (to stream a response body).
+    Args:
+        rows (async iterable of list): The rows to serialize.
+        header (list of unicode): The column names, written first.
+        chunk_size (int): How many rows are written in each chunk.
+
+    Returns:
+        (async generator of unicode): The chunks.
+    """
+    return aiter_chunks(rows, CsvChunks(header, chunk_size))
@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+User API app (roles section, ASGI).
+"""
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from user_api.user_api_exception import ApiException
+from .asgi_utils import (
+    api_error_handler,
+    check_args,
+    check_payload,
+    construct_response
+)
+from ..schemas import LIST_ARGS_SCHEMA, USER_IDS_SCHEMA
+
+
+def construct_role_api_app(asgi_user_api):
+    user_api = asgi_user_api._user_api
+
+    @asgi_user_api.has_roles(roles=[u"admin"])
+    async def list_roles(request):
+        args = check_args(request, LIST_ARGS_SCHEMA)
+        return construct_response(await user_api.list_roles(**args))
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def assign_role(request, token):
+        payload = await check_payload(request, USER_IDS_SCHEMA)
+        return construct_response(await user_api.assign_role(
+            token[u"customer"][u"id"], request.path_params[u"role_id"], payload[u"ids"]
+        ))
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def revoke_role(request, token):
+        payload = await check_payload(request, USER_IDS_SCHEMA)
+        return construct_response(await user_api.revoke_role(
+            token[u"customer"][u"id"], request.path_params[u"role_id"], payload[u"ids"]
+        ))
+
+    return Starlette(
+        routes=[
+            Route(u"/", list_roles, methods=[u"GET"]),
+            Route(u"/{role_id:int}/users", assign_role, methods=[u"POST"]),
+            Route(u"/{role_id:int}/users", revoke_role, methods=[u"DELETE"])
+        ],
+        exception_handlers={
+            ApiException: api_error_handler
+        }
+    )
@@ -0,0 +1,149 @@
+# coding: utf-8
+"""
+User API app (ASGI)
+"""
+
+import base64
+import datetime
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from user_api.user_api_exception import ApiException
+from .asgi_utils import (
+    api_error_handler,
+    check_args,
+    check_payload,
+    construct_response,
+    stream_ndjson,
+    stream_csv
+)
+from ..schemas import (
+    CREDENTIALS_SCHEMA,
+    REFRESH_SCHEMA,
+    REGISTER_SCHEMA,
+    UPDATE_SCHEMA,
+    LIST_USERS_ARGS_SCHEMA,
+    EXPORT_USERS_ARGS_SCHEMA,
+    BATCH_USERS_SCHEMA,
+    EXPORT_CSV_HEADER,
+    to_export_row
+)
+
+
+def construct_user_api_app(asgi_user_api):
+    user_api = asgi_user_api._user_api
+
+    def construct_token_response(token_payload, token):
+        response = JSONResponse(token_payload)
+        response.set_cookie(
+            u"user-api-credentials",
+            value=base64.b64encode(token).decode(u"ascii"),
+            httponly=True,
+            expires=datetime.datetime.fromtimestamp(token_payload[u"exp"], datetime.timezone.utc)
+        )
+        return response
+
+    async def login(request):
+        payload = await check_payload(request, CREDENTIALS_SCHEMA)
+        token_payload, token = await user_api.authenticate(
+            email=payload.get(u"email"),
+            password=payload.get(u"password")
+        )
+        return construct_token_response(token_payload, token)
+
+    async def refresh(request):
+        payload = await check_payload(request, REFRESH_SCHEMA)
+        token_payload, token = await user_api.refresh(payload[u"refresh_token"])
+        return construct_token_response(token_payload, token)
+
+    @asgi_user_api.is_connected(inject_token=True)
+    async def reset_password(request, token):
+        payload = await check_payload(request, CREDENTIALS_SCHEMA)
+        # If connected user different from the one to reset, check admin rights.
+        if token[u"email"] != payload.get(u"email"):
+            user_api.token_has_roles(token, [u"admin"])
+
+        return construct_response(await user_api.reset_password(**payload))
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def register(request, token):
+        payload = await check_payload(request, REGISTER_SCHEMA)
+        return construct_response(await user_api.register(token[u"customer"][u"id"], payload), 201)
+
+    @asgi_user_api.is_connected(inject_token=True)
+    async def get_token(request, token):
+        return construct_response(token)
+
+    async def jwks(request):
+        return construct_response(user_api.get_jwks())
+
+    @asgi_user_api.is_connected(inject_token=True)
+    async def logout(request, token):
+        await user_api.logout(token)
+        response = construct_response({
+            u"message": u"User disconnected."
+        })
+        response.delete_cookie(u"user-api-credentials", httponly=True)
+        return response
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def list_users(request, token):
+        args = check_args(request, LIST_USERS_ARGS_SCHEMA)
+        return construct_response(await user_api.list_users(token[u"customer"][u"id"], **args))
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def export_users(request, token):
+        args = check_args(request, EXPORT_USERS_ARGS_SCHEMA)
+        file_format = args.pop(u"format")
+        users = user_api.iter_users(token[u"customer"][u"id"], **args)
+
+        if file_format == u"csv":
+            rows = (to_export_row(user) async for user in users)
+            return StreamingResponse(stream_csv(rows, EXPORT_CSV_HEADER), media_type=u"text/csv")
+        return StreamingResponse(stream_ndjson(users), media_type=u"application/x-ndjson")
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def get_users(request, token):
+        payload = await check_payload(request, BATCH_USERS_SCHEMA)
+        users = await user_api.get_users_information(
+            token[u"customer"][u"id"],
+            payload[u"ids"],
+            payload.get(u"with_roles", True)
+        )
+        return construct_response({
+            u"users": {str(user_id): user for user_id, user in users.items()}
+        })
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def get_user(request, token):
+        return construct_response(
+            await user_api.get_user_information(token[u"customer"][u"id"], request.path_params[u"user_id"])
+        )
+
+    @asgi_user_api.has_roles(roles=[u"admin"], inject_token=True)
+    async def update(request, token):
+        payload = await check_payload(request, UPDATE_SCHEMA)
+        payload.pop(u"id", None)
+        return construct_response(
+            await user_api.update(token[u"customer"][u"id"], request.path_params[u"user_id"], payload)
+        )
+
+    return Starlette(
+        routes=[
+            Route(u"/login", login, methods=[u"POST"]),
+            Route(u"/reset-password", reset_password, methods=[u"POST"]),
+            Route(u"/", register, methods=[u"POST"]),
+            Route(u"/", list_users, methods=[u"GET"]),
+            Route(u"/token", get_token, methods=[u"GET"]),
+            Route(u"/token/refresh", refresh, methods=[u"POST"]),
+            Route(u"/.well-known/jwks.json", jwks, methods=[u"GET"]),
+            Route(u"/logout", logout, methods=[u"GET"]),
+            Route(u"/export", export_users, methods=[u"GET"]),
+            Route(u"/batch", get_users, methods=[u"POST"]),
+            Route(u"/{user_id:int}", get_user, methods=[u"GET"]),
+            Route(u"/{user_id:int}", update, methods=[u"PUT"])
+        ],
+        exception_handlers={
+            ApiException: api_error_handler
+        }
+    )
@@ -3,14 +3,21 @@
 import re
 import base64
 from functools import wraps
-from flask import request, redirect
+from flask import g, request, redirect
 from user_api.user_api_exception import (
     ApiUnauthorized
 )
-from .flask_utils import add_api_error_handler
+from .flask_utils import (
+    TOKEN_CONTEXT_ATTRIBUTE,
+    add_api_error_handler,
+    add_auth_context_handler,
+    add_session_scope_handler
+)
 from .user_api_blueprint import construct_user_api_blueprint
 from .role_api_blueprint import construct_role_api_blueprint
 
+BEARER_TOKEN_REGEX = re.compile(u"Bearer (\\S+)")
+
 
 class FlaskUserApi(object):
 
@@ -22,33 +29,75 @@ class FlaskUserApi(object):
         """
         self._user_api = user_api
 
-    def check_token(self, request, login_url=None):
+    @staticmethod
+    def get_request_token(request):
+        """
+        Read the token of a request, from the Authorization header or the credentials cookie.
+        Args:
+            request: The flask request.
+
+        Returns:
+            (unicode|bytes): The token, None if there are no credentials.
+        """
         if u"Authorization" in request.headers:
             authorization = request.headers.get(u"Authorization")
-            m = re.search(u"Bearer (\S+)", authorization)
-            token = m.group(1)
-            if m is None or not self._user_api.is_token_valid(token):
-                raise ApiUnauthorized(u"Invalid token.")
-            return self._user_api.get_token_data(token)
-        elif u"user-api-credentials" in request.cookies:
-            decoded_token = base64.b64decode(request.cookies.get(u'user-api-credentials'))
-            if not self._user_api.is_token_valid(decoded_token):
+            m = BEARER_TOKEN_REGEX.search(authorization)
+            if m is None:
                 raise ApiUnauthorized(u"Invalid token.")
-            return self._user_api.get_token_data(decoded_token)
-        else:
+            return m.group(1)
+        if u"user-api-credentials" in request.cookies:
+            return base64.b64decode(request.cookies.get(u'user-api-credentials'))
+        return None
+
+    def check_token(self, request, login_url=None):
+        """
+        Verify the token of a request and return its claims. The token is decoded once per
+        request: the claims are kept on flask.g, where the decorators and the routes read them.
+        Args:
+            request: The flask request.
+            login_url (unicode): Where to redirect if there are no credentials.
+
+        Returns:
+            (dict): The token claims.
+        """
+        token_data = g.get(TOKEN_CONTEXT_ATTRIBUTE)
+        if token_data is not None:
+            return token_data
+
+        token = self.get_request_token(request)
+        if token is None:
             if login_url:
                 return redirect(login_url, 302)
             else:
                 raise ApiUnauthorized()
 
+        token_data = self._user_api.get_token_data(token)
+        if token_data is None:
+            raise ApiUnauthorized(u"Invalid token.")
+        setattr(g, TOKEN_CONTEXT_ATTRIBUTE, token_data)
+        return token_data
+
     def is_connected(self, login_url=None, inject_token: bool = False):
+        """
+        Decorator checking the request has a valid token.
+        Args:
+            login_url (unicode): Where to redirect if there are no credentials (401 if None).
+            inject_token (boolean): Give the token claims to the function (token kwarg).
+
+        Returns:
+            (callable): The decorator.
+        """
 
         def decorator(funct):
 
             @wraps(funct)
             def wrapper(*args, **kwargs):
+                if login_url and g.get(TOKEN_CONTEXT_ATTRIBUTE) is None \
+                        and self.get_request_token(request) is None:
+                    return redirect(login_url, 302)
+                token = self.check_token(request)
                 if inject_token:
-                    kwargs["token"] = self.check_token(request, login_url)
+                    kwargs["token"] = token
                 # If all right, do call function
                 ret = funct(*args, **kwargs)
                 return ret
@@ -57,17 +106,31 @@ class FlaskUserApi(object):
 
         return decorator
 
-    def has_roles(self, roles, inject_token: bool = False, inject_roles: bool = False):
+    def has_roles(self, roles, inject_token: bool = False, inject_roles: bool = False, any_of: bool = False):
+        """
+        Decorator checking the token of the request has the roles.
+        Args:
+            roles (list of unicode): The role codes to check.
+            inject_token (boolean): Give the token claims to the function (token kwarg).
+            inject_roles (boolean): Give the checked roles to the function (roles kwarg).
+            any_of (boolean): Only require one of the roles instead of all of them.
+
+        Returns:
+            (callable): The decorator.
+        """
+        # Computed once, when the decorator is applied.
+        required_roles = frozenset(roles)
 
         def decorator(funct):
 
             @wraps(funct)
             def wrapper(*args, **kwargs):
-                
+
                 token = self.check_token(request)
                 self._user_api.token_has_roles(
                     token=token,
-                    roles=roles
+                    roles=required_roles,
+                    any_of=any_of
                 )
                 if inject_token:
                     kwargs["token"] = token
@@ -81,7 +144,20 @@ class FlaskUserApi(object):
             return wrapper
 
         return decorator
-    
+
+    def has_any_role(self, roles, inject_token: bool = False, inject_roles: bool = False):
+        """
+        Decorator checking the token of the request has at least one of the roles.
+        Args:
+            roles (list of unicode): The role codes to check.
+            inject_token (boolean): Give the token claims to the function (token kwarg).
+            inject_roles (boolean): Give the checked roles to the function (roles kwarg).
+
+        Returns:
+            (callable): The decorator.
+        """
+        return self.has_roles(roles, inject_token=inject_token, inject_roles=inject_roles, any_of=True)
+
     @staticmethod
     def add_api_error_handler(blueprint):
         """
@@ -91,7 +167,24 @@ class FlaskUserApi(object):
 
         """
         add_api_error_handler(blueprint)
-        
+
+    @staticmethod
+    def add_auth_context_handler(blueprint):
+        """
+        Forget the token claims kept on flask.g at the end of each request.
+        Args:
+            blueprint (Blueprint|Flask): The blueprint (or app) using the decorators.
+        """
+        add_auth_context_handler(blueprint)
+
+    def add_session_scope_handler(self, blueprint):
+        """
+        Share one DB session between all the calls made while handling a request.
+        Args:
+            blueprint (Blueprint|Flask): The blueprint (or app) handling the requests.
+        """
+        add_session_scope_handler(blueprint, self._user_api)
+
     def construct_user_api_blueprint(self):
         return construct_user_api_blueprint(self)
 
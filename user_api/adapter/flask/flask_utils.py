@@ -6,9 +6,14 @@ Blueprint utils methods
 import json
 from functools import wraps
 from cerberus import Validator
-from flask import jsonify, request
+from flask import g, jsonify, request
 from collections import OrderedDict
 from user_api.user_api_exception import ApiUnprocessableEntity, ApiException
+from ..schemas import to_bool
+from ..streaming import CsvChunks, NdjsonChunks, iter_chunks
+
+# Attribute of flask.g holding the claims of the request token, once verified.
+TOKEN_CONTEXT_ATTRIBUTE = u"user_api_token"
 
 to_dict = lambda x: json.loads(x, encoding=u"utf8")
 to_unicode_list = lambda x: x.split(u",")
@@ -62,6 +67,33 @@ def flask_construct_response(item, code=200):
     return jsonify(item), code
 
 
+def stream_ndjson(items, chunk_size=500):
+    """
+    Serialize items as JSON lines, chunk by chunk (to stream a response body).
+    Args:
+        items (iterable of dict): The items to serialize, may be a stream.
+        chunk_size (int): How many items are written in each chunk.
+
+    Returns:
+        (generator of unicode): The chunks.
+    """
+    return iter_chunks(items, NdjsonChunks(chunk_size))
+
+
+def stream_csv(rows, header, chunk_size=500):
+    """
+    Serialize rows as CSV, chunk by chunk (to stream a response body).
+    Args:
+        rows (iterable of list): The rows to serialize, may be a stream.
+        header (list of unicode): The column names, written first.
+        chunk_size (int): How many rows are written in each chunk.
+
+    Returns:
+        (generator of unicode): The chunks.
+    """
+    return iter_chunks(rows, CsvChunks(header, chunk_size))
+
+
 def flask_check_args(validation_schema):
     """
 
@@ -158,3 +190,31 @@ def add_api_error_handler(blueprint):
             custom_error_code=exception.api_error_code,
             error_payload=exception.payload
         )
+
+
+def add_session_scope_handler(blueprint, user_api):
+    """
+    Bind one DB session to each request handled by the blueprint (or app), and release it on teardown.
+    Args:
+        blueprint (Blueprint|Flask): The blueprint (or app) to bind the session scope to.
+        user_api (UserApi): The user API owning the DB sessions.
+    """
+    @blueprint.before_request
+    def open_session_scope():
+        user_api.open_session_scope()
+
+    @blueprint.teardown_request
+    def close_session_scope(exception):
+        user_api.close_session_scope(exception)
+
+
+def add_auth_context_handler(blueprint):
+    """
+    Forget the token claims of each request handled by the blueprint (or app) on teardown,
+    so they can't leak to the next request when the app context is reused.
+    Args:
+        blueprint (Blueprint|Flask): The blueprint (or app) handling the requests.
+    """
+    @blueprint.teardown_request
+    def clear_auth_context(exception):
+        g.pop(TOKEN_CONTEXT_ATTRIBUTE, None)
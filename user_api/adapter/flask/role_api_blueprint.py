@@ -7,16 +7,18 @@ import base64
 from .flask_utils import (
     flask_check_args,
     add_api_error_handler,
+    add_auth_context_handler,
     flask_constructor_error,
     flask_construct_response,
     flask_check_and_inject_payload
 )
+from ..schemas import LIST_ARGS_SCHEMA, USER_IDS_SCHEMA
 
 from user_api.user_api_exception import (
     ApiException
 )
 
-from flask import Blueprint
+from flask import Blueprint, request
 
 
 def construct_role_api_blueprint(flask_user_api):
@@ -24,23 +26,32 @@ def construct_role_api_blueprint(flask_user_api):
 
     @role_api_blueprint.route(u'/', methods=[u"GET"])
     @flask_user_api.has_roles(roles=[u"admin"])
-    @flask_check_args({
-        u"limit": {
-            u"type": u"integer",
-            u"default": 20,
-            u"coerce": int
-        },
-        u"offset": {
-            u"type": u"integer",
-            u"default": 0,
-            u"coerce": int
-        }
-    })
+    @flask_check_args(LIST_ARGS_SCHEMA)
     def list_roles(args):
         return flask_construct_response(
             flask_user_api._user_api.list_roles(**args), 200
         )
 
+    @role_api_blueprint.route(u'/<int:role_id>/users', methods=[u"POST"])
+    @flask_user_api.has_roles(roles=[u"admin"])
+    @flask_check_and_inject_payload(USER_IDS_SCHEMA)
+    def assign_role(payload, role_id):
+        customer_id = flask_user_api.check_token(request)[u"customer"][u"id"]
+        return flask_construct_response(
+            flask_user_api._user_api.assign_role(customer_id, role_id, payload[u"ids"]), 200
+        )
+
+    @role_api_blueprint.route(u'/<int:role_id>/users', methods=[u"DELETE"])
+    @flask_user_api.has_roles(roles=[u"admin"])
+    @flask_check_and_inject_payload(USER_IDS_SCHEMA)
+    def revoke_role(payload, role_id):
+        customer_id = flask_user_api.check_token(request)[u"customer"][u"id"]
+        return flask_construct_response(
+            flask_user_api._user_api.revoke_role(customer_id, role_id, payload[u"ids"]), 200
+        )
+
     add_api_error_handler(role_api_blueprint)
+    add_auth_context_handler(role_api_blueprint)
+    flask_user_api.add_session_scope_handler(role_api_blueprint)
 
     return role_api_blueprint
@@ -7,34 +7,32 @@ import base64
 from .flask_utils import (
     flask_check_args,
     add_api_error_handler,
+    add_auth_context_handler,
     flask_construct_response,
-    flask_check_and_inject_payload
+    flask_check_and_inject_payload,
+    stream_ndjson,
+    stream_csv
+)
+from ..schemas import (
+    CREDENTIALS_SCHEMA,
+    REFRESH_SCHEMA,
+    REGISTER_SCHEMA,
+    UPDATE_SCHEMA,
+    LIST_USERS_ARGS_SCHEMA,
+    EXPORT_USERS_ARGS_SCHEMA,
+    BATCH_USERS_SCHEMA,
+    EXPORT_CSV_HEADER,
+    to_export_row
 )
 
-from flask import request, jsonify, Blueprint
+from flask import request, jsonify, Blueprint, Response, stream_with_context
+from user_api.user_api_exception import ApiUnauthorized
 
 
 def construct_user_api_blueprint(flask_user_api):
     user_api_blueprint = Blueprint(u'user_api', __name__)
 
-    @user_api_blueprint.route(u'/login', methods=[u"POST"])
-    @flask_check_and_inject_payload({
-        u"email": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"password": {
-            u"type": u"string",
-            u"required": True
-        }
-    })
-    def login(payload):
-
-        token_payload, token = flask_user_api._user_api.authenticate(
-            email=payload.get(u"email"),
-            password=payload.get(u"password")
-        )
-
+    def construct_token_response(token_payload, token):
         response = jsonify(token_payload)
         response.set_cookie(
             u"user-api-credentials",
@@ -44,6 +42,22 @@ def construct_user_api_blueprint(flask_user_api):
         )
 
         return response, 200
+
+    @user_api_blueprint.route(u'/login', methods=[u"POST"])
+    @flask_check_and_inject_payload(CREDENTIALS_SCHEMA)
+    def login(payload):
+
+        token_payload, token = flask_user_api._user_api.authenticate(
+            email=payload.get(u"email"),
+            password=payload.get(u"password")
+        )
+        return construct_token_response(token_payload, token)
+
+    @user_api_blueprint.route(u'/token/refresh', methods=[u"POST"])
+    @flask_check_and_inject_payload(REFRESH_SCHEMA)
+    def refresh(payload):
+        token_payload, token = flask_user_api._user_api.refresh(payload[u"refresh_token"])
+        return construct_token_response(token_payload, token)
     
     def get_customer_id(request) -> int:
         """
@@ -60,22 +74,11 @@ def construct_user_api_blueprint(flask_user_api):
 
 
     @user_api_blueprint.route(u'/reset-password', methods=[u'POST'])
-    @flask_user_api.is_connected()
-    @flask_check_and_inject_payload({
-        u"email": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"password": {
-            u"type": u"string",
-            u"required": True
-        }
-    })
-    def reset_password(payload):
-        token = flask_user_api.check_token(request)
-        token_payload = flask_user_api._user_api.get_token_data(token)
+    @flask_user_api.is_connected(inject_token=True)
+    @flask_check_and_inject_payload(CREDENTIALS_SCHEMA)
+    def reset_password(payload, token):
         # If connected user different from the one to reset, check admin rights.
-        if token_payload[u"email"] != payload.get(u"email"):
+        if token[u"email"] != payload.get(u"email"):
             flask_user_api._user_api.token_has_roles(token, [u"admin"])
 
         result = flask_user_api._user_api.reset_password(**payload)
@@ -84,38 +87,7 @@ def construct_user_api_blueprint(flask_user_api):
     @user_api_blueprint.route(u'/', methods=[u"POST"])
     @flask_user_api.has_roles(roles=[u"admin"])
     @flask_user_api.is_connected()
-    @flask_check_and_inject_payload({
-        u"email": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"name": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"password": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"active": {
-            u"type": u"boolean",
-            u"required": True
-        },
-        u'roles': {
-            u'type': u'list',
-            u"required": True,
-            u'schema': {
-                u'type': u'dict',
-                u"allow_unknown": True,
-                u'schema': {
-                    u"id": {
-                        u"type": u"integer",
-                        u"required": True
-                    }
-                }
-            }
-        }
-    })
+    @flask_check_and_inject_payload(REGISTER_SCHEMA)
     def register(payload):
         customer_id = get_customer_id(request)
         return flask_construct_response(
@@ -124,53 +96,68 @@ def construct_user_api_blueprint(flask_user_api):
 
 
     @user_api_blueprint.route(u'/token', methods=[u"GET"])
-    @flask_user_api.is_connected()
-    def token():
-        if u"user-api-credentials" in request.cookies:
-            decoded_token = base64.b64decode(request.cookies.get(u'user-api-credentials'))
-            return flask_construct_response(flask_user_api._user_api.get_token_data(decoded_token), 200)
+    @flask_user_api.is_connected(inject_token=True)
+    def token(token):
+        return flask_construct_response(token, 200)
+
+    @user_api_blueprint.route(u'/.well-known/jwks.json', methods=[u"GET"])
+    def jwks():
+        return flask_construct_response(flask_user_api._user_api.get_jwks(), 200)
 
     @user_api_blueprint.route(u'/logout', methods=[u"GET"])
-    @flask_user_api.is_connected()
     def logout():
+        try:
+            flask_user_api._user_api.logout(flask_user_api.check_token(request))
+        except ApiUnauthorized:
+            # An expired or invalid token can't be revoked, but the cookie is still cleared.
+            pass
+        response, code = flask_construct_response({
+            u"message": u"User disconnected."
+        }, 200)
         if u"user-api-credentials" in request.cookies:
-            response, code = flask_construct_response({
-                u"message": u"User disconnected."
-            }, 200)
             response.set_cookie(
                 u"user-api-credentials",
                 value=u"",
                 httponly=True,
                 expires=0
             )
-            return response, code
+        return response, code
 
     @user_api_blueprint.route(u'/', methods=[u"GET"])
     @flask_user_api.has_roles(roles=[u"admin"])
-    @flask_check_args({
-        u"limit": {
-            u"type": u"integer",
-            u"default": 20,
-            u"coerce": int
-        },
-        u"offset": {
-            u"type": u"integer",
-            u"default": 0,
-            u"coerce": int
-        },
-        u"email": {
-            u"type": u"string"
-        },
-        u"name": {
-            u"type": u"string"
-        }
-    })
+    @flask_check_args(LIST_USERS_ARGS_SCHEMA)
     def list_users(args):
         args["customer_id"] = get_customer_id(request)
         return flask_construct_response(
             flask_user_api._user_api.list_users(**args), 200
         )
 
+    @user_api_blueprint.route(u'/export', methods=[u"GET"])
+    @flask_user_api.has_roles(roles=[u"admin"])
+    @flask_check_args(EXPORT_USERS_ARGS_SCHEMA)
+    def export_users(args):
+        file_format = args.pop(u"format")
+        users = flask_user_api._user_api.iter_users(get_customer_id(request), **args)
+
+        if file_format == u"csv":
+            rows = (to_export_row(user) for user in users)
+            return Response(stream_with_context(stream_csv(rows, EXPORT_CSV_HEADER)), mimetype=u"text/csv")
+        return Response(stream_with_context(stream_ndjson(users)), mimetype=u"application/x-ndjson")
+
+    @user_api_blueprint.route(u'/batch', methods=[u"POST"])
+    @flask_user_api.has_roles(roles=[u"admin"])
+    @flask_check_and_inject_payload(BATCH_USERS_SCHEMA)
+    def get_users(payload):
+        customer_id = get_customer_id(request)
+        users = flask_user_api._user_api.get_users_information(
+            customer_id,
+            payload[u"ids"],
+            payload.get(u"with_roles", True)
+        )
+        return flask_construct_response({
+            u"users": {str(user_id): user for user_id, user in users.items()}
+        }, 200)
+
     @user_api_blueprint.route(u'/<int:user_id>', methods=[u"GET"])
     @flask_user_api.has_roles(roles=[u"admin"])
     def get_user(user_id):
@@ -184,42 +171,7 @@ def construct_user_api_blueprint(flask_user_api):
 
     @user_api_blueprint.route(u'/<int:user_id>', methods=[u"PUT"])
     @flask_user_api.has_roles(roles=[u"admin"])
-    @flask_check_and_inject_payload({
-        u"email": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"id": {
-            u"type": u"integer",
-            u"required": False
-        },
-        u"name": {
-            u"type": u"string",
-            u"required": True
-        },
-        u"password": {
-            u"type": u"string",
-            u"required": False
-        },
-        u"active": {
-            u"type": u"boolean",
-            u"required": True
-        },
-        u'roles': {
-            u'type': u'list',
-            u"required": False,
-            u'schema': {
-                u'type': u'dict',
-                u"allow_unknown": True,
-                u'schema': {
-                    u"id": {
-                        u"type": u"integer",
-                        u"required": True
-                    }
-                }
-            }
-        }
-    })
+    @flask_check_and_inject_payload(UPDATE_SCHEMA)
     def update(payload, user_id):
         customer_id = get_customer_id(request)
         if u"id" in payload:
@@ -229,6 +181,8 @@ def construct_user_api_blueprint(flask_user_api):
         return flask_construct_response(result, 200)
 
     add_api_error_handler(user_api_blueprint)
+    add_auth_context_handler(user_api_blueprint)
+    flask_user_api.add_session_scope_handler(user_api_blueprint)
 
     return user_api_blueprint
 
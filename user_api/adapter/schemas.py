@@ -0,0 +1,176 @@
+# coding: utf-8
+"""
+Validation schemas of the REST API, shared by the adapters.
+"""
+
+to_bool = lambda x: x if isinstance(x, bool) else x.lower() in (u"1", u"true", u"yes")
+
+MATCH_SCHEMA = {
+    u"type": u"string",
+    u"allowed": [u"prefix", u"contains", u"search"]
+}
+
+ROLES_SCHEMA = {
+    u'type': u'list',
+    u'schema': {
+        u'type': u'dict',
+        u"allow_unknown": True,
+        u'schema': {
+            u"id": {
+                u"type": u"integer",
+                u"required": True
+            }
+        }
+    }
+}
+
+CREDENTIALS_SCHEMA = {
+    u"email": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"password": {
+        u"type": u"string",
+        u"required": True
+    }
+}
+
+REFRESH_SCHEMA = {
+    u"refresh_token": {
+        u"type": u"string",
+        u"required": True
+    }
+}
+
+REGISTER_SCHEMA = {
+    u"email": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"name": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"password": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"active": {
+        u"type": u"boolean",
+        u"required": True
+    },
+    u'roles': dict(ROLES_SCHEMA, required=True)
+}
+
+UPDATE_SCHEMA = {
+    u"email": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"id": {
+        u"type": u"integer",
+        u"required": False
+    },
+    u"name": {
+        u"type": u"string",
+        u"required": True
+    },
+    u"password": {
+        u"type": u"string",
+        u"required": False
+    },
+    u"active": {
+        u"type": u"boolean",
+        u"required": True
+    },
+    u'roles': dict(ROLES_SCHEMA, required=False)
+}
+
+LIST_ARGS_SCHEMA = {
+    u"limit": {
+        u"type": u"integer",
+        u"default": 20,
+        u"coerce": int
+    },
+    u"offset": {
+        u"type": u"integer",
+        u"default": 0,
+        u"coerce": int
+    },
+    u"cursor": {
+        u"type": u"string"
+    },
+    u"total_count": {
+        u"type": u"boolean",
+        u"coerce": to_bool
+    }
+}
+
+LIST_USERS_ARGS_SCHEMA = dict(LIST_ARGS_SCHEMA, **{
+    u"email": {
+        u"type": u"string"
+    },
+    u"name": {
+        u"type": u"string"
+    },
+    u"match": MATCH_SCHEMA
+})
+
+EXPORT_USERS_ARGS_SCHEMA = {
+    u"format": {
+        u"type": u"string",
+        u"default": u"ndjson",
+        u"allowed": [u"ndjson", u"csv"]
+    },
+    u"with_roles": {
+        u"type": u"boolean",
+        u"default": False,
+        u"coerce": to_bool
+    },
+    u"email": {
+        u"type": u"string"
+    },
+    u"name": {
+        u"type": u"string"
+    },
+    u"match": dict(MATCH_SCHEMA, default=u"contains")
+}
+
+USER_IDS_SCHEMA = {
+    u"ids": {
+        u"type": u"list",
+        u"required": True,
+        u"schema": {
+            u"type": u"integer"
+        }
+    }
+}
+
+BATCH_USERS_SCHEMA = dict(USER_IDS_SCHEMA, **{
+    u"with_roles": {
+        u"type": u"boolean",
+        u"default": True
+    }
+})
+
+# Columns of the CSV exports (the roles are space separated role IDs, as for the imports).
+EXPORT_CSV_HEADER = [u"id", u"email", u"name", u"active", u"customer_id", u"roles"]
+
+
+def to_export_row(user):
+    """
+    Build the CSV export row of a user.
+    Args:
+        user (dict): The user.
+
+    Returns:
+        (list): The values, in the EXPORT_CSV_HEADER order.
+    """
+    return [
+        user[u"id"],
+        user[u"email"],
+        user[u"name"],
+        user[u"active"],
+        user[u"customer"][u"id"],
+        u" ".join(str(role[u"id"]) for role in user.get(u"roles", []))
+    ]
@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+Serializers of the streamed response bodies (exports), shared by the adapters.
+"""
+
+import io
+import csv
+import json
+
+
+class NdjsonChunks(object):
+    """
+    Serialize items as JSON lines, chunk by chunk.
+    """
+
+    def __init__(self, chunk_size=500):
+        """
+        Constructor.
+        Args:
+            chunk_size (int): How many items are written in each chunk.
+        """
+        self._chunk_size = chunk_size
+        self._lines = []
+
+    def add(self, item):
+        """
+        Serialize an item.
+        Args:
+            item (dict): The item.
+
+        Returns:
+            (unicode): The chunk, if this item completes one, else None.
+        """
+        self._lines.append(json.dumps(item) + u"\n")
+        if len(self._lines) >= self._chunk_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Returns:
+            (unicode): The items serialized since the last chunk, None if there are none.
+        """
+        if not self._lines:
+            return None
+        chunk = u"".join(self._lines)
+        self._lines = []
+        return chunk
+
+
+class CsvChunks(object):
+    """
+    Serialize rows as CSV, chunk by chunk. The header is written with the first chunk.
+    """
+
+    def __init__(self, header, chunk_size=500):
+        """
+        Constructor.
+        Args:
+            header (list of unicode): The column names, written first.
+            chunk_size (int): How many rows are written in each chunk.
+        """
+        self._chunk_size = chunk_size
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(header)
+        self._count = 0
+
+    def add(self, row):
+        """
+        Serialize a row.
+        Args:
+            row (list): The values.
+
+        Returns:
+            (unicode): The chunk, if this row completes one, else None.
+        """
+        self._writer.writerow(row)
+        self._count += 1
+        if self._count % self._chunk_size == 0:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Returns:
+            (unicode): The rows serialized since the last chunk, None if there are none.
+        """
+        if not self._buffer.tell():
+            return None
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+
+def iter_chunks(items, chunks):
+    """
+    Serialize items chunk by chunk (to stream a response body).
+    Args:
+        items (iterable): The items to serialize, may be a stream.
+        chunks (NdjsonChunks|CsvChunks): The serializer.
+
+    Yields:
+        (unicode): The next chunk.
+    """
+    for item in items:
+        chunk = chunks.add(item)
+        if chunk is not None:
+            yield chunk
+    chunk = chunks.flush()
+    if chunk is not None:
+        yield chunk
+
+
+async def aiter_chunks(items, chunks):
+    """
+    Serialize items chunk by chunk (to stream a response body).
+    Args:
+        items (async iterable): The items to serialize.
+        chunks (NdjsonChunks|CsvChunks): The serializer.
+
+    Yields:
+        (unicode): The next chunk.
+    """
+    async for item in items:
+        chunk = chunks.add(item)
+        if chunk is not None:
+            yield chunk
+    chunk = chunks.flush()
+    if chunk is not None:
+        yield chunk
@@ -0,0 +1,153 @@
+# coding: utf-8
+"""
+Contains the asyncio facade of the user API.
+"""
+
+import itertools
+from functools import wraps
+from .user_api import UserApi
+
+
+def _run_in_session_scope(name):
+    """
+    Build an AsyncUserApi method running a UserApi method in the session registry.
+    Args:
+        name (unicode): The name of the UserApi method.
+
+    Returns:
+        (coroutine function): The AsyncUserApi method.
+    """
+    @wraps(getattr(UserApi, name))
+    async def method(self, *args, **kwargs):
+        return await self._session_registry.run(getattr(self._user_api, name), *args, **kwargs)
+
+    return method
+
+
+def _take(items, count):
+    return list(itertools.islice(items, count))
+
+
+class AsyncUserApi(object):
+    """
+    The UserApi, for asyncio servers. Each method is a coroutine running the matching UserApi
+    method in one unit of work of an AsyncDBSessionRegistry: the queries and the password
+    hashes are awaited, so the event loop is never blocked.
+    """
+
+    def __init__(self, user_api, session_registry):
+        """
+        Build the asyncio user API.
+        Args:
+            user_api (UserApi): The user API, built on managers sharing session_registry and
+                an auth manager hashing in an AwaitingHashExecutor.
+            session_registry (AsyncDBSessionRegistry): The registry running the units of work.
+        """
+        self._user_api = user_api
+        self._session_registry = session_registry
+
+    get_user_information = _run_in_session_scope(u"get_user_information")
+    get_users_information = _run_in_session_scope(u"get_users_information")
+    update = _run_in_session_scope(u"update")
+    authenticate_no_password = _run_in_session_scope(u"authenticate_no_password")
+    authenticate = _run_in_session_scope(u"authenticate")
+    refresh = _run_in_session_scope(u"refresh")
+    reset_password = _run_in_session_scope(u"reset_password")
+    register = _run_in_session_scope(u"register")
+    register_many = _run_in_session_scope(u"register_many")
+    get_token_data = _run_in_session_scope(u"get_token_data")
+    is_token_valid = _run_in_session_scope(u"is_token_valid")
+    logout = _run_in_session_scope(u"logout")
+    list_users = _run_in_session_scope(u"list_users")
+    list_roles = _run_in_session_scope(u"list_roles")
+    assign_role = _run_in_session_scope(u"assign_role")
+    revoke_role = _run_in_session_scope(u"revoke_role")
+
+    def get_asgi_user_api(self):
+        """
+        Get an ASGI (Starlette) adapter for the API.
+
+        Returns:
+            (AsgiUserApi): The adapter.
+        """
+        # Requires the "asgi" extra.
+        from .adapter.asgi import AsgiUserApi
+        return AsgiUserApi(self)
+
+    def get_user_api(self):
+        """
+        Returns:
+            (UserApi): The synchronous user API behind the facade.
+        """
+        return self._user_api
+
+    def get_jwks(self):
+        """
+        Returns:
+            (dict): The public keys verifying the tokens, as a JSON Web Key Set.
+        """
+        return self._user_api.get_jwks()
+
+    def get_token_role_codes(self, token):
+        """
+        Get the codes of the roles in a token (no database access, so not a coroutine).
+        Args:
+            token (Dict): The token claims.
+
+        Returns:
+            (frozenset of unicode): The role codes.
+        """
+        return self._user_api.get_token_role_codes(token)
+
+    def token_has_roles(self, token, roles, any_of=False):
+        """
+        Check if a token is authorized for a role list (no database access, so not a coroutine).
+        Args:
+            token (Dict): The token to check.
+            roles (iterable of unicode): The role codes to check (a frozenset avoids a copy).
+            any_of (boolean): Only require one of the roles instead of all of them.
+
+        Returns:
+            (boolean): Returns true if it has the roles.
+
+        Raises
+            (ApiForbidden): Raised if the token doesn't have the expected roles.
+        """
+        return self._user_api.token_has_roles(token, roles, any_of)
+
+    def get_cache_stats(self):
+        """
+        Returns:
+            (dict): The hit / miss counters of the caches.
+        """
+        return self._user_api.get_cache_stats()
+
+    async def iter_users(
+            self,
+            customer_id: int,
+            email=None,
+            name=None,
+            match=u"contains",
+            with_roles=False,
+            batch_size=1000
+        ):
+        """
+        Go through all the users of a customer, ordered by ID, without holding them all in memory (exports).
+        Args:
+            customer_id (int): The corresponding customer.
+            email (unicode): An email to filter on.
+            name (unicode): A name to filter on.
+            match (unicode): How email and name are matched: "prefix", "contains" or "search".
+            with_roles (boolean): Add the roles to the users.
+            batch_size (int): How many users are read by each unit of work.
+
+        Yields:
+            (dict): The users representations.
+        """
+        users = self._user_api.iter_users(customer_id, email, name, match, with_roles)
+        while True:
+            batch = await self._session_registry.run(_take, users, batch_size)
+            for user in batch:
+                yield user
+            if len(batch) < batch_size:
+                return
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the auth manager exceptions.
+"""
+
+
+class AuthException(Exception):
+    """
+    Base exception.
+    """
+    def __init__(self, message):
+        Exception.__init__(self)
+        self.message = message
+
+
+class AuthHashQueueFull(AuthException):
+    """
+    Raised if too many hashes are already waiting to be computed.
+    """
+    def __init__(self):
+        AuthException.__init__(self, u"Too many passwords waiting to be hashed.")
+
+
+class AuthHashTimeout(AuthException):
+    """
+    Raised if a hash took too long to be computed.
+    """
+    def __init__(self):
+        AuthException.__init__(self, u"Password hashing timed out.")
@@ -1,16 +1,120 @@
 # coding: utf-8
 
 import jwt
+import hmac
 import time
-import datetime
+import hashlib
 import Crypto.Random
+import Crypto.Hash.SHA1
+import Crypto.Hash.SHA256
+import Crypto.Hash.SHA512
 import Crypto.Protocol.KDF
 import binascii
+from itertools import repeat
+from concurrent.futures import Future
+from .key_ring import ALGORITHMS
+
+
+# Hash functions usable for PBKDF2, by scheme name.
+HASH_MODULES = {
+    u"pbkdf2_sha1": Crypto.Hash.SHA1,
+    u"pbkdf2_sha256": Crypto.Hash.SHA256,
+    u"pbkdf2_sha512": Crypto.Hash.SHA512
+}
+# Parameters of the hashes saved without scheme (pycryptodome PBKDF2 defaults).
+LEGACY_HASH_PARAMETERS = (u"pbkdf2_sha1", 1000, 16)
+HASH_SEPARATOR = u"$"
+
+# PyJWT with the asymmetric algorithms of the key ring.
+KEY_RING_JWT = jwt.PyJWT()
+for _name, _algorithm in ALGORITHMS.items():
+    KEY_RING_JWT.register_algorithm(_name, _algorithm)
+
+
+def compute_hash(password, salt, algorithm, iterations, length):
+    """
+    Compute the hash of a password. Module level so it can be sent to a process pool.
+    :param password: The password to hash.
+    :param salt: The salt to hash the password with.
+    :param algorithm: The hashing scheme (a HASH_MODULES key).
+    :param iterations: The PBKDF2 iteration count.
+    :param length: The derived key length (bytes).
+    :return (unicode): The hash, prefixed with its parameters ("algorithm$iterations$length$hash").
+    """
+    hash = Crypto.Protocol.KDF.PBKDF2(
+        password,
+        salt,
+        dkLen=length,
+        count=iterations,
+        hmac_hash_module=HASH_MODULES[algorithm]
+    )
+    hash = binascii.hexlify(hash).decode()
+    return HASH_SEPARATOR.join([algorithm, str(iterations), str(length), hash])
+
+
+def parse_hash(saved_hash):
+    """
+    Read the parameters a hash was computed with.
+    :param saved_hash: A hash as saved in the database.
+    :return (unicode, int, int, unicode): The algorithm, the iteration count, the length and the hash itself.
+    :raise ValueError: If the hash is malformed or its algorithm unknown.
+    """
+    parts = saved_hash.split(HASH_SEPARATOR)
+    if len(parts) == 1:
+        return LEGACY_HASH_PARAMETERS + (saved_hash,)
+    if len(parts) != 4 or parts[0] not in HASH_MODULES:
+        raise ValueError(u"Malformed hash.")
+    algorithm, iterations, length, hash = parts
+    return algorithm, int(iterations), int(length), hash
+
+
+def copy_claims(claims):
+    """
+    Copy token claims, nested dicts and lists of dicts (the roles) included. The claims are
+    decoded JSON two levels deep at most, so this is much cheaper than copy.deepcopy.
+    :param claims: The claims to copy.
+    :return (dict): The copy.
+    """
+    copied = dict(claims)
+    for key, value in claims.items():
+        if isinstance(value, dict):
+            copied[key] = dict(value)
+        elif isinstance(value, list):
+            copied[key] = [dict(item) if isinstance(item, dict) else item for item in value]
+    return copied
+
 
 class AuthManager(object):
-    def __init__(self, jwt_secret, jwt_lifetime):
+    def __init__(
+        self,
+        jwt_secret,
+        jwt_lifetime,
+        hash_executor=None,
+        hash_algorithm=LEGACY_HASH_PARAMETERS[0],
+        hash_iterations=LEGACY_HASH_PARAMETERS[1],
+        hash_length=LEGACY_HASH_PARAMETERS[2],
+        token_cache=None,
+        key_ring=None
+    ):
+        """
+        Construct the object.
+        :param jwt_secret: The secret used to sign the tokens.
+        :param jwt_lifetime: How long each token is valid (seconds).
+        :param hash_executor (HashExecutor): Optional pool to compute the hashes out of the calling thread.
+        :param hash_algorithm: The scheme used for new hashes (pbkdf2_sha1, pbkdf2_sha256 or pbkdf2_sha512).
+        :param hash_iterations: The PBKDF2 iteration count used for new hashes.
+        :param hash_length: The length (bytes) of the new hashes.
+        :param token_cache (Cache): Optional cache of the verified token claims.
+        :param key_ring (KeyRing): Optional asymmetric keys signing the tokens instead of jwt_secret.
+        """
+        if hash_algorithm not in HASH_MODULES:
+            raise ValueError(u"Unknown hash algorithm '{}'.".format(hash_algorithm))
         self._jwt_secret = jwt_secret
         self._jwt_lifetime = jwt_lifetime
+        self._hash_executor = hash_executor
+        self._hash_parameters = (hash_algorithm, hash_iterations, hash_length)
+        self._token_cache = token_cache
+        self._key_ring = key_ring
 
     @staticmethod
     def generate_salt():
@@ -22,10 +126,98 @@ class AuthManager(object):
         return salt
 
     @staticmethod
-    def generate_hash(password, salt):
-        hash = Crypto.Protocol.KDF.PBKDF2(password, salt)
-        hash = binascii.hexlify(hash).decode()
-        return hash
+    def generate_refresh_token():
+        """
+        Generate a refresh token (random, so no password hashing is needed to check it).
+        :return (unicode): The token.
+        """
+        return binascii.hexlify(Crypto.Random.new().read(32)).decode()
+
+    @staticmethod
+    def hash_refresh_token(token):
+        """
+        Hash a refresh token, to store or look it up.
+        :param token: The token.
+        :return (unicode): The SHA-256 hash (hex).
+        """
+        return hashlib.sha256(token.encode(u"utf-8")).hexdigest()
+
+    def generate_hash(self, password, salt):
+        """
+        Hash a password with the current parameters, in the hash executor if there is one.
+        :param password: The password to hash.
+        :param salt: The salt to hash the password with.
+        :return (unicode): The hash, prefixed with its parameters.
+        """
+        if self._hash_executor is None:
+            return compute_hash(password, salt, *self._hash_parameters)
+        return self._hash_executor.result(self.generate_hash_async(password, salt))
+
+    def generate_hashes(self, passwords, salts):
+        """
+        Hash a batch of passwords with the current parameters, in parallel in the hash executor if there is one.
+        :param passwords: The passwords to hash.
+        :param salts: The salts to hash the passwords with, one per password.
+        :return (list of unicode): The hashes, in the order of the passwords.
+        """
+        parameters = [repeat(parameter) for parameter in self._hash_parameters]
+        if self._hash_executor is None:
+            return list(map(compute_hash, passwords, salts, *parameters))
+        return self._hash_executor.map(compute_hash, passwords, salts, *parameters)
+
+    def generate_hash_async(self, password, salt):
+        """
+        Hash a password without waiting for the result.
+        Without hash executor, the hash is computed inline and the future is already done.
+        :param password: The password to hash.
+        :param salt: The salt to hash the password with.
+        :return (Future): The future hash.
+        """
+        return self._compute_hash_async(password, salt, self._hash_parameters)
+
+    def verify_hash(self, password, salt, saved_hash):
+        """
+        Check a password against a saved hash, using the parameters recorded with the hash.
+        :param password: The password to check.
+        :param salt: The salt saved with the hash.
+        :param saved_hash: The hash saved in the database.
+        :return (boolean): True if the password matches.
+        """
+        if not saved_hash:
+            return False
+        try:
+            parameters = parse_hash(saved_hash)
+        except ValueError:
+            # A malformed hash can't match: a failed check, not a server error.
+            return False
+        future = self._compute_hash_async(password, salt, parameters[:3])
+        if self._hash_executor is None:
+            hash = future.result()
+        else:
+            hash = self._hash_executor.result(future)
+        return hmac.compare_digest(parse_hash(hash)[3], parameters[3])
+
+    def needs_rehash(self, saved_hash):
+        """
+        Check if a hash was computed with other parameters than the current ones.
+        :param saved_hash: The hash saved in the database.
+        :return (boolean): True if the password should be hashed again.
+        """
+        try:
+            return tuple(parse_hash(saved_hash)[:3]) != self._hash_parameters
+        except ValueError:
+            return False
+
+    def _compute_hash_async(self, password, salt, parameters):
+        if self._hash_executor is not None:
+            return self._hash_executor.submit(compute_hash, password, salt, *parameters)
+
+        future = Future()
+        try:
+            future.set_result(compute_hash(password, salt, *parameters))
+        except Exception as err:
+            future.set_exception(err)
+        return future
 
     def generate_token(self, payload):
         """
@@ -35,15 +227,28 @@ class AuthManager(object):
         """
         # Get user informations metadata
         # Update with expiration date
-        timestamp = int(time.mktime(datetime.datetime.utcnow().timetuple()))
+        # UTC timestamp, the clock the revocation watermarks are compared to.
+        timestamp = int(time.time())
 
+        payload[u"iat"] = timestamp
         payload[u"exp"] = timestamp + self._jwt_lifetime
+        # Unique ID, to revoke the token.
+        payload[u"jti"] = binascii.hexlify(Crypto.Random.new().read(12)).decode()
         # Create JWT token
-        encoded = jwt.encode(
-            payload,
-            self._jwt_secret,
-            algorithm=u"HS256"
-        )
+        if self._key_ring is None:
+            encoded = jwt.encode(
+                payload,
+                self._jwt_secret,
+                algorithm=u"HS256"
+            )
+        else:
+            key = self._key_ring.get_signing_key()
+            encoded = KEY_RING_JWT.encode(
+                payload,
+                key.private_key,
+                algorithm=key.algorithm,
+                headers={u"kid": key.kid}
+            )
         # Return
         return encoded
 
@@ -59,13 +264,51 @@ class AuthManager(object):
 
     def get_token_data(self, token):
         """
-        :param token:
-        :return:
+        Verify a token and return its claims. Verified claims are kept in the token cache
+        (if any) until the token expires, so the signature is checked once per token. The
+        callers get their own copy (roles included), so they can't alter the cached claims.
+        The claims are cached with the kid of their key: a cached token is rejected as soon
+        as its key is retired.
+        :param token: The token to decode.
+        :return: The claims, None if the token is not valid.
         """
+        cache_key = None
+        if self._token_cache is not None:
+            cache_key = hashlib.sha256(
+                token if isinstance(token, bytes) else token.encode(u"utf-8")
+            ).hexdigest()
+            cached = self._token_cache.get(cache_key)
+            if cached is not None:
+                kid, decoded = cached
+                if self._key_ring is not None and self._key_ring.get_verification_key(kid) is None:
+                    return None
+                return copy_claims(decoded)
+
+        kid = None
         try:
-            decoded = jwt.decode(token, self._jwt_secret)
-        except jwt.ExpiredSignature:
-            return None
-        except jwt.DecodeError:
+            if self._key_ring is None:
+                decoded = jwt.decode(token, self._jwt_secret, algorithms=[u"HS256"])
+            else:
+                # The key (and so the only accepted algorithm) is chosen by the kid of the header.
+                kid = jwt.get_unverified_header(token).get(u"kid")
+                key = self._key_ring.get_verification_key(kid)
+                if key is None:
+                    return None
+                decoded = KEY_RING_JWT.decode(token, key.public_key, algorithms=[key.algorithm])
+        except jwt.InvalidTokenError:
             return None
+
+        if cache_key is not None and u"exp" in decoded:
+            ttl = decoded[u"exp"] - time.time()
+            if ttl > 0:
+                self._token_cache.set(cache_key, [kid, copy_claims(decoded)], ttl=ttl)
         return decoded
+
+    def get_jwks(self):
+        """
+        Get the public keys verifying the tokens.
+        :return (dict): The JSON Web Key Set, None if the tokens are signed with the shared secret.
+        """
+        if self._key_ring is None:
+            return None
+        return self._key_ring.get_jwks()
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+Contains the executor used to await password hashes from the asyncio API.
+"""
+
+import asyncio
+from sqlalchemy.util import await_only
+from .auth_exception import AuthHashTimeout
+
+
+class AwaitingHashExecutor(object):
+    """
+    Hash executor of the asyncio API. The hashes are computed by a HashExecutor, and awaited
+    without blocking the event loop (the caller runs in a greenlet, see AsyncDBSessionRegistry).
+    """
+
+    def __init__(self, hash_executor):
+        """
+        Constructor.
+        Args:
+            hash_executor (HashExecutor): The pool computing the hashes.
+        """
+        self._hash_executor = hash_executor
+
+    @property
+    def timeout(self):
+        """
+        Returns:
+            (float): How many seconds to wait for a hash.
+        """
+        return self._hash_executor.timeout
+
+    def submit(self, funct, *args):
+        """
+        Schedule a function in the pool.
+        Args:
+            funct (callable): A picklable (module level) function.
+            *args: The function arguments.
+
+        Returns:
+            (Future): The future result.
+
+        Raises:
+            (AuthHashQueueFull): If the queue is full.
+        """
+        return self._hash_executor.submit(funct, *args)
+
+    def result(self, future):
+        """
+        Await a future submitted to the pool.
+        Args:
+            future (Future): The future to wait for.
+
+        Returns:
+            (object): The result.
+
+        Raises:
+            (AuthHashTimeout): If the result is not ready in time.
+        """
+        try:
+            return await_only(asyncio.wait_for(asyncio.wrap_future(future), self.timeout))
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise AuthHashTimeout
+
+    def map(self, funct, *iterables, chunksize=16):
+        """
+        Run a function on every item of a batch, awaiting all the results.
+        Args:
+            funct (callable): A picklable (module level) function.
+            *iterables: The function arguments, one iterable per argument.
+            chunksize (int): How many items are sent to a process at once.
+
+        Returns:
+            (list): The results, in the order of the items.
+        """
+        return await_only(asyncio.get_running_loop().run_in_executor(
+            None, lambda: self._hash_executor.map(funct, *iterables, chunksize=chunksize)
+        ))
+
+    def shutdown(self, wait=True):
+        """
+        Stop the hashing processes.
+        Args:
+            wait (boolean): Wait for the pending hashes.
+        """
+        self._hash_executor.shutdown(wait=wait)
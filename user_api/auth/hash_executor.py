@@ -0,0 +1,100 @@
+# coding: utf-8
+"""
+Contains the executor used to compute password hashes out of the request thread.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from .auth_exception import AuthHashQueueFull, AuthHashTimeout
+
+
+class HashExecutor(object):
+    """
+    Process pool computing the (CPU bound) password hashes, so they don't hold the GIL
+    of the web worker. The number of hashes waiting for a process is bounded.
+    """
+
+    def __init__(self, max_workers=None, max_queue_depth=64, timeout=10):
+        """
+        Constructor.
+        Args:
+            max_workers (int): The number of hashing processes (number of CPUs if None).
+            max_queue_depth (int): How many hashes can wait for a free process before being rejected.
+            timeout (float): How many seconds to wait for a hash before giving up.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_depth)
+        self._timeout = timeout
+
+    @property
+    def timeout(self):
+        """
+        Returns:
+            (float): How many seconds to wait for a hash.
+        """
+        return self._timeout
+
+    def submit(self, funct, *args):
+        """
+        Schedule a function in the pool.
+        Args:
+            funct (callable): A picklable (module level) function.
+            *args: The function arguments.
+
+        Returns:
+            (Future): The future result.
+
+        Raises:
+            (AuthHashQueueFull): If the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise AuthHashQueueFull
+        try:
+            future = self._executor.submit(funct, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def result(self, future):
+        """
+        Wait for a future submitted to the pool.
+        Args:
+            future (Future): The future to wait for.
+
+        Returns:
+            (object): The result.
+
+        Raises:
+            (AuthHashTimeout): If the result is not ready in time.
+        """
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            future.cancel()
+            raise AuthHashTimeout
+
+    def map(self, funct, *iterables, chunksize=16):
+        """
+        Run a function on every item of a batch (bulk jobs), waiting for all the results.
+        The batch doesn't take queue slots, so it isn't rejected when the pool is busy.
+        Args:
+            funct (callable): A picklable (module level) function.
+            *iterables: The function arguments, one iterable per argument.
+            chunksize (int): How many items are sent to a process at once.
+
+        Returns:
+            (list): The results, in the order of the items.
+        """
+        return list(self._executor.map(funct, *iterables, chunksize=chunksize))
+
+    def shutdown(self, wait=True):
+        """
+        Stop the hashing processes.
+        Args:
+            wait (boolean): Wait for the pending hashes.
+        """
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,243 @@
+# coding: utf-8
+"""
+Contains the key ring used to sign the tokens with asymmetric keys.
+"""
+
+import json
+import time
+import base64
+import hashlib
+import threading
+import Crypto.Hash.SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import pkcs1_15
+from Crypto.Util.number import long_to_bytes
+from jwt.algorithms import Algorithm
+
+try:
+    # Ed25519 requires pycryptodome >= 3.15.
+    from Crypto.Signature import eddsa
+except ImportError:
+    eddsa = None
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode(u"ascii")
+
+
+class RSAAlgorithm(Algorithm):
+    """
+    RS256 (RSASSA-PKCS1-v1_5 with SHA-256) for PyJWT, with pycryptodome keys.
+    """
+
+    def prepare_key(self, key):
+        if isinstance(key, RSA.RsaKey):
+            return key
+        return RSA.import_key(key)
+
+    def sign(self, msg, key):
+        return pkcs1_15.new(key).sign(Crypto.Hash.SHA256.new(msg))
+
+    def verify(self, msg, key, sig):
+        try:
+            pkcs1_15.new(key).verify(Crypto.Hash.SHA256.new(msg), sig)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+class EdDSAAlgorithm(Algorithm):
+    """
+    EdDSA (Ed25519) for PyJWT, with pycryptodome keys.
+    """
+
+    def prepare_key(self, key):
+        if isinstance(key, ECC.EccKey):
+            return key
+        return ECC.import_key(key)
+
+    def sign(self, msg, key):
+        return eddsa.new(key, u"rfc8032").sign(msg)
+
+    def verify(self, msg, key, sig):
+        try:
+            eddsa.new(key, u"rfc8032").verify(msg, sig)
+            return True
+        except (ValueError, TypeError):
+            return False
+
+
+# Supported signing algorithms, by JWS name.
+ALGORITHMS = {
+    u"RS256": RSAAlgorithm()
+}
+if eddsa is not None:
+    ALGORITHMS[u"EdDSA"] = EdDSAAlgorithm()
+
+
+class JwtKey(object):
+    """
+    A key of the ring: a public key verifying tokens, with the private key if it can sign them.
+    """
+
+    def __init__(self, kid, algorithm, private_key=None, public_key=None, not_before=None, retire_at=None):
+        """
+        Constructor.
+        Args:
+            kid (unicode): The key ID, set in the header of the tokens.
+            algorithm (unicode): The signing algorithm (RS256 or EdDSA).
+            private_key (RsaKey|EccKey|unicode): The private key (or its PEM), None for a verification only key.
+            public_key (RsaKey|EccKey|unicode): The public key (or its PEM), taken from private_key if None.
+            not_before (float): When (timestamp) the key starts signing the tokens. Now if None.
+            retire_at (float): When (timestamp) the key stops verifying the tokens. Never if None.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(u"Unknown (or unavailable) signing algorithm '{}'.".format(algorithm))
+        if private_key is not None:
+            private_key = ALGORITHMS[algorithm].prepare_key(private_key)
+            if public_key is None:
+                # RsaKey.public_key only exists from pycryptodome 3.10, EccKey.publickey never did.
+                public_key = private_key.public_key() if hasattr(private_key, u"public_key") \
+                    else private_key.publickey()
+        if public_key is None:
+            raise ValueError(u"A key needs a public or a private key.")
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = ALGORITHMS[algorithm].prepare_key(public_key)
+        self.not_before = not_before if not_before is not None else time.time()
+        self.retire_at = retire_at
+
+    def can_sign(self, now):
+        return self.private_key is not None and self.not_before <= now and self.can_verify(now)
+
+    def can_verify(self, now):
+        return self.retire_at is None or now < self.retire_at
+
+    def to_jwk(self):
+        """
+        Returns:
+            (dict): The public key, as a JSON Web Key.
+        """
+        if self.algorithm == u"RS256":
+            jwk = {
+                u"kty": u"RSA",
+                u"n": _b64url(long_to_bytes(self.public_key.n)),
+                u"e": _b64url(long_to_bytes(self.public_key.e))
+            }
+        else:
+            jwk = {
+                u"kty": u"OKP",
+                u"crv": u"Ed25519",
+                u"x": _b64url(self.public_key.export_key(format=u"raw"))
+            }
+        jwk.update({
+            u"kid": self.kid,
+            u"alg": self.algorithm,
+            u"use": u"sig"
+        })
+        return jwk
+
+
+class KeyRing(object):
+    """
+    The keys signing and verifying the tokens. The newest active key with a private key signs,
+    every key not retired verifies (by the kid of the token header). To rotate, add a key
+    (possibly with a future not_before), then retire the previous one once the tokens it signed
+    have expired: live sessions are never invalidated.
+    """
+
+    def __init__(self, keys=None):
+        """
+        Constructor.
+        Args:
+            keys (list of JwtKey): The initial keys.
+        """
+        self._lock = threading.Lock()
+        self._keys = {}
+        for key in keys or []:
+            self.add_key(key)
+
+    def add_key(self, key):
+        """
+        Add a key to the ring.
+        Args:
+            key (JwtKey): The key.
+        """
+        with self._lock:
+            keys = dict(self._keys)
+            keys[key.kid] = key
+            self._keys = keys
+
+    def generate_key(self, algorithm=u"RS256", not_before=None, retire_at=None):
+        """
+        Generate a key and add it to the ring (its kid is its RFC 7638 thumbprint).
+        Args:
+            algorithm (unicode): The signing algorithm (RS256 or EdDSA).
+            not_before (float): When (timestamp) the key starts signing the tokens. Now if None.
+            retire_at (float): When (timestamp) the key stops verifying the tokens. Never if None.
+
+        Returns:
+            (JwtKey): The new key. Save key.private_key to load it again later.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(u"Unknown (or unavailable) signing algorithm '{}'.".format(algorithm))
+        if algorithm == u"RS256":
+            private_key = RSA.generate(2048)
+        else:
+            private_key = ECC.generate(curve=u"Ed25519")
+        key = JwtKey(None, algorithm, private_key, not_before=not_before, retire_at=retire_at)
+        jwk = key.to_jwk()
+        required = [u"e", u"kty", u"n"] if algorithm == u"RS256" else [u"crv", u"kty", u"x"]
+        key.kid = _b64url(hashlib.sha256(json.dumps(
+            {member: jwk[member] for member in required}, sort_keys=True, separators=(u",", u":")
+        ).encode(u"utf-8")).digest())
+        self.add_key(key)
+        return key
+
+    def retire_key(self, kid, retire_at=None):
+        """
+        Schedule the end of a key.
+        Args:
+            kid (unicode): The key ID.
+            retire_at (float): When (timestamp) the key stops verifying the tokens. Now if None.
+        """
+        self._keys[kid].retire_at = retire_at if retire_at is not None else time.time()
+
+    def get_signing_key(self):
+        """
+        Returns:
+            (JwtKey): The key signing the new tokens.
+
+        Raises:
+            (ValueError): If no key can sign.
+        """
+        now = time.time()
+        keys = [key for key in self._keys.values() if key.can_sign(now)]
+        if not keys:
+            raise ValueError(u"No active signing key in the key ring.")
+        return max(keys, key=lambda key: key.not_before)
+
+    def get_verification_key(self, kid):
+        """
+        Get the key verifying a token.
+        Args:
+            kid (unicode): The kid of the token header.
+
+        Returns:
+            (JwtKey): The key, None if unknown or retired.
+        """
+        key = self._keys.get(kid)
+        if key is None or not key.can_verify(time.time()):
+            return None
+        return key
+
+    def get_jwks(self):
+        """
+        Returns:
+            (dict): The public keys verifying the tokens, as a JSON Web Key Set.
+        """
+        now = time.time()
+        return {
+            u"keys": [key.to_jwk() for key in self._keys.values() if key.can_verify(now)]
+        }
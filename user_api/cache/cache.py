@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+Contains the cache interface.
+"""
+
+
+class Cache(object):
+    """
+    Interface of the caches used by the API. Missing and expired keys read as None.
+    """
+
+    def get(self, key):
+        """
+        Get a value.
+        Args:
+            key (hashable): The key of the value.
+
+        Returns:
+            (object): The value, None if missing or expired.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value.
+        Args:
+            key (hashable): The key of the value.
+            value (object): The value to store.
+            ttl (float): Seconds before the value expires (cache default if None).
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Remove a value, if present.
+        Args:
+            key (hashable): The key of the value.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Remove all the values.
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Returns:
+            (dict): The hit / miss counters of the cache.
+        """
+        raise NotImplementedError
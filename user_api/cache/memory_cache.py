@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+Contains the in-process cache.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from .cache import Cache
+
+
+class MemoryCache(Cache):
+    """
+    In-process LRU cache, with an optional expiration on each entry. Thread safe.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        Constructor.
+        Args:
+            max_size (int): The max number of entries, the least recently used are evicted first.
+            ttl (float): Default number of seconds before an entry expires (never if None).
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                u"hits": self._hits,
+                u"misses": self._misses,
+                u"evictions": self._evictions,
+                u"size": len(self._entries)
+            }
@@ -0,0 +1,67 @@
+# coding: utf-8
+"""
+Contains the Redis backed cache.
+"""
+
+import json
+import math
+import threading
+from .cache import Cache
+
+
+class RedisCache(Cache):
+    """
+    Cache shared between processes, stored in Redis (or any client exposing the redis-py
+    get / set / delete / scan_iter methods). Values are stored as JSON.
+    """
+
+    def __init__(self, client, prefix=u"user_api:", ttl=None):
+        """
+        Constructor.
+        Args:
+            client (redis.Redis): The client to the Redis server.
+            prefix (unicode): Prefix of the keys, to share the server with other applications.
+            ttl (float): Default number of seconds before an entry expires (never if None).
+        """
+        self._client = client
+        self._prefix = prefix
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _to_redis_key(self, key):
+        if isinstance(key, tuple):
+            key = u":".join(str(part) for part in key)
+        return u"{}{}".format(self._prefix, key)
+
+    def get(self, key):
+        value = self._client.get(self._to_redis_key(key))
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl if ttl is None else ttl
+        self._client.set(
+            self._to_redis_key(key),
+            json.dumps(value),
+            ex=int(math.ceil(ttl)) if ttl is not None else None
+        )
+
+    def delete(self, key):
+        self._client.delete(self._to_redis_key(key))
+
+    def clear(self):
+        for key in self._client.scan_iter(match=u"{}*".format(self._prefix)):
+            self._client.delete(key)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                u"hits": self._hits,
+                u"misses": self._misses
+            }
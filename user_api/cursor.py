@@ -0,0 +1,43 @@
+# coding: utf-8
+"""
+Contains the helpers building the opaque cursors used to page through listings.
+"""
+
+import json
+import base64
+import binascii
+
+
+def encode_cursor(last_id):
+    """
+    Build the cursor pointing after a row.
+    Args:
+        last_id (int): The ID of the last row returned.
+
+    Returns:
+        (unicode): The opaque cursor.
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps({u"id": last_id}).encode(u"utf-8")
+    ).decode(u"ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor built by encode_cursor.
+    Args:
+        cursor (unicode): The opaque cursor.
+
+    Returns:
+        (int): The ID to list after.
+
+    Raises:
+        (ValueError): If the cursor is malformed.
+    """
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode(u"ascii")).decode(u"utf-8"))[u"id"]
+    except (binascii.Error, UnicodeError, TypeError, KeyError, ValueError):
+        raise ValueError(u"Malformed cursor.")
+    if not isinstance(last_id, int):
+        raise ValueError(u"Malformed cursor.")
+    return last_id
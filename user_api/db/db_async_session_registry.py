@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the asyncio DB session registry.
+"""
+
+from contextlib import contextmanager
+from greenlet import getcurrent
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+
+class AsyncDBSessionRegistry(object):
+    """
+    Registry plugging the DB managers on an asyncio driver (aiomysql, asyncpg, aiosqlite...).
+    The managers keep their code: run executes them through AsyncSession.run_sync, where each
+    query awaits the driver instead of blocking the event loop. session_scope provides them
+    the session of the unit of work being run.
+    """
+
+    def __init__(
+            self,
+            url,
+            pool_size=None,
+            max_overflow=None,
+            pool_recycle=3600,
+            pool_pre_ping=False
+    ):
+        """
+        Constructor.
+        Args:
+            url (unicode): The construction URL to connect to the database, with an asyncio driver.
+            pool_size (int): The number of connections kept open in the pool (driver default if None).
+            max_overflow (int): The number of connections allowed over pool_size (driver default if None).
+            pool_recycle (int): Number of seconds after which a connection is recycled (-1 to disable).
+            pool_pre_ping (boolean): Test connections for liveness when checked out of the pool.
+        """
+        engine_options = {
+            u"pool_recycle": pool_recycle,
+            u"pool_pre_ping": pool_pre_ping
+        }
+        if pool_size is not None:
+            engine_options[u"pool_size"] = pool_size
+        if max_overflow is not None:
+            engine_options[u"max_overflow"] = max_overflow
+
+        self._async_engine = create_async_engine(url, **engine_options)
+        self._session_factory = sessionmaker(bind=self._async_engine, class_=AsyncSession)
+        # Session of the unit of work run by each greenlet.
+        self._sessions = {}
+
+    @property
+    def engine(self):
+        """
+        Returns:
+            (Engine): The synchronous facade of the engine (usable inside run only).
+        """
+        return self._async_engine.sync_engine
+
+    @property
+    def async_engine(self):
+        """
+        Returns:
+            (AsyncEngine): The engine shared by the managers.
+        """
+        return self._async_engine
+
+    async def run(self, funct, *args, **kwargs):
+        """
+        Run a synchronous function (a DB manager or UserApi method) in one unit of work,
+        without blocking the event loop on its queries.
+        Args:
+            funct (callable): The function to run.
+            *args: The function arguments.
+            **kwargs: The function keyword arguments.
+
+        Returns:
+            (object): The function result.
+        """
+        async with self._session_factory() as session:
+            return await session.run_sync(self._run_in_scope, funct, args, kwargs)
+
+    def _run_in_scope(self, session, funct, args, kwargs):
+        worker = getcurrent()
+        self._sessions[worker] = session
+        try:
+            return funct(*args, **kwargs)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            del self._sessions[worker]
+
+    def create_session(self):
+        """
+        Not supported: the sessions are bound to the units of work started by run.
+        """
+        raise NotImplementedError(u"Sessions of an asyncio registry are only available through run.")
+
+    def open_scope(self):
+        """
+        Nothing to do: each run is a unit of work.
+        """
+
+    def close_scope(self, exception=None):
+        """
+        Nothing to do: each run is a unit of work.
+        Args:
+            exception (Exception): The error which ended the unit of work, if any.
+        """
+
+    @contextmanager
+    def session_scope(self):
+        """
+        Provide the session of the unit of work being run.
+        Yields:
+            (Session): The session object.
+
+        Raises:
+            (RuntimeError): If called outside of run.
+        """
+        session = self._sessions.get(getcurrent())
+        if session is None:
+            raise RuntimeError(u"The DB managers of an asyncio registry must be called through run.")
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
@@ -29,3 +29,17 @@ class DBUserConflict(DBException):
         DBException.__init__(self, u"User conflict.")
 
 
+class DBRoleNotFound(DBException):
+    """
+    Raised if a role can't be found in the database.
+    """
+    def __init__(self):
+        DBException.__init__(self, u"Can't find role in the database.")
+
+
+class DBTokenNotFound(DBException):
+    """
+    Raised if a refresh token can't be found in the database (unknown, expired or already used).
+    """
+    def __init__(self):
+        DBException.__init__(self, u"Can't find token in the database.")
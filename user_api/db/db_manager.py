@@ -3,8 +3,8 @@
 Contains the DB manager.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from .db_session_registry import DBSessionRegistry
+from .role_catalogue import RoleCatalogue
 
 
 class DBManager(object):
@@ -14,23 +14,54 @@ class DBManager(object):
 
     def __init__(
             self,
-            url
+            url=None,
+            session_registry=None,
+            role_catalogue=None
     ):
         """
         Constructor.
         Args:
             url (unicode): The construction URL to connect to the database.
+            session_registry (DBSessionRegistry): A registry shared with other managers. Built from url if None.
+            role_catalogue (RoleCatalogue): A catalogue shared with other managers. Built if None.
         """
-        self._engine = create_engine(url)
+        if session_registry is None:
+            session_registry = DBSessionRegistry(url)
+        if role_catalogue is None:
+            role_catalogue = RoleCatalogue(session_registry)
+        self._session_registry = session_registry
+        self._engine = session_registry.engine
+        self._role_catalogue = role_catalogue
 
     def get_session(self):
         """
-        Returns a DB access session.
+        Returns a new DB access session. The caller is in charge of closing it.
         Returns:
             (Session): The session object.
         """
-        session = sessionmaker(self._engine)
-        return session()
+        return self._session_registry.create_session()
+
+    def session_scope(self):
+        """
+        Returns a context manager providing the session of the current unit of work.
+        Returns:
+            (contextmanager): Yields the session object.
+        """
+        return self._session_registry.session_scope()
+
+    def get_session_registry(self):
+        """
+        Returns:
+            (DBSessionRegistry): The registry the manager gets its sessions from.
+        """
+        return self._session_registry
+
+    def get_role_catalogue(self):
+        """
+        Returns:
+            (RoleCatalogue): The in-memory copy of the roles.
+        """
+        return self._role_catalogue
 
     @staticmethod
     def to_role_dict(role):
@@ -3,10 +3,10 @@
 Contains the DB Role manager.
 """
 
-from .models import Role, User
+from .models import User, user_has_role
 from .db_manager import DBManager
-from sqlalchemy import and_
-from sqlalchemy.orm import joinedload, load_only
+from .db_exception import DBRoleNotFound
+from sqlalchemy import and_, exists, literal, select
 
 
 class DBRoleManager(DBManager):
@@ -16,14 +16,18 @@ class DBRoleManager(DBManager):
 
     def __init__(
             self,
-            url
+            url=None,
+            session_registry=None,
+            role_catalogue=None
     ):
         """
         Constructor.
         Args:
             url (unicode): The construction URL to connect to the database.
+            session_registry (DBSessionRegistry): A registry shared with other managers. Built from url if None.
+            role_catalogue (RoleCatalogue): A catalogue shared with other managers. Built if None.
         """
-        DBManager.__init__(self, url)
+        DBManager.__init__(self, url, session_registry, role_catalogue)
 
     def get_user_roles(self, user_id):
         """
@@ -33,43 +37,112 @@ class DBRoleManager(DBManager):
         Returns:
             (list of dict): The list of roles.
         """
-        session = self.get_session()
-        user = session.query(User) \
-            .filter_by(id=user_id) \
-            .options(joinedload(u"roles"))\
-            .one()
-        return [
-            self.to_role_dict(role) for role in user.roles
-        ]
+        with self.session_scope() as session:
+            role_ids = [
+                row.role_id
+                for row in session.query(user_has_role.c.role_id).filter(user_has_role.c.user_id == user_id)
+            ]
+        return self._role_catalogue.get_roles(role_ids)
 
-    def list_roles(self, limit=20, offset=0):
+    def get_roles(self, role_ids):
         """
-        List the roles from the API.
+        Get roles from their IDs (from the role catalogue), skipping the unknown ones.
+        Args:
+            role_ids (iterable of int): The IDs of the roles.
+
+        Returns:
+            (list of dict): The roles, ordered by ID.
+        """
+        return self._role_catalogue.get_roles(role_ids)
+
+    def get_roles_by_codes(self, codes):
+        """
+        Get roles from their codes (from the role catalogue), skipping the unknown ones.
+        Args:
+            codes (iterable of unicode): The codes of the roles.
+
+        Returns:
+            (list of dict): The roles, ordered by ID.
+        """
+        return self._role_catalogue.get_roles_by_codes(codes)
+
+    def list_roles(self, limit=20, offset=0, after_id=None):
+        """
+        List the roles from the API, ordered by ID.
         Args:
             limit (int): The max number of returned roles.
-            offset (int): The cursor.
+            offset (int): The number of roles to skip (ignored if after_id is set).
+            after_id (int): Only list the roles with a greater ID (keyset pagination).
 
         Returns:
             (list of dict, boolean): A list of roles representations. The boolean stands for if there is more to fetch.
         """
-        session = self.get_session()
-        columns = [u"id", u"code", u"name"]
+        return self._role_catalogue.list_roles(limit, offset, after_id)
+
+    def count_roles(self):
+        """
+        Count the roles.
+        Returns:
+            (int): The number of roles.
+        """
+        return self._role_catalogue.count()
 
-        filters = []
+    def assign_role(self, customer_id: int, role_id: int, user_ids):
+        """
+        Give a role to users of a customer, with one INSERT ... SELECT.
+        The users which already have the role, or belong to another customer, are skipped.
+        Args:
+            customer_id (int): The customer the users must belong to.
+            role_id (int): The ID of the role to give.
+            user_ids (iterable of int): The IDs of the users.
 
-        roles = session.query(Role)\
-            .options(load_only(*columns))\
-            .filter(and_(*filters))\
-            .offset(offset)\
-            .limit(limit+1)
+        Returns:
+            (int): The number of users who got the role.
 
-        if roles.count() > limit:
-            roles = roles[:-1]
-            has_next = True
-        else:
-            has_next = False
+        Raises:
+            (DBRoleNotFound): If the role doesn't exist.
+        """
+        if self._role_catalogue.get_role(role_id) is None:
+            raise DBRoleNotFound
+        users_to_assign = select([User.id, literal(role_id)]).where(and_(
+            User.customer == customer_id,
+            User.id.in_(list(user_ids)),
+            ~exists().where(and_(
+                user_has_role.c.user_id == User.id,
+                user_has_role.c.role_id == role_id
+            ))
+        ))
+        with self.session_scope() as session:
+            result = session.execute(
+                user_has_role.insert().from_select([u"user_id", u"role_id"], users_to_assign)
+            )
+            session.commit()
+            return result.rowcount
 
-        return [
-            self.to_role_dict(role)
-            for role in roles
-        ], has_next
+    def revoke_role(self, customer_id: int, role_id: int, user_ids):
+        """
+        Remove a role from users of a customer, with one DELETE.
+        Args:
+            customer_id (int): The customer the users must belong to.
+            role_id (int): The ID of the role to remove.
+            user_ids (iterable of int): The IDs of the users.
+
+        Returns:
+            (int): The number of users who lost the role.
+
+        Raises:
+            (DBRoleNotFound): If the role doesn't exist.
+        """
+        if self._role_catalogue.get_role(role_id) is None:
+            raise DBRoleNotFound
+        customer_users = select([User.id]).where(and_(
+            User.customer == customer_id,
+            User.id.in_(list(user_ids))
+        ))
+        with self.session_scope() as session:
+            result = session.execute(user_has_role.delete().where(and_(
+                user_has_role.c.role_id == role_id,
+                user_has_role.c.user_id.in_(customer_users)
+            )))
+            session.commit()
+            return result.rowcount
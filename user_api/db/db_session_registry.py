@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the DB session registry.
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+class DBSessionRegistry(object):
+    """
+    Holds the engine (and so the connection pool) and the session factory
+    shared by all the DB managers plugged on the same database.
+    """
+
+    def __init__(
+            self,
+            url,
+            pool_size=None,
+            max_overflow=None,
+            pool_recycle=3600,
+            pool_pre_ping=False
+    ):
+        """
+        Constructor.
+        Args:
+            url (unicode): The construction URL to connect to the database.
+            pool_size (int): The number of connections kept open in the pool (driver default if None).
+            max_overflow (int): The number of connections allowed over pool_size (driver default if None).
+            pool_recycle (int): Number of seconds after which a connection is recycled (-1 to disable).
+            pool_pre_ping (boolean): Test connections for liveness when checked out of the pool
+                (one more round trip per checkout, off by default: pool_recycle drops the stale ones).
+        """
+        engine_options = {
+            u"pool_recycle": pool_recycle,
+            u"pool_pre_ping": pool_pre_ping
+        }
+        # Not every pool accepts a size (SQLite ones for example).
+        if pool_size is not None:
+            engine_options[u"pool_size"] = pool_size
+        if max_overflow is not None:
+            engine_options[u"max_overflow"] = max_overflow
+
+        self._engine = create_engine(url, **engine_options)
+        self._session_factory = sessionmaker(bind=self._engine)
+        # Thread local registry holding the session of the current unit of work.
+        self._scoped_session = scoped_session(self._session_factory)
+
+    @property
+    def engine(self):
+        """
+        Returns:
+            (Engine): The engine shared by the managers.
+        """
+        return self._engine
+
+    def create_session(self):
+        """
+        Returns a new DB access session.
+        Returns:
+            (Session): The session object.
+        """
+        return self._session_factory()
+
+    def open_scope(self):
+        """
+        Bind a session to the current thread (for example for the time of a request).
+        Every session_scope opened until close_scope is called shares this session.
+        """
+        self._scoped_session()
+
+    def close_scope(self, exception=None):
+        """
+        Release the session bound by open_scope, and return its connection to the pool.
+        Args:
+            exception (Exception): The error which ended the unit of work, if any.
+        """
+        if not self._scoped_session.registry.has():
+            return
+        try:
+            if exception is not None:
+                self._scoped_session.rollback()
+        finally:
+            self._scoped_session.remove()
+
+    @contextmanager
+    def session_scope(self):
+        """
+        Provide a session for a unit of work.
+        If a session is already bound to the current thread it is reused, else a new one
+        is opened and closed on exit. The session is rolled back if an error is raised.
+        Yields:
+            (Session): The session object.
+        """
+        owner = not self._scoped_session.registry.has()
+        session = self._scoped_session()
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            if owner:
+                self._scoped_session.remove()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the DB Token manager.
+"""
+
+import time
+from .models import RefreshToken, User, user_has_role
+from .db_manager import DBManager
+from .db_exception import DBTokenNotFound
+
+
+class DBTokenManager(DBManager):
+    """
+    Handles the refresh tokens in the database.
+    """
+
+    def __init__(
+            self,
+            url=None,
+            session_registry=None,
+            role_catalogue=None
+    ):
+        """
+        Constructor.
+        Args:
+            url (unicode): The construction URL to connect to the database.
+            session_registry (DBSessionRegistry): A registry shared with other managers. Built from url if None.
+            role_catalogue (RoleCatalogue): A catalogue shared with other managers. Built if None.
+        """
+        DBManager.__init__(self, url, session_registry, role_catalogue)
+
+    def save_refresh_token(self, user_id, token_hash, expires_at):
+        """
+        Save a new refresh token.
+        Args:
+            user_id (int): The ID of the user the token is given to.
+            token_hash (unicode): The hash of the token.
+            expires_at (int): The expiration timestamp of the token.
+        """
+        with self.session_scope() as session:
+            session.add(RefreshToken(user_id=user_id, token_hash=token_hash, expires_at=expires_at))
+            session.commit()
+
+    def rotate_refresh_token(self, token_hash, new_token_hash, expires_at):
+        """
+        Use a refresh token: read its user (with roles) in one query, then replace it by a new one.
+        Args:
+            token_hash (unicode): The hash of the used token.
+            new_token_hash (unicode): The hash of the token replacing it.
+            expires_at (int): The expiration timestamp of the new token.
+
+        Returns:
+            (dict): The user (with roles).
+
+        Raises:
+            (DBTokenNotFound): If the token is unknown, expired or has already been used, or if
+                the user is not active (nothing is written then).
+        """
+        with self.session_scope() as session:
+            rows = session.query(
+                User.id,
+                User.email,
+                User.name,
+                User.active,
+                User.customer,
+                user_has_role.c.role_id
+            ).join(RefreshToken, RefreshToken.user_id == User.id)\
+                .outerjoin(user_has_role, user_has_role.c.user_id == User.id)\
+                .filter(
+                    RefreshToken.token_hash == token_hash,
+                    RefreshToken.expires_at > int(time.time()),
+                    User.active.is_(True)
+                )\
+                .all()
+            if not rows:
+                raise DBTokenNotFound
+
+            # Only one of concurrent uses of the token can delete it.
+            if not session.query(RefreshToken).filter(RefreshToken.token_hash == token_hash)\
+                    .delete(synchronize_session=False):
+                raise DBTokenNotFound
+            user_id = rows[0].id
+            session.add(RefreshToken(user_id=user_id, token_hash=new_token_hash, expires_at=expires_at))
+            session.commit()
+
+        return {
+            u"id": user_id,
+            u"email": rows[0].email,
+            u"name": rows[0].name,
+            u"active": rows[0].active,
+            u"customer": {
+                u"id": rows[0].customer
+            },
+            u"roles": self._role_catalogue.get_roles(row.role_id for row in rows if row.role_id is not None)
+        }
+
+    def delete_refresh_token(self, token_hash):
+        """
+        Delete a refresh token.
+        Args:
+            token_hash (unicode): The hash of the token.
+
+        Returns:
+            (int): The number of deleted tokens.
+        """
+        with self.session_scope() as session:
+            count = session.query(RefreshToken).filter(RefreshToken.token_hash == token_hash)\
+                .delete(synchronize_session=False)
+            session.commit()
+            return count
+
+    def delete_user_refresh_tokens(self, user_id):
+        """
+        Delete all the refresh tokens of a user.
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            (int): The number of deleted tokens.
+        """
+        with self.session_scope() as session:
+            count = session.query(RefreshToken).filter(RefreshToken.user_id == user_id)\
+                .delete(synchronize_session=False)
+            session.commit()
+            return count
+
+    def delete_expired_refresh_tokens(self):
+        """
+        Delete the expired refresh tokens.
+        Returns:
+            (int): The number of deleted tokens.
+        """
+        with self.session_scope() as session:
+            count = session.query(RefreshToken).filter(RefreshToken.expires_at <= int(time.time()))\
+                .delete(synchronize_session=False)
+            session.commit()
+            return count
@@ -7,13 +7,17 @@ from .db_exception import (
     DBUserConflict,
     DBUserNotFound
 )
+import copy
 from typing import List
-from .models import User, Role
+from .models import User, user_has_role
 from sqlalchemy import exc
 from .db_manager import DBManager
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func
 from sqlalchemy.orm import load_only, exc as orm_exc, joinedload, noload
 
+# How the email / name filters of the listings can be matched.
+MATCH_MODES = (u"prefix", u"contains", u"search")
+
 
 class DBUserManager(DBManager):
     """
@@ -22,14 +26,24 @@ class DBUserManager(DBManager):
 
     def __init__(
             self,
-            url
+            url=None,
+            session_registry=None,
+            role_catalogue=None,
+            count_cache=None,
+            user_cache=None
     ):
         """
         Constructor.
         Args:
             url (string): The construction URL to connect to the database.
+            session_registry (DBSessionRegistry): A registry shared with other managers. Built from url if None.
+            role_catalogue (RoleCatalogue): A catalogue shared with other managers. Built if None.
+            count_cache (Cache): Optional cache of the listing counts.
+            user_cache (Cache): Optional cache of the user profiles, by (ID, with roles).
         """
-        DBManager.__init__(self, url)
+        DBManager.__init__(self, url, session_registry, role_catalogue)
+        self._count_cache = count_cache
+        self._user_cache = user_cache
 
     def to_user_dict(self, user, with_roles=False):
         """
@@ -68,19 +82,122 @@ class DBUserManager(DBManager):
         except ValueError:
             filters[u"email"] = user_id
 
-        session = self.get_session()
-        columns = [u"id", u"email", u"name", u"active"]
+        # Only the lookups by ID are cached.
+        cache_key = None
+        if self._user_cache is not None and u"id" in filters:
+            cache_key = self._get_user_cache_key(filters[u"id"], with_roles)
+            user = self._user_cache.get(cache_key)
+            if user is not None:
+                return copy.deepcopy(user)
 
-        try:
-            options = [load_only(*columns)]
+        columns = [u"id", u"email", u"name", u"active", u"customer"]
+
+        with self.session_scope() as session:
+            try:
+                options = [load_only(*columns)]
+                if with_roles:
+                    options.append(joinedload(User.roles))
+
+                user = session.query(User).filter_by(**filters).options(*options).one()
+                user = self.to_user_dict(user, with_roles)
+
+            except orm_exc.NoResultFound:
+                raise DBUserNotFound
+
+        if cache_key is not None:
+            self._user_cache.set(cache_key, copy.deepcopy(user))
+        return user
+
+    def get_users_information(self, customer_id: int, user_ids, with_roles=False):
+        """
+        Get the information of several users of a customer at once (one query, plus one for the roles).
+        The users found in the profile cache are not read again.
+        Args:
+            customer_id (int): The customer the users must belong to.
+            user_ids (iterable of int): The IDs of the users.
+            with_roles (boolean): Fetch the roles with the users.
+
+        Returns:
+            (dict): The users by ID. Unknown IDs, and users of other customers, are left out.
+        """
+        users = {}
+        to_read = set(user_ids)
+        if self._user_cache is not None:
+            for user_id in list(to_read):
+                user = self._user_cache.get(self._get_user_cache_key(user_id, with_roles))
+                if user is not None:
+                    to_read.discard(user_id)
+                    if user[u"customer"][u"id"] == customer_id:
+                        users[user_id] = copy.deepcopy(user)
+        if not to_read:
+            return users
+
+        columns = [u"id", u"email", u"name", u"active", u"customer"]
+
+        with self.session_scope() as session:
+            read_users = [
+                self.to_user_dict(user, with_roles=False)
+                for user in session.query(User)
+                    .options(load_only(*columns), noload(u"roles"))
+                    .filter(User.customer == customer_id, User.id.in_(list(to_read)))
+            ]
             if with_roles:
-                options.append(joinedload(User.roles))
+                self._add_roles(session, read_users)
+
+        for user in read_users:
+            users[user[u"id"]] = user
+            if self._user_cache is not None:
+                self._user_cache.set(self._get_user_cache_key(user[u"id"], with_roles), copy.deepcopy(user))
+        return users
+
+    @staticmethod
+    def _get_user_cache_key(user_id, with_roles):
+        return u"user", user_id, bool(with_roles)
+
+    def invalidate_users(self, user_ids):
+        """
+        Remove users from the profile cache.
+        Args:
+            user_ids (iterable of int): The IDs of the users.
+        """
+        if self._user_cache is None:
+            return
+        for user_id in user_ids:
+            for with_roles in (False, True):
+                self._user_cache.delete(self._get_user_cache_key(user_id, with_roles))
+
+    def get_cache_stats(self):
+        """
+        Returns:
+            (dict): The hit / miss counters of the profile and count caches (None if disabled).
+        """
+        return {
+            u"users": self._user_cache.get_stats() if self._user_cache is not None else None,
+            u"counts": self._count_cache.get_stats() if self._count_cache is not None else None
+        }
+
+    def get_user_credentials(self, email):
+        """
+        Get everything needed to authenticate a user in one query.
+        Args:
+            email (string): The email of the user to authenticate.
 
-            user = session.query(User).filter_by(**filters).options(*options).one()
-            return self.to_user_dict(user, with_roles)
+        Returns:
+            (dict, string, string): The user information (with roles), the salt and the hash.
+        """
+        columns = [u"id", u"email", u"name", u"active", u"customer", u"salt", u"hash"]
+
+        with self.session_scope() as session:
+            try:
+                user = session.query(User)\
+                    .filter_by(email=email)\
+                    .options(load_only(*columns), joinedload(User.roles))\
+                    .one()
+
+            except orm_exc.NoResultFound:
+                raise DBUserNotFound
 
-        except orm_exc.NoResultFound:
-            raise DBUserNotFound
+            return self.to_user_dict(user, with_roles=True), user.salt, user.hash
 
     def update_user_information(self, email, name, active, user_id, roles=None):
         """
@@ -96,46 +213,60 @@ class DBUserManager(DBManager):
             (dict): The updated user.
         """
 
-        session = self.get_session()
-        try:
-
-            if roles is not None:
-
-                user = session.query(User).filter_by(id=user_id).options(joinedload(User.roles)).one()
-                to_save_role_ids = [role.get(u"id") for role in roles]
-                saved_role_ids = [role.id for role in user.roles]
-
-                # Remove
-                for role in reversed(list(user.roles)):
-                    if role.id not in to_save_role_ids:
-                        user.roles.remove(role)
-
-                # Add
-                role_ids_to_add = [
-                    role_id
-                    for role_id in to_save_role_ids
-                    if role_id not in saved_role_ids
-                ]
-
-                roles_to_add = session.query(Role).filter(Role.id.in_(role_ids_to_add)).all()
-                for role in roles_to_add:
-                    user.roles.append(role)
-
-            session.query(User)\
-                .filter_by(id=user_id)\
-                .update({
-                    u"email": email,
-                    u"name": name,
-                    u"active": active
-                })
-            session.commit()
-        except exc.IntegrityError:
-            raise DBUserConflict
-        except orm_exc.NoResultFound:
-            raise DBUserNotFound
-
-        session.commit()
-        return self.get_user_information(user_id, with_roles=True)
+        with self.session_scope() as session:
+            try:
+                # One query for the existence of the user, their customer and their current roles.
+                rows = session.query(User.customer, user_has_role.c.role_id)\
+                    .outerjoin(user_has_role, user_has_role.c.user_id == User.id)\
+                    .filter(User.id == user_id)\
+                    .all()
+                if not rows:
+                    raise DBUserNotFound
+                customer_id = rows[0].customer
+                role_ids = {row.role_id for row in rows if row.role_id is not None}
+
+                session.query(User)\
+                    .filter_by(id=user_id)\
+                    .update({
+                        u"email": email,
+                        u"name": name,
+                        u"active": active
+                    }, synchronize_session=False)
+
+                if roles is not None:
+                    to_save_role_ids = {role.get(u"id") for role in roles}
+                    role_ids_to_remove = role_ids - to_save_role_ids
+                    # Unknown roles are skipped, as the catalogue knows every role.
+                    role_ids_to_add = {
+                        role[u"id"] for role in self._role_catalogue.get_roles(to_save_role_ids - role_ids)
+                    }
+                    if role_ids_to_remove:
+                        session.execute(user_has_role.delete().where(and_(
+                            user_has_role.c.user_id == user_id,
+                            user_has_role.c.role_id.in_(role_ids_to_remove)
+                        )))
+                    if role_ids_to_add:
+                        session.execute(user_has_role.insert(), [
+                            {u"user_id": user_id, u"role_id": role_id}
+                            for role_id in role_ids_to_add
+                        ])
+                    role_ids = (role_ids - role_ids_to_remove) | role_ids_to_add
+
+                session.commit()
+            except exc.IntegrityError:
+                raise DBUserConflict
+
+        self.invalidate_users([user_id])
+        return {
+            u"id": user_id,
+            u"email": email,
+            u"name": name,
+            u"active": active,
+            u"roles": self._role_catalogue.get_roles(role_ids),
+            u"customer": {
+                u"id": customer_id
+            }
+        }
 
     def get_user_salt(self, email):
         """
@@ -146,14 +277,14 @@ class DBUserManager(DBManager):
         Returns:
             (string): The salt.
         """
-        session = self.get_session()
-        try:
-            user = session.query(User).filter_by(email=email).options(load_only(u"salt")).one()
+        with self.session_scope() as session:
+            try:
+                user = session.query(User).filter_by(email=email).options(load_only(u"salt")).one()
 
-        except orm_exc.NoResultFound:
-            raise DBUserNotFound
+            except orm_exc.NoResultFound:
+                raise DBUserNotFound
 
-        return user.salt
+            return user.salt
 
     def modify_hash_salt(self, email, hash, salt):
         """
@@ -163,12 +294,17 @@ class DBUserManager(DBManager):
             hash (string): The hash (password).
             salt (string): The salt associated with the hash before saving.
         """
-        session = self.get_session()
-        session.query(User)\
-            .filter_by(email=email)\
-            .update({User.hash: hash, User.salt: salt})
+        with self.session_scope() as session:
+            user_ids = []
+            if self._user_cache is not None:
+                user_ids = [row.id for row in session.query(User.id).filter_by(email=email)]
 
-        session.commit()
+            session.query(User)\
+                .filter_by(email=email)\
+                .update({User.hash: hash, User.salt: salt})
+
+            session.commit()
+        self.invalidate_users(user_ids)
 
     def save_new_user(
             self, 
@@ -194,29 +330,121 @@ class DBUserManager(DBManager):
         Raises:
             (ValueError): if user breaks a constraint.
         """
-        try:
-            session = self.get_session()
-
-            roles_to_add = session.query(Role).filter(Role.id.in_([
-                role[u"id"] for role in roles
-            ])).all()
-
-
-            user = User(
-                email=email,
-                name=name,
-                active=active,
-                hash=hash,
-                salt=salt,
-                roles=roles_to_add,
-                customer=customer_id
-            )
-            session.add(user)
-            session.commit()
-            return self.get_user_information(user_id=user.id, with_roles=True)
+        with self.session_scope() as session:
+            try:
+                roles_to_add = self._role_catalogue.get_roles(role[u"id"] for role in roles)
+
+                user = User(
+                    email=email,
+                    name=name,
+                    active=active,
+                    hash=hash,
+                    salt=salt,
+                    customer=customer_id
+                )
+                session.add(user)
+                session.flush()
+                if roles_to_add:
+                    session.execute(user_has_role.insert(), [
+                        {u"user_id": user.id, u"role_id": role[u"id"]}
+                        for role in roles_to_add
+                    ])
+                user_id = user.id
+                session.commit()
+                self.invalidate_users([user_id])
+                return {
+                    u"id": user_id,
+                    u"email": email,
+                    u"name": name,
+                    u"active": active,
+                    u"roles": roles_to_add,
+                    u"customer": {
+                        u"id": customer_id
+                    }
+                }
 
-        except exc.IntegrityError as err:
-            raise DBUserConflict
+            except exc.IntegrityError as err:
+                raise DBUserConflict
+
+    def save_new_users(self, customer_id: int, users: List[dict]):
+        """
+        Save a batch of new users in one transaction, with batched inserts.
+        The users whose email is already taken are reported instead of failing the batch.
+        Args:
+            customer_id (int): The customer related to the users.
+            users (list of dict): The users to save (email, name, active, hash, salt, roles).
+
+        Returns:
+            (list of dict, list of (int, DBException)): The created users, and the errors
+                with the position of the failing user in the batch.
+        """
+        errors = []
+        with self.session_scope() as session:
+            emails = [user[u"email"] for user in users]
+            taken_emails = {
+                row.email for row in session.query(User.email).filter(User.email.in_(emails))
+            }
+            to_save = []
+            for index, user in enumerate(users):
+                if user[u"email"] in taken_emails:
+                    errors.append((index, DBUserConflict()))
+                    continue
+                taken_emails.add(user[u"email"])
+                to_save.append((index, user))
+            if not to_save:
+                return [], errors
+
+            try:
+                session.execute(User.__table__.insert(), [
+                    {
+                        u"email": user[u"email"],
+                        u"name": user[u"name"],
+                        u"active": user[u"active"],
+                        u"hash": user[u"hash"],
+                        u"salt": user[u"salt"],
+                        u"customer_id": customer_id
+                    }
+                    for _, user in to_save
+                ])
+                # executemany doesn't return the generated IDs.
+                ids_by_email = dict(
+                    session.query(User.email, User.id).filter(User.email.in_([
+                        user[u"email"] for _, user in to_save
+                    ])).all()
+                )
+                created = []
+                role_rows = []
+                for _, user in to_save:
+                    roles = self._role_catalogue.get_roles(role[u"id"] for role in user[u"roles"] or [])
+                    user_id = ids_by_email[user[u"email"]]
+                    role_rows.extend({u"user_id": user_id, u"role_id": role[u"id"]} for role in roles)
+                    created.append({
+                        u"id": user_id,
+                        u"email": user[u"email"],
+                        u"name": user[u"name"],
+                        u"active": user[u"active"],
+                        u"roles": roles,
+                        u"customer": {
+                            u"id": customer_id
+                        }
+                    })
+                if role_rows:
+                    session.execute(user_has_role.insert(), role_rows)
+                session.commit()
+                return created, errors
+
+            except exc.IntegrityError:
+                session.rollback()
+
+            # A user has been created meanwhile: save them one by one to find the culprits.
+            created = []
+            for index, user in to_save:
+                try:
+                    created.append(self.save_new_user(customer_id=customer_id, **user))
+                except DBUserConflict as err:
+                    errors.append((index, err))
+            errors.sort(key=lambda error: error[0])
+            return created, errors
 
     def is_user_hash_valid(self, email, hash):
         """
@@ -228,50 +456,182 @@ class DBUserManager(DBManager):
         Returns:
             (boolean): If the hash is valid or not.
         """
-        session = self.get_session()
-        user = session.query(User).filter_by(email=email).options(load_only(u"hash")).one()
+        with self.session_scope() as session:
+            user = session.query(User).filter_by(email=email).options(load_only(u"hash")).one()
 
-        return False if (user is None or hash != user.hash) else True
+            return False if (user is None or hash != user.hash) else True
 
-    def list_users(self, customer_id: int, limit=20, offset=0, email=None, name=None):
+    @staticmethod
+    def _get_match_filter(column, value, match=u"contains"):
         """
-        List the users from the API.
+        Build the LIKE filter of a column.
+        Args:
+            column (Column): The column to filter on.
+            value (string): The value to look for (wildcards are escaped).
+            match (string): "prefix" (LIKE 'x%', uses btree indexes), "contains" (LIKE '%x%')
+                or "search" (case insensitive, uses the trigram indexes on PostgreSQL).
+
+        Returns:
+            (BinaryExpression): The filter.
+        """
+        value = value.replace(u"\\", u"\\\\").replace(u"%", u"\\%").replace(u"_", u"\\_")
+        if match == u"prefix":
+            return column.like(u"{}%".format(value), escape=u"\\")
+        if match == u"search":
+            return column.ilike(u"%{}%".format(value), escape=u"\\")
+        return column.like(u"%{}%".format(value), escape=u"\\")
+
+    def _get_list_users_filter(self, customer_id: int, email=None, name=None, match=u"contains"):
+        """
+        Build the filter used to list the users: the customer, and then any of the email / name filters.
         Args:
             customer_id (int): The corresponding customer id.
-            limit (int): The max number of returned users.
-            offset (int): The cursor.
             email (string): An email to filter on.
             name (string): A name to filter on.
+            match (string): How email and name are matched (prefix, contains or search).
 
         Returns:
-            (list of dict, boolean): A list of user representations. The boolean stands for if there is more to fetch.
+            (BooleanClauseList): The filter.
         """
-        session = self.get_session()
-        columns = [u"id", u"email", u"name", u"active"]
-
         filters = []
         if email is not None:
-            filters.append(User.email.like(u"%{}%".format(email)))
+            filters.append(self._get_match_filter(User.email, email, match))
 
         if name is not None:
-            filters.append(User.name.like(u"%{}%".format(name)))
-
-        filters.append(User.customer==customer_id)
-        
-        users = session.query(User)\
-            .options(load_only(*columns), noload(u"roles"))\
-            .filter(or_(*filters))\
-            .offset(offset)\
-            .limit(limit+1)
-
-        if users.count() > limit:
-            users = users[:-1]
-            has_next = True
-        else:
-            has_next = False
-
-        return [
-            self.to_user_dict(user, with_roles=False)
-            for user in users
-        ], has_next
+            filters.append(self._get_match_filter(User.name, name, match))
 
+        if not filters:
+            return User.customer == customer_id
+        return and_(User.customer == customer_id, or_(*filters))
+
+    def list_users(
+            self,
+            customer_id: int,
+            limit=20,
+            offset=0,
+            email=None,
+            name=None,
+            after_id=None,
+            match=u"contains"
+        ):
+        """
+        List the users from the API, ordered by ID.
+        Args:
+            customer_id (int): The corresponding customer id.
+            limit (int): The max number of returned users.
+            offset (int): The number of users to skip (ignored if after_id is set).
+            email (string): An email to filter on.
+            name (string): A name to filter on.
+            after_id (int): Only list the users with a greater ID (keyset pagination).
+            match (string): How email and name are matched (prefix, contains or search).
+
+        Returns:
+            (list of dict, boolean): A list of user representations. The boolean stands for if there is more to fetch.
+        """
+        columns = [u"id", u"email", u"name", u"active", u"customer"]
+
+        with self.session_scope() as session:
+            users = session.query(User)\
+                .options(load_only(*columns), noload(u"roles"))\
+                .filter(self._get_list_users_filter(customer_id, email, name, match))\
+                .order_by(User.id)
+
+            if after_id is not None:
+                users = users.filter(User.id > after_id)
+            else:
+                users = users.offset(offset)
+
+            # One more row than asked tells if there is a next page.
+            users = users.limit(limit+1).all()
+            has_next = len(users) > limit
+
+            return [
+                self.to_user_dict(user, with_roles=False)
+                for user in users[:limit]
+            ], has_next
+
+    def iter_users(
+            self,
+            customer_id: int,
+            email=None,
+            name=None,
+            match=u"contains",
+            with_roles=False,
+            batch_size=1000
+        ):
+        """
+        Go through all the users of a customer, ordered by ID (exports).
+        The users are read by batches of batch_size, one keyset query each (plus one for the roles),
+        so only one batch is held in memory and no connection is held between two batches
+        (even by a session bound to the request).
+        Args:
+            customer_id (int): The corresponding customer id.
+            email (string): An email to filter on.
+            name (string): A name to filter on.
+            match (string): How email and name are matched (prefix, contains or search).
+            with_roles (boolean): Add the roles to the users.
+            batch_size (int): How many users are read at once.
+
+        Yields:
+            (dict): The users.
+        """
+        after_id = None
+        has_next = True
+        while has_next:
+            with self.session_scope() as session:
+                users, has_next = self.list_users(
+                    customer_id, batch_size, email=email, name=name, after_id=after_id, match=match
+                )
+                if with_roles:
+                    self._add_roles(session, users)
+                # Ends the read transaction: a session bound for the whole request (streamed
+                # export) gives its connection back to the pool until the next batch.
+                session.commit()
+            if users:
+                after_id = users[-1][u"id"]
+            for user in users:
+                yield user
+
+    def _add_roles(self, session, users):
+        """
+        Set the roles of users, with one query for all of them.
+        Args:
+            session (Session): The session to query with.
+            users (list of dict): The users to complete.
+        """
+        role_ids_by_user = {user[u"id"]: [] for user in users}
+        if not role_ids_by_user:
+            return
+        rows = session.query(user_has_role.c.user_id, user_has_role.c.role_id)\
+            .filter(user_has_role.c.user_id.in_(list(role_ids_by_user)))
+        for row in rows:
+            role_ids_by_user[row.user_id].append(row.role_id)
+        for user in users:
+            user[u"roles"] = self._role_catalogue.get_roles(role_ids_by_user[user[u"id"]])
+
+    def count_users(self, customer_id: int, email=None, name=None, match=u"contains"):
+        """
+        Count the users a listing would go through. Served from the count cache when possible.
+        Args:
+            customer_id (int): The corresponding customer id.
+            email (string): An email to filter on.
+            name (string): A name to filter on.
+            match (string): How email and name are matched (prefix, contains or search).
+
+        Returns:
+            (int): The number of users.
+        """
+        cache_key = (u"users", customer_id, email, name, match)
+        if self._count_cache is not None:
+            count = self._count_cache.get(cache_key)
+            if count is not None:
+                return count
+
+        with self.session_scope() as session:
+            count = session.query(func.count(User.id))\
+                .filter(self._get_list_users_filter(customer_id, email, name, match))\
+                .scalar()
+
+        if self._count_cache is not None:
+            self._count_cache.set(cache_key, count)
+        return count
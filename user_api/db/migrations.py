@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the schema migrations, applied to upgrade databases created by older versions.
+"""
+
+from sqlalchemy import inspect, text
+from .models import SchemaSpec, RefreshToken, TokenRevocation, User, user_has_role, POSTGRESQL_SEARCH_INDEXES_DDL
+
+# Schema version of the databases created before the migrations were recorded.
+INITIAL_SCHEMA_VERSION = u"1.0.0"
+
+
+def _to_version_tuple(version):
+    return tuple(int(part) for part in version.split(u"."))
+
+
+def _create_index(connection, table, name):
+    """
+    Create an index declared in the models, if it doesn't exist yet.
+    """
+    existing_indexes = [index[u"name"] for index in inspect(connection).get_indexes(table.name)]
+    if name not in existing_indexes:
+        index = next(index for index in table.indexes if index.name == name)
+        index.create(bind=connection)
+
+
+def add_search_indexes(connection):
+    """
+    1.1.0: Indexes for tenant listings and prefix / substring searches.
+    """
+    _create_index(connection, User.__table__, u"ix__user_customer_name")
+    if connection.dialect.name == u"postgresql":
+        for statement in POSTGRESQL_SEARCH_INDEXES_DDL:
+            connection.execute(statement)
+
+
+def add_lookup_indexes(connection):
+    """
+    1.2.0: Customer index on the users, primary key and reverse index on user_has_role.
+    """
+    _create_index(connection, User.__table__, u"ix__user_customer_id")
+    _create_index(connection, user_has_role, u"ix_user_has_role_role_id")
+
+    if inspect(connection).get_pk_constraint(user_has_role.name)[u"constrained_columns"]:
+        return
+    # Remove the duplicated (or incomplete) associations the missing key allowed. In place, with
+    # DML only: no implicit commit on MySQL, so a failure rolls back and the step can run again.
+    connection.execute(u"DELETE FROM user_has_role WHERE user_id IS NULL OR role_id IS NULL")
+    duplicates = connection.execute(
+        u"SELECT user_id, role_id FROM user_has_role GROUP BY user_id, role_id HAVING COUNT(*) > 1"
+    ).fetchall()
+    # The copies of a pair can't be told apart (no key): delete them all, then add one back.
+    for user_id, role_id in duplicates:
+        parameters = {u"user_id": user_id, u"role_id": role_id}
+        connection.execute(
+            text(u"DELETE FROM user_has_role WHERE user_id = :user_id AND role_id = :role_id"), parameters
+        )
+        connection.execute(
+            text(u"INSERT INTO user_has_role (user_id, role_id) VALUES (:user_id, :role_id)"), parameters
+        )
+    if connection.dialect.name == u"sqlite":
+        # SQLite can't add a primary key to an existing table.
+        connection.execute(u"CREATE UNIQUE INDEX ux_user_has_role ON user_has_role (user_id, role_id)")
+    else:
+        connection.execute(u"ALTER TABLE user_has_role ADD PRIMARY KEY (user_id, role_id)")
+
+
+def add_token_revocation(connection):
+    """
+    1.3.0: Table of the revoked tokens.
+    """
+    TokenRevocation.__table__.create(bind=connection, checkfirst=True)
+
+
+def add_refresh_tokens(connection):
+    """
+    1.4.0: Table of the refresh tokens.
+    """
+    RefreshToken.__table__.create(bind=connection, checkfirst=True)
+
+
+# Ordered list of (version, migration).
+MIGRATIONS = [
+    (u"1.1.0", add_search_indexes),
+    (u"1.2.0", add_lookup_indexes),
+    (u"1.3.0", add_token_revocation),
+    (u"1.4.0", add_refresh_tokens)
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(connection):
+    """
+    Get the schema version of a database.
+    Args:
+        connection (Connection): The connection to the database.
+
+    Returns:
+        (unicode): The version.
+    """
+    # Inspector.has_table only exists from SQLAlchemy 1.4.
+    if not connection.dialect.has_table(connection, SchemaSpec.__tablename__):
+        return INITIAL_SCHEMA_VERSION
+    row = connection.execute(
+        SchemaSpec.__table__.select().order_by(SchemaSpec.id.desc()).limit(1)
+    ).first()
+    return row[u"version"] if row is not None else INITIAL_SCHEMA_VERSION
+
+
+def stamp_schema_version(connection, version=SCHEMA_VERSION):
+    """
+    Record the schema version of a database.
+    Args:
+        connection (Connection): The connection to the database.
+        version (unicode): The version to record.
+    """
+    SchemaSpec.__table__.create(bind=connection, checkfirst=True)
+    connection.execute(SchemaSpec.__table__.insert().values(version=version))
+
+
+def upgrade_schema(engine):
+    """
+    Apply the migrations a database misses.
+    Args:
+        engine (Engine): The engine of the database to upgrade.
+
+    Returns:
+        (list of unicode): The versions applied.
+    """
+    applied = []
+    with engine.begin() as connection:
+        current_version = _to_version_tuple(get_schema_version(connection))
+        for version, migration in MIGRATIONS:
+            if _to_version_tuple(version) > current_version:
+                migration(connection)
+                applied.append(version)
+        if applied:
+            stamp_schema_version(connection, applied[-1])
+    return applied
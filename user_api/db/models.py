@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from sqlalchemy import (
+    DDL,
     Column,
     String,
     Integer,
     Boolean,
     Table,
-    ForeignKey
+    Index,
+    ForeignKey,
+    event
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -14,8 +17,10 @@ from sqlalchemy.ext.declarative import declarative_base
 Base = declarative_base()
 
 user_has_role = Table(u'user_has_role', Base.metadata,
-    Column(u'user_id', Integer, ForeignKey(u'_user.id')),
-    Column(u'role_id', Integer, ForeignKey(u'role.id'))
+    Column(u'user_id', Integer, ForeignKey(u'_user.id'), primary_key=True),
+    Column(u'role_id', Integer, ForeignKey(u'role.id'), primary_key=True),
+    # The primary key serves the user -> roles lookups, this one the role -> users ones.
+    Index(u'ix_user_has_role_role_id', u'role_id')
 )
 class SchemaSpec(Base):
     __tablename__ = "schema_spec"
@@ -60,3 +65,52 @@ class Role(Base):
         back_populates=u"roles")
 
 
+class TokenRevocation(Base):
+    """
+    A revoked token (jti), or a watermark revoking the tokens of a user issued until a time.
+    The ID orders the entries, to sync them incrementally.
+    """
+
+    __tablename__ = u"token_revocation"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    jti = Column(String(64))
+    user_id = Column(Integer, ForeignKey(u'_user.id'))
+    issued_before = Column(Integer)
+    # Past this timestamp, the revoked tokens have expired anyway.
+    expires_at = Column(Integer, nullable=False, index=True)
+
+
+class RefreshToken(Base):
+    """
+    A refresh token, stored as its SHA-256 hash: the table alone can't be used to log in.
+    """
+
+    __tablename__ = u"refresh_token"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey(u'_user.id'), nullable=False, index=True)
+    expires_at = Column(Integer, nullable=False)
+
+
+# Tenant lookups and listings (ordered / paged by ID).
+Index(u"ix__user_customer_id", User.customer, User.id)
+
+# Tenant listings filtered on a name prefix (pattern ops make LIKE 'x%' use it on PostgreSQL).
+Index(
+    u"ix__user_customer_name",
+    User.customer,
+    User.name,
+    postgresql_ops={u"name": u"varchar_pattern_ops"}
+)
+
+# PostgreSQL only: email prefix and trigram (substring / search) indexes.
+POSTGRESQL_SEARCH_INDEXES_DDL = [
+    u"CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    u"CREATE INDEX IF NOT EXISTS ix__user_email_pattern ON _user (email varchar_pattern_ops)",
+    u"CREATE INDEX IF NOT EXISTS ix__user_email_trgm ON _user USING gin (email gin_trgm_ops)",
+    u"CREATE INDEX IF NOT EXISTS ix__user_name_trgm ON _user USING gin (name gin_trgm_ops)"
+]
+for statement in POSTGRESQL_SEARCH_INDEXES_DDL:
+    event.listen(User.__table__, u"after_create", DDL(statement).execute_if(dialect=u"postgresql"))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the token revocation list.
+"""
+
+import time
+import threading
+from .models import TokenRevocation
+
+
+class RevocationList(object):
+    """
+    In-memory copy of the token_revocation table: the revoked token IDs (jti) and, by user,
+    the time until which their tokens are revoked. Checking a token is a memory lookup: the
+    new entries are read at most every sync_interval seconds (only those with a greater ID),
+    and the whole table is read again every full_sync_interval seconds (which also catches
+    the entries committed out of ID order, and forgets the expired ones).
+    """
+
+    def __init__(self, session_registry, token_lifetime, sync_interval=1, full_sync_interval=300):
+        """
+        Constructor.
+        Args:
+            session_registry (DBSessionRegistry): The registry to read and write the entries with.
+            token_lifetime (int): How many seconds the tokens are valid (how long to keep a watermark).
+            sync_interval (float): Min number of seconds between two reads of the new entries.
+            full_sync_interval (float): Number of seconds before the whole table is read again.
+        """
+        self._session_registry = session_registry
+        self._token_lifetime = token_lifetime
+        self._sync_interval = sync_interval
+        self._full_sync_interval = full_sync_interval
+        self._sync_lock = threading.Lock()
+        self._revoked_jtis = {}
+        self._watermarks = {}
+        self._last_id = 0
+        self._synced_at = None
+        self._fully_synced_at = None
+
+    def sync(self, full=False):
+        """
+        Read the entries added to the table since the last sync.
+        Args:
+            full (boolean): Read the whole table again.
+        """
+        now = int(time.time())
+        last_id = 0 if full else self._last_id
+        with self._session_registry.session_scope() as session:
+            rows = session.query(
+                TokenRevocation.id,
+                TokenRevocation.jti,
+                TokenRevocation.user_id,
+                TokenRevocation.issued_before,
+                TokenRevocation.expires_at
+            ).filter(
+                TokenRevocation.id > last_id,
+                TokenRevocation.expires_at > now
+            ).order_by(TokenRevocation.id).all()
+
+        # A full sync builds new maps, an incremental one completes the current ones.
+        revoked_jtis = {} if full else self._revoked_jtis
+        watermarks = {} if full else self._watermarks
+        for row in rows:
+            if row.jti is not None:
+                revoked_jtis[row.jti] = row.expires_at
+            if row.user_id is not None:
+                watermarks[row.user_id] = max(watermarks.get(row.user_id, 0), row.issued_before)
+            last_id = max(last_id, row.id)
+
+        if full:
+            # Keep the entries revoked locally while reading.
+            revoked_jtis.update(
+                (jti, expires_at) for jti, expires_at in self._revoked_jtis.items() if expires_at > now
+            )
+            for user_id, issued_before in self._watermarks.items():
+                watermarks[user_id] = max(watermarks.get(user_id, 0), issued_before)
+            self._fully_synced_at = time.monotonic()
+        self._revoked_jtis = revoked_jtis
+        self._watermarks = watermarks
+        self._last_id = max(self._last_id, last_id)
+        self._synced_at = time.monotonic()
+
+    def _sync_if_due(self):
+        synced_at = self._synced_at
+        if synced_at is not None and time.monotonic() - synced_at < self._sync_interval:
+            return
+        # Only one caller reads, the others check against the current copy (empty until the
+        # first read ends). Never wait: under asyncio, all the callers share the event loop thread.
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            full = self._fully_synced_at is None or \
+                time.monotonic() - self._fully_synced_at > self._full_sync_interval
+            self.sync(full)
+        finally:
+            self._sync_lock.release()
+
+    def is_revoked(self, claims):
+        """
+        Check if a token has been revoked.
+        Args:
+            claims (dict): The token claims (jti, iat and id of the user).
+
+        Returns:
+            (boolean): True if the token is revoked.
+        """
+        self._sync_if_due()
+        if claims.get(u"jti") in self._revoked_jtis:
+            return True
+        issued_before = self._watermarks.get(claims.get(u"id"))
+        # Same second included: a token issued while revoking can't be told apart.
+        return issued_before is not None and claims.get(u"iat", 0) <= issued_before
+
+    def revoke_token(self, jti, expires_at):
+        """
+        Revoke a token.
+        Args:
+            jti (unicode): The ID of the token.
+            expires_at (int): The expiration timestamp of the token.
+        """
+        self._add(TokenRevocation(jti=jti, expires_at=expires_at))
+        self._revoked_jtis[jti] = expires_at
+
+    def revoke_user_tokens(self, user_id, issued_before=None):
+        """
+        Revoke the tokens of a user issued until a time (included).
+        Args:
+            user_id (int): The ID of the user.
+            issued_before (int): The timestamp. Now if None.
+        """
+        if issued_before is None:
+            issued_before = int(time.time())
+        self._add(TokenRevocation(
+            user_id=user_id,
+            issued_before=issued_before,
+            expires_at=issued_before + self._token_lifetime
+        ))
+        self._watermarks[user_id] = max(self._watermarks.get(user_id, 0), issued_before)
+
+    def _add(self, revocation):
+        with self._session_registry.session_scope() as session:
+            session.add(revocation)
+            session.commit()
+
+    def prune(self):
+        """
+        Delete the entries of the expired tokens from the table.
+        Returns:
+            (int): The number of deleted entries.
+        """
+        with self._session_registry.session_scope() as session:
+            result = session.execute(
+                TokenRevocation.__table__.delete().where(TokenRevocation.expires_at <= int(time.time()))
+            )
+            session.commit()
+            return result.rowcount
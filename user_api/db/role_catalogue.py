@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the role catalogue.
+"""
+
+import time
+import threading
+from .models import Role
+
+
+class RoleCatalogue(object):
+    """
+    In-memory copy of the role table, which almost never changes. Loaded on first use,
+    then reloaded when it is older than its TTL, or when invalidated.
+    Each load increments the catalogue version.
+    Each process has its own copy (and version): invalidate only reloads the local one. The
+    other processes find a new role as soon as it is asked for (an unknown role triggers a
+    reload), but their lists and renamed roles can be up to ttl seconds old.
+    """
+
+    # Min number of seconds between two reloads triggered by an unknown role.
+    MISS_RELOAD_INTERVAL = 1
+
+    def __init__(self, session_registry, ttl=300):
+        """
+        Constructor.
+        Args:
+            session_registry (DBSessionRegistry): The registry to read the roles with.
+            ttl (float): Number of seconds before the catalogue is reloaded.
+        """
+        self._session_registry = session_registry
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._roles_by_id = None
+        self._ids_by_code = {}
+        self._loaded_at = None
+        self._version = 0
+
+    def load(self):
+        """
+        (Re)load the catalogue from the database.
+        """
+        with self._session_registry.session_scope() as session:
+            rows = session.query(Role.id, Role.code, Role.name).order_by(Role.id).all()
+
+        roles_by_id = {
+            row.id: {u"id": row.id, u"code": row.code, u"name": row.name}
+            for row in rows
+        }
+        with self._lock:
+            self._roles_by_id = roles_by_id
+            self._ids_by_code = {role[u"code"]: role_id for role_id, role in roles_by_id.items()}
+            self._loaded_at = time.monotonic()
+            self._version += 1
+
+    def invalidate(self):
+        """
+        Force a reload on next use (for example after a role has been created).
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def get_version(self):
+        """
+        Returns:
+            (int): The number of times the catalogue has been loaded by this process.
+        """
+        return self._version
+
+    def _get_roles_by_id(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self._ttl:
+            self.load()
+        return self._roles_by_id
+
+    def _reload_on_miss(self):
+        """
+        Reload the catalogue if a role is unknown, unless it has just been loaded.
+        Returns:
+            (boolean): True if the catalogue has been reloaded.
+        """
+        # Read once: invalidate can reset it meanwhile (then reload now).
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.MISS_RELOAD_INTERVAL:
+            return False
+        self.load()
+        return True
+
+    def get_role(self, role_id):
+        """
+        Get a role.
+        Args:
+            role_id (int): The ID of the role.
+
+        Returns:
+            (dict): The role (id, code, name), None if unknown.
+        """
+        roles_by_id = self._get_roles_by_id()
+        if role_id not in roles_by_id and self._reload_on_miss():
+            roles_by_id = self._roles_by_id
+        role = roles_by_id.get(role_id)
+        return dict(role) if role is not None else None
+
+    def get_roles(self, role_ids):
+        """
+        Get roles, skipping the unknown ones.
+        Args:
+            role_ids (iterable of int): The IDs of the roles.
+
+        Returns:
+            (list of dict): The roles, ordered by ID.
+        """
+        role_ids = set(role_ids)
+        roles_by_id = self._get_roles_by_id()
+        if not role_ids.issubset(roles_by_id) and self._reload_on_miss():
+            roles_by_id = self._roles_by_id
+        return [
+            dict(roles_by_id[role_id])
+            for role_id in sorted(role_ids)
+            if role_id in roles_by_id
+        ]
+
+    def get_role_id(self, code):
+        """
+        Get the ID of a role from its code.
+        Args:
+            code (unicode): The code of the role.
+
+        Returns:
+            (int): The ID, None if unknown.
+        """
+        self._get_roles_by_id()
+        return self._ids_by_code.get(code)
+
+    def get_roles_by_codes(self, codes):
+        """
+        Get roles from their codes, skipping the unknown ones.
+        Args:
+            codes (iterable of unicode): The codes of the roles.
+
+        Returns:
+            (list of dict): The roles, ordered by ID.
+        """
+        codes = set(codes)
+        self._get_roles_by_id()
+        if not codes.issubset(self._ids_by_code):
+            self._reload_on_miss()
+        ids_by_code = self._ids_by_code
+        return self.get_roles(ids_by_code[code] for code in codes if code in ids_by_code)
+
+    def list_roles(self, limit=20, offset=0, after_id=None):
+        """
+        List the roles, ordered by ID.
+        Args:
+            limit (int): The max number of returned roles.
+            offset (int): The number of roles to skip (ignored if after_id is set).
+            after_id (int): Only list the roles with a greater ID.
+
+        Returns:
+            (list of dict, boolean): The roles. The boolean stands for if there is more to fetch.
+        """
+        roles = [role for _, role in sorted(self._get_roles_by_id().items())]
+        if after_id is not None:
+            roles = [role for role in roles if role[u"id"] > after_id]
+        else:
+            roles = roles[offset:]
+        return [dict(role) for role in roles[:limit]], len(roles) > limit
+
+    def count(self):
+        """
+        Returns:
+            (int): The number of roles.
+        """
+        return len(self._get_roles_by_id())
@@ -6,8 +6,16 @@ Contains helpers to help construct objects.
 from .user_api import UserApi
 from .db.db_user_manager import DBUserManager
 from .db.db_role_manager import DBRoleManager
+from .db.db_token_manager import DBTokenManager
+from .db.db_session_registry import DBSessionRegistry
+from .db.role_catalogue import RoleCatalogue
+from .db.revocation_list import RevocationList
 from .auth.auth_manager import AuthManager
+from .auth.hash_executor import HashExecutor
+from .cache import MemoryCache
+from .user_import import USER_READERS
 from user_api.db.models import Base, Role, User, Customer
+from user_api.db.migrations import stamp_schema_version, upgrade_schema
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
@@ -18,7 +26,25 @@ def create_user_api(
     jwt_secret,
     jwt_lifetime=3600 * 12 * 30,
     user_created_callback=None,
-    user_updated_callback=None
+    user_updated_callback=None,
+    pool_size=None,
+    max_overflow=None,
+    pool_recycle=3600,
+    pool_pre_ping=False,
+    hash_workers=None,
+    hash_queue_depth=64,
+    hash_timeout=10,
+    hash_algorithm=u"pbkdf2_sha1",
+    hash_iterations=1000,
+    hash_length=16,
+    token_cache_size=None,
+    count_cache_ttl=None,
+    user_cache=None,
+    role_catalogue_ttl=300,
+    key_ring=None,
+    claims_profile=u"full",
+    revocation_sync_interval=None,
+    refresh_token_lifetime=None
 ):
     """
     Create a user API method.
@@ -28,19 +54,203 @@ def create_user_api(
         jwt_lifetime (unicode): How long each token is valid.
         user_created_callback (callable): Optional method to be called when a user is created.
         user_updated_callback (callable): Optional method to be called when a user is edited.
+        pool_size (int): The number of connections kept in the pool (driver default if None).
+        max_overflow (int): The number of connections allowed over pool_size (driver default if None).
+        pool_recycle (int): Number of seconds after which a connection is recycled (-1 to disable).
+        pool_pre_ping (boolean): Test connections for liveness when checked out of the pool.
+        hash_workers (int): Number of processes hashing the passwords (hash in the request thread if None).
+        hash_queue_depth (int): How many hashes can wait for a free process before being rejected.
+        hash_timeout (float): How many seconds to wait for a hash before giving up.
+        hash_algorithm (unicode): The scheme of new hashes (pbkdf2_sha1, pbkdf2_sha256 or pbkdf2_sha512).
+        hash_iterations (int): The PBKDF2 iteration count of new hashes.
+        hash_length (int): The length (bytes) of new hashes.
+        token_cache_size (int): How many verified tokens to keep decoded (no cache if None).
+        count_cache_ttl (float): How many seconds to keep the user listing counts (no cache if None).
+        user_cache (Cache): Optional cache of the user profiles (MemoryCache, RedisCache...).
+        role_catalogue_ttl (float): How many seconds to keep the roles in memory before reloading them.
+        key_ring (KeyRing): Optional asymmetric keys (RS256, EdDSA) signing the tokens instead of jwt_secret.
+        claims_profile (unicode): What the tokens hold: "full" (user and roles), "codes" (IDs and
+            role codes) or "bitmask" (IDs and a bitmask of the role IDs).
+        revocation_sync_interval (float): How many seconds between two reads of the revoked tokens
+            (no revocation if None). Requires the schema 1.3.0 (init_api.py --upgrade).
+        refresh_token_lifetime (int): How many seconds each refresh token is valid (no refresh tokens if None).
+            Enabled, jwt_lifetime should be short (minutes): the tokens are renewed without the password.
 
     Returns:
         (UserApi): The constructed UserApi object.
     """
+    # One engine (one pool) shared by every manager.
+    session_registry = DBSessionRegistry(
+        db_url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping
+    )
+    hash_executor = None
+    if hash_workers:
+        hash_executor = HashExecutor(
+            max_workers=hash_workers,
+            max_queue_depth=hash_queue_depth,
+            timeout=hash_timeout
+        )
+    return _build_user_api(
+        session_registry,
+        hash_executor,
+        jwt_secret=jwt_secret,
+        jwt_lifetime=jwt_lifetime,
+        user_created_callback=user_created_callback,
+        user_updated_callback=user_updated_callback,
+        hash_algorithm=hash_algorithm,
+        hash_iterations=hash_iterations,
+        hash_length=hash_length,
+        token_cache_size=token_cache_size,
+        count_cache_ttl=count_cache_ttl,
+        user_cache=user_cache,
+        role_catalogue_ttl=role_catalogue_ttl,
+        key_ring=key_ring,
+        claims_profile=claims_profile,
+        revocation_sync_interval=revocation_sync_interval,
+        refresh_token_lifetime=refresh_token_lifetime
+    )
+
+
+def create_async_user_api(
+    db_url,
+    jwt_secret,
+    jwt_lifetime=3600 * 12 * 30,
+    user_created_callback=None,
+    user_updated_callback=None,
+    pool_size=None,
+    max_overflow=None,
+    pool_recycle=3600,
+    pool_pre_ping=False,
+    hash_workers=None,
+    hash_queue_depth=64,
+    hash_timeout=10,
+    hash_algorithm=u"pbkdf2_sha1",
+    hash_iterations=1000,
+    hash_length=16,
+    token_cache_size=None,
+    count_cache_ttl=None,
+    user_cache=None,
+    role_catalogue_ttl=300,
+    key_ring=None,
+    claims_profile=u"full",
+    revocation_sync_interval=None,
+    refresh_token_lifetime=None
+):
+    """
+    Create a user API for asyncio servers. Same parameters as create_user_api, except:
+    Args:
+        db_url (unicode): The DB url for connection, with an asyncio driver
+            (mysql+aiomysql://, postgresql+asyncpg://, sqlite+aiosqlite://...).
+        hash_workers (int): Number of processes hashing the passwords (number of CPUs if None).
+            The hashes are never computed on the event loop.
+
+    Returns:
+        (AsyncUserApi): The constructed AsyncUserApi object.
+    """
+    # Requires the "async" extra (SQLAlchemy >= 1.4 with greenlet).
+    from .async_user_api import AsyncUserApi
+    from .auth.awaiting_hash_executor import AwaitingHashExecutor
+    from .db.db_async_session_registry import AsyncDBSessionRegistry
+
+    session_registry = AsyncDBSessionRegistry(
+        db_url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping
+    )
+    hash_executor = AwaitingHashExecutor(HashExecutor(
+        max_workers=hash_workers,
+        max_queue_depth=hash_queue_depth,
+        timeout=hash_timeout
+    ))
+    user_api = _build_user_api(
+        session_registry,
+        hash_executor,
+        jwt_secret=jwt_secret,
+        jwt_lifetime=jwt_lifetime,
+        user_created_callback=user_created_callback,
+        user_updated_callback=user_updated_callback,
+        hash_algorithm=hash_algorithm,
+        hash_iterations=hash_iterations,
+        hash_length=hash_length,
+        token_cache_size=token_cache_size,
+        count_cache_ttl=count_cache_ttl,
+        user_cache=user_cache,
+        role_catalogue_ttl=role_catalogue_ttl,
+        key_ring=key_ring,
+        claims_profile=claims_profile,
+        revocation_sync_interval=revocation_sync_interval,
+        refresh_token_lifetime=refresh_token_lifetime
+    )
+    return AsyncUserApi(user_api, session_registry)
+
+
+def _build_user_api(
+    session_registry,
+    hash_executor,
+    jwt_secret,
+    jwt_lifetime,
+    user_created_callback,
+    user_updated_callback,
+    hash_algorithm,
+    hash_iterations,
+    hash_length,
+    token_cache_size,
+    count_cache_ttl,
+    user_cache,
+    role_catalogue_ttl,
+    key_ring,
+    claims_profile,
+    revocation_sync_interval,
+    refresh_token_lifetime
+):
+    """
+    Build a UserApi on a session registry (see create_user_api for the parameters).
+    """
+    role_catalogue = RoleCatalogue(session_registry, ttl=role_catalogue_ttl)
+    revocation_list = None
+    if revocation_sync_interval is not None:
+        revocation_list = RevocationList(
+            session_registry,
+            token_lifetime=jwt_lifetime,
+            sync_interval=revocation_sync_interval
+        )
     return UserApi(
-        db_user_manager=DBUserManager(db_url),
-        db_role_manager=DBRoleManager(db_url),
+        db_user_manager=DBUserManager(
+            session_registry=session_registry,
+            role_catalogue=role_catalogue,
+            count_cache=MemoryCache(ttl=count_cache_ttl) if count_cache_ttl else None,
+            user_cache=user_cache
+        ),
+        db_role_manager=DBRoleManager(
+            session_registry=session_registry,
+            role_catalogue=role_catalogue
+        ),
         auth_manager=AuthManager(
             jwt_lifetime=jwt_lifetime,
-            jwt_secret=jwt_secret
+            jwt_secret=jwt_secret,
+            hash_executor=hash_executor,
+            hash_algorithm=hash_algorithm,
+            hash_iterations=hash_iterations,
+            hash_length=hash_length,
+            token_cache=MemoryCache(max_size=token_cache_size) if token_cache_size else None,
+            key_ring=key_ring
         ),
         user_created_callback=user_created_callback,
-        user_updated_callback=user_updated_callback
+        user_updated_callback=user_updated_callback,
+        session_registry=session_registry,
+        claims_profile=claims_profile,
+        revocation_list=revocation_list,
+        db_token_manager=DBTokenManager(
+            session_registry=session_registry,
+            role_catalogue=role_catalogue
+        ) if refresh_token_lifetime else None,
+        refresh_token_lifetime=refresh_token_lifetime
     )
 
 def init_db(
@@ -62,6 +272,19 @@ def init_db(
     conn.close()
     engine = create_engine("{}/{}".format(db_url, "user_api", echo=True))
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        stamp_schema_version(connection)
+
+def upgrade_db(db_url: str):
+    """
+    Upgrade an existing user api database to the current schema.
+    Args:
+        db_url (str): The connection string to the database.
+    Returns:
+        (list of str): The schema versions applied.
+    """
+    engine = create_engine("{}/{}".format(db_url, "user_api"), echo=True)
+    return upgrade_schema(engine)
 
 def add_customer(db_url: str):
     """
@@ -128,7 +351,55 @@ def add_user(
     except NoResultFound:
         admin_role = Role(code=u"admin", name=u"Admin")
 
-    admin_role.users.append(admin)
+    # The (user_id, role_id) key rejects duplicates.
+    if admin not in admin_role.users:
+        admin_role.users.append(admin)
     session.add(admin_role)
     session.commit()
 
+def import_users(
+        db_url: str,
+        customer_id: int,
+        path: str,
+        file_format: str = None,
+        chunk_size: int = 500,
+        hash_workers: int = None,
+        progress_callback=None
+    ):
+    """
+    Import users in bulk from a CSV or JSON lines file.
+    Args:
+        db_url (str): The connection string to the database.
+        customer_id (int): The customer of the imported users.
+        path (str): The file to import.
+        file_format (str): csv or jsonl (guessed from the file extension if None).
+        chunk_size (int): How many users are hashed and saved at once.
+        hash_workers (int): Number of processes hashing the passwords (number of CPUs if None).
+        progress_callback (callable): Optional method called after each chunk with the number
+            of users processed, created and rejected so far.
+    Returns:
+        (dict): The number of created users, and the errors.
+    """
+    if file_format is None:
+        file_format = path.rsplit(u".", 1)[-1].lower()
+    if file_format not in USER_READERS:
+        raise ValueError(u"Unknown file format '{}'.".format(file_format))
+
+    session_registry = DBSessionRegistry("{}/{}".format(db_url, "user_api"))
+    hash_executor = HashExecutor(max_workers=hash_workers)
+    try:
+        user_api = UserApi(
+            db_user_manager=DBUserManager(session_registry=session_registry),
+            db_role_manager=DBRoleManager(session_registry=session_registry),
+            auth_manager=AuthManager(jwt_secret=None, jwt_lifetime=None, hash_executor=hash_executor),
+            session_registry=session_registry
+        )
+        with open(path, newline=u"") as stream:
+            return user_api.register_many(
+                customer_id,
+                USER_READERS[file_format](stream),
+                chunk_size=chunk_size,
+                progress_callback=progress_callback
+            )
+    finally:
+        hash_executor.shutdown()
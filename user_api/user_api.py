@@ -1,19 +1,97 @@
 # coding: utf-8
 
-from .db.db_user_manager import DBUserManager
+import time
+from functools import wraps
+from contextlib import contextmanager
+from .db.db_user_manager import DBUserManager, MATCH_MODES
 from .db.db_exception import (
+    DBRoleNotFound,
+    DBTokenNotFound,
     DBUserConflict,
     DBUserNotFound
 )
+from cerberus import Validator
 from .user_api_exception import (
+    ApiException,
     ApiConflict,
     ApiNotFound,
     ApiForbidden,
     ApiUnauthorized,
+    ApiServiceUnavailable,
     ApiUnprocessableEntity
 )
 from .auth.auth_manager import AuthManager
+from .auth.auth_exception import AuthException
+from .cursor import encode_cursor, decode_cursor
 from .adapter.flask import FlaskUserApi
+from .adapter.schemas import REGISTER_SCHEMA
+
+
+# The max number of users fetched by a batch lookup.
+MAX_BATCH_SIZE = 500
+# The max number of users changed by a bulk role assignment / revocation.
+MAX_ROLE_BATCH_SIZE = 10000
+# The fields an imported user may omit (register_many).
+IMPORT_DEFAULTS = {
+    u"active": True,
+    u"roles": []
+}
+# What the tokens hold: the user and their roles, the IDs and the role codes,
+# or the IDs and a bitmask of the role IDs (expanded back by get_token_data).
+CLAIMS_PROFILES = (u"full", u"codes", u"bitmask")
+
+
+def in_session_scope(funct):
+    """
+    Run a UserApi method in one unit of work, so all its DB calls share the same session.
+    Args:
+        funct (callable): The UserApi method to wrap.
+
+    Returns:
+        (callable): The wrapped method.
+    """
+    @wraps(funct)
+    def wrapper(self, *args, **kwargs):
+        with self.session_scope():
+            return funct(self, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def _no_session_scope():
+    yield None
+
+
+def _release_connection(session):
+    """
+    End the transaction of a session, so its connection returns to the pool (before a long
+    computation). The session stays usable: the next query checks a connection out again.
+    Args:
+        session (Session): The session, None if there is no registry.
+    """
+    if session is not None:
+        session.commit()
+
+
+def _chunks(items, size):
+    """
+    Split an iterable in lists.
+    Args:
+        items (iterable): The items to split, may be a stream.
+        size (int): The max length of a list.
+
+    Yields:
+        (list): The next items.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 class UserApi(object):
@@ -24,7 +102,12 @@ class UserApi(object):
         db_role_manager,
         auth_manager,
         user_created_callback=None,
-        user_updated_callback=None
+        user_updated_callback=None,
+        session_registry=None,
+        claims_profile=u"full",
+        revocation_list=None,
+        db_token_manager=None,
+        refresh_token_lifetime=3600 * 24 * 30
     ):
         """
         Build the user API
@@ -34,14 +117,90 @@ class UserApi(object):
             auth_manager (AuthManager): Injected object to handle Auth interactions.
             user_created_callback (callable): Optional method to be called when a user is created.
             user_updated_callback (callable): Optional method to be called when a user is edited.
+            session_registry (DBSessionRegistry): Optional registry shared by the DB managers,
+                used to run each operation in one unit of work.
+            claims_profile (unicode): What the tokens hold (see CLAIMS_PROFILES).
+            revocation_list (RevocationList): Optional list of the revoked tokens (no revocation if None).
+            db_token_manager (DBTokenManager): Optional object storing the refresh tokens (no refresh if None).
+            refresh_token_lifetime (int): How many seconds each refresh token is valid.
         """
+        if claims_profile not in CLAIMS_PROFILES:
+            raise ValueError(u"Unknown claims profile '{}'.".format(claims_profile))
         self._db_user_manager = db_user_manager
         self._db_role_manager = db_role_manager
         self._auth_manager = auth_manager
+        self._session_registry = session_registry
+        self._claims_profile = claims_profile
+        self._revocation_list = revocation_list
+        self._db_token_manager = db_token_manager
+        self._refresh_token_lifetime = refresh_token_lifetime
 
         self._user_created_callback = user_created_callback
         self._user_updated_callback = user_updated_callback
 
+    def session_scope(self):
+        """
+        Returns a context manager sharing one DB session between all the calls made inside it.
+        Returns:
+            (contextmanager): Yields the session (None if no registry was supplied).
+        """
+        if self._session_registry is None:
+            return _no_session_scope()
+        return self._session_registry.session_scope()
+
+    def open_session_scope(self):
+        """
+        Bind a DB session to the current thread, until close_session_scope is called.
+        """
+        if self._session_registry is not None:
+            self._session_registry.open_scope()
+
+    def close_session_scope(self, exception=None):
+        """
+        Release the DB session bound by open_session_scope.
+        Args:
+            exception (Exception): The error which ended the unit of work, if any.
+        """
+        if self._session_registry is not None:
+            self._session_registry.close_scope(exception)
+
+    def _generate_hash(self, password, salt):
+        """
+        Hash a password.
+        Args:
+            password (unicode): The password to hash.
+            salt (unicode): The salt to hash the password with.
+
+        Returns:
+            (unicode): The hash.
+
+        Raises:
+            (ApiServiceUnavailable): If the hashing pool is overloaded.
+        """
+        try:
+            return self._auth_manager.generate_hash(password, salt)
+        except AuthException as err:
+            raise ApiServiceUnavailable(err.message)
+
+    def _verify_hash(self, password, salt, saved_hash):
+        """
+        Check a password against a saved hash.
+        Args:
+            password (unicode): The password to check.
+            salt (unicode): The salt saved with the hash.
+            saved_hash (unicode): The saved hash.
+
+        Returns:
+            (boolean): True if the password matches.
+
+        Raises:
+            (ApiServiceUnavailable): If the hashing pool is overloaded.
+        """
+        try:
+            return self._auth_manager.verify_hash(password, salt, saved_hash)
+        except AuthException as err:
+            raise ApiServiceUnavailable(err.message)
+
     def get_flask_user_api(self):
         """
         Get an adapter for the API.
@@ -51,6 +210,7 @@ class UserApi(object):
         """
         return FlaskUserApi(self)
 
+    @in_session_scope
     def get_user_information(
             self, 
             customer_id: int, 
@@ -77,6 +237,27 @@ class UserApi(object):
 
         return user
 
+    @in_session_scope
+    def get_users_information(self, customer_id: int, user_ids, with_roles=True):
+        """
+        Get the user informations for several user ids at once.
+        Args:
+            customer_id (int): The ID of the customer of the user requesting.
+            user_ids (list of int): The ids of the users to fetch (at most MAX_BATCH_SIZE).
+            with_roles (boolean): Fetch the roles with the users.
+
+        Returns:
+            (dict): The users representations by id. The unknown users, and the ones of
+                other customers, are left out.
+        """
+        if len(user_ids) > MAX_BATCH_SIZE:
+            raise ApiUnprocessableEntity(
+                u"At most {} users can be fetched at once.".format(MAX_BATCH_SIZE),
+                api_error_code=u"BATCH_TOO_LARGE"
+            )
+        return self._db_user_manager.get_users_information(customer_id, user_ids, with_roles)
+
+    @in_session_scope
     def update(self, customer_id: int, user_id: int, payload: dict):
         """
         Update a user.
@@ -93,6 +274,7 @@ class UserApi(object):
                 user_id)
             if user["customer"]["id"] != customer_id:
                 raise ApiForbidden
+            was_active = user[u"active"]
 
             user = self._db_user_manager.update_user_information(
                 payload.get(u"email"),
@@ -105,6 +287,13 @@ class UserApi(object):
             if payload.get(u"password") is not None:
                 self.reset_password(user.get(u"email"), payload.get(u"password"))
 
+            # A deactivated user loses the tokens already given.
+            if was_active and not user[u"active"]:
+                if self._revocation_list is not None:
+                    self._revocation_list.revoke_user_tokens(user_id)
+                if self._db_token_manager is not None:
+                    self._db_token_manager.delete_user_refresh_tokens(user_id)
+
             if self._user_updated_callback is not None:
                 self._user_updated_callback(user)
 
@@ -114,6 +303,106 @@ class UserApi(object):
         except DBUserNotFound:
             raise ApiNotFound(u"User not found.")
 
+    def _generate_token(self, payload):
+        """
+        Generate the token of a user, with the claims of the profile.
+        Args:
+            payload (dict): The user information, with roles. Its "exp" is set.
+
+        Returns:
+            (unicode): The token.
+        """
+        if self._claims_profile == u"full":
+            return self._auth_manager.generate_token(payload)
+
+        claims = {
+            u"id": payload[u"id"],
+            u"email": payload[u"email"],
+            u"cid": payload[u"customer"][u"id"]
+        }
+        roles = payload.get(u"roles") or []
+        if self._claims_profile == u"codes":
+            claims[u"rc"] = [role[u"code"] for role in roles]
+        else:
+            # Bits of the role IDs, which never change: a mask reads the same in every process.
+            mask = 0
+            for role in roles:
+                mask |= 1 << role[u"id"]
+            claims[u"rm"] = format(mask, u"x")
+
+        token = self._auth_manager.generate_token(claims)
+        payload[u"exp"] = claims[u"exp"]
+        return token
+
+    def _add_refresh_token(self, payload):
+        """
+        Give a new refresh token to a user (if they are enabled).
+        Args:
+            payload (dict): The user information. Its "refresh_token" is set.
+        """
+        if self._db_token_manager is None:
+            return
+        refresh_token = self._auth_manager.generate_refresh_token()
+        self._db_token_manager.save_refresh_token(
+            payload[u"id"],
+            self._auth_manager.hash_refresh_token(refresh_token),
+            int(time.time()) + self._refresh_token_lifetime
+        )
+        payload[u"refresh_token"] = refresh_token
+
+    @in_session_scope
+    def refresh(self, refresh_token):
+        """
+        Give a new token for a refresh token, without the password. The claims are read again
+        (one query), and the refresh token is replaced by a new one: each can be used once.
+        Args:
+            refresh_token (unicode): The refresh token.
+
+        Returns:
+            (dict, unicode): The user auth information (with the new refresh token) and the token.
+        """
+        if self._db_token_manager is None:
+            raise ApiNotFound(u"The refresh tokens are not enabled.")
+
+        new_refresh_token = self._auth_manager.generate_refresh_token()
+        try:
+            payload = self._db_token_manager.rotate_refresh_token(
+                self._auth_manager.hash_refresh_token(refresh_token),
+                self._auth_manager.hash_refresh_token(new_refresh_token),
+                int(time.time()) + self._refresh_token_lifetime
+            )
+        except DBTokenNotFound:
+            # Also raised for an inactive user, before the token is rotated.
+            raise ApiUnauthorized(u"Invalid refresh token.")
+
+        token = self._generate_token(payload)
+        payload[u"refresh_token"] = new_refresh_token
+        return payload, token
+
+    def _expand_claims(self, claims):
+        """
+        Expand the claims of a compact token back to the full profile.
+        Args:
+            claims (dict): The decoded claims.
+
+        Returns:
+            (dict): The claims, with the customer and the roles.
+        """
+        if claims is None or u"cid" not in claims:
+            return claims
+
+        expanded = {key: value for key, value in claims.items() if key not in (u"cid", u"rc", u"rm")}
+        expanded[u"customer"] = {u"id": claims[u"cid"]}
+        if u"rc" in claims:
+            expanded[u"roles"] = self._db_role_manager.get_roles_by_codes(claims[u"rc"])
+        else:
+            mask = int(claims.get(u"rm", u"0"), 16)
+            expanded[u"roles"] = self._db_role_manager.get_roles(
+                role_id for role_id in range(mask.bit_length()) if mask >> role_id & 1
+            )
+        return expanded
+
+    @in_session_scope
     def authenticate_no_password(self, email):
         """
         Used to authenticate without password (for Google authentication for example).
@@ -131,12 +420,13 @@ class UserApi(object):
         payload[u"roles"] = self._db_role_manager.get_user_roles(
             user_id=payload[u"id"]
         )
-        token = self._auth_manager.generate_token(payload)
+        token = self._generate_token(payload)
+        self._add_refresh_token(payload)
         return payload, token
     
     def authenticate(self, email, password):
         """
-        Authenticate a user.
+        Authenticate a user. No DB connection is held while the password is hashed.
         Args:
             email (unicode): The user email.
             password (unicode): The user password.
@@ -144,32 +434,33 @@ class UserApi(object):
         Returns:
             (dict, unicode): The user auth information and the token.
         """
-        try:
-            salt = self._db_user_manager.get_user_salt(email=email)
-        except DBUserNotFound:
-            raise ApiNotFound(u"Can't find user {}.".format(email))
-
-        hash = self._auth_manager.generate_hash(
-            password,
-            salt
-        )
-        valid = self._db_user_manager.is_user_hash_valid(
-            email,
-            hash=hash
-        )
-        if not valid:
+        with self.session_scope() as session:
+            try:
+                payload, salt, saved_hash = self._db_user_manager.get_user_credentials(email)
+            except DBUserNotFound:
+                raise ApiNotFound(u"Can't find user {}.".format(email))
+            _release_connection(session)
+
+        if not self._verify_hash(password, salt, saved_hash):
             raise ApiUnauthorized(u"Wrong login or / and password.")
 
-        payload = self._db_user_manager.get_user_information(email)
         if not payload[u"active"]:
             raise ApiUnauthorized(u"User is not active.")
 
-        payload[u"roles"] = self._db_role_manager.get_user_roles(
-            user_id=payload[u"id"]
-        )
-        token = self._auth_manager.generate_token(payload)
+        # Migrate the hash to the current parameters while the password is known.
+        new_hash = None
+        if self._auth_manager.needs_rehash(saved_hash):
+            salt = self._auth_manager.generate_salt()
+            new_hash = self._generate_hash(password, salt)
+
+        with self.session_scope():
+            if new_hash is not None:
+                self._db_user_manager.modify_hash_salt(email, new_hash, salt)
+            token = self._generate_token(payload)
+            self._add_refresh_token(payload)
         return payload, token
 
+    @in_session_scope
     def reset_password(self, email, password):
         """
         Reset a user password.
@@ -181,7 +472,7 @@ class UserApi(object):
             (dict): The user auth new information.
         """
         salt = self._auth_manager.generate_salt()
-        hash = self._auth_manager.generate_hash(password, salt)
+        hash = self._generate_hash(password, salt)
 
         self._db_user_manager.modify_hash_salt(email, hash, salt)
         try:
@@ -191,6 +482,7 @@ class UserApi(object):
 
         return payload
 
+    @in_session_scope
     def register(self, customer_id: int, payload: dict):
         """
         Register a new user.
@@ -201,7 +493,7 @@ class UserApi(object):
             (dict): The user auth new information.
         """
         salt = self._auth_manager.generate_salt()
-        hash = self._auth_manager.generate_hash(payload.get(u"password"), salt)
+        hash = self._generate_hash(payload.get(u"password"), salt)
         try:
             user = self._db_user_manager.save_new_user(
                 email=payload.get(u"email"),
@@ -219,6 +511,105 @@ class UserApi(object):
         except DBUserConflict:
             raise ApiConflict(u"User already exists.")
 
+    def register_many(self, customer_id: int, users, chunk_size=500, progress_callback=None):
+        """
+        Register users in bulk. The users are read in chunks: the passwords of a chunk are hashed
+        in parallel (in the hash executor if there is one), then the chunk is saved in one transaction.
+        A failing user doesn't stop the import, it is reported in the errors.
+        Args:
+            customer_id (int): The related customer.
+            users (iterable of dict): The users to create, may be a stream. Same payload as register
+                (active and roles are optional), validated with the same schema. An ApiException
+                in place of a user (a row a reader can't parse) is reported as is.
+            chunk_size (int): How many users are hashed and saved at once.
+            progress_callback (callable): Optional method called after each chunk with the number
+                of users processed, created and rejected so far.
+
+        Returns:
+            (dict): The number of created users, and the errors (index, email, code, message,
+                and the payload of the validation errors).
+        """
+        report = {
+            u"created": 0,
+            u"errors": []
+        }
+        position = 0
+        for chunk in _chunks(users, chunk_size):
+            self._register_chunk(customer_id, chunk, position, report)
+            position += len(chunk)
+            if progress_callback is not None:
+                progress_callback(position, report[u"created"], len(report[u"errors"]))
+        return report
+
+    def _register_chunk(self, customer_id, payloads, position, report):
+        """
+        Register a chunk of users, and record the result in the report.
+        Args:
+            customer_id (int): The related customer.
+            payloads (list of dict): The users to create.
+            position (int): The index of the first user of the chunk in the import.
+            report (dict): The import report to fill.
+        """
+        errors = []
+
+        def add_error(index, error):
+            payload = payloads[index]
+            errors.append(dict({
+                u"index": position + index,
+                u"email": payload.get(u"email") if isinstance(payload, dict) else None,
+                u"code": error.api_error_code,
+                u"message": error.message
+            }, **({u"payload": error.payload} if error.payload else {})))
+
+        validator = Validator(REGISTER_SCHEMA)
+        valid = []
+        documents = {}
+        for index, payload in enumerate(payloads):
+            if isinstance(payload, ApiException):
+                add_error(index, payload)
+            elif not isinstance(payload, dict) or not validator.validate(dict(IMPORT_DEFAULTS, **payload)):
+                add_error(index, ApiUnprocessableEntity(
+                    u"The user doesn't have the right format.",
+                    api_error_code=u"WRONG_PAYLOAD",
+                    payload=validator.errors if isinstance(payload, dict) else None
+                ))
+            elif not validator.document[u"email"] or not validator.document[u"password"]:
+                add_error(index, ApiUnprocessableEntity(u"An email and a password are required."))
+            else:
+                valid.append(index)
+                documents[index] = validator.document
+        if not valid:
+            report[u"errors"].extend(errors)
+            return
+
+        salts = [self._auth_manager.generate_salt() for _ in valid]
+        try:
+            hashes = self._auth_manager.generate_hashes([documents[index][u"password"] for index in valid], salts)
+        except AuthException as err:
+            raise ApiServiceUnavailable(err.message)
+
+        users = [
+            {
+                u"email": documents[index][u"email"],
+                u"name": documents[index][u"name"],
+                u"active": documents[index][u"active"],
+                u"hash": hash,
+                u"salt": salt,
+                u"roles": documents[index][u"roles"]
+            }
+            for index, hash, salt in zip(valid, hashes, salts)
+        ]
+        with self.session_scope():
+            created, conflicts = self._db_user_manager.save_new_users(customer_id, users)
+
+        for index, _ in conflicts:
+            add_error(valid[index], ApiConflict(u"User already exists."))
+        report[u"errors"].extend(sorted(errors, key=lambda error: error[u"index"]))
+        report[u"created"] += len(created)
+        if self._user_created_callback is not None:
+            for user in created:
+                self._user_created_callback(user)
+
     def get_token_data(self, token):
         """
         Decrypt token and return payload.
@@ -226,9 +617,39 @@ class UserApi(object):
             token (unicode): The JWT token.
 
         Returns:
-            (dict): The payload contained in the token.
+            (dict): The payload contained in the token (compact claims are expanded), None if
+                the token is not valid or has been revoked.
+        """
+        token_data = self._auth_manager.get_token_data(token)
+        if token_data is not None and self._revocation_list is not None \
+                and self._revocation_list.is_revoked(token_data):
+            return None
+        return self._expand_claims(token_data)
+
+    @in_session_scope
+    def logout(self, token):
+        """
+        Revoke a token, for the rest of its lifetime.
+        Args:
+            token (dict): The token claims.
         """
-        return self._auth_manager.get_token_data(token)
+        if self._revocation_list is not None and u"jti" in token:
+            self._revocation_list.revoke_token(token[u"jti"], token[u"exp"])
+
+    def get_jwks(self):
+        """
+        Get the public keys verifying the tokens, for the services checking them locally.
+
+        Returns:
+            (dict): The JSON Web Key Set.
+
+        Raises:
+            (ApiNotFound): If the tokens are signed with the shared secret.
+        """
+        jwks = self._auth_manager.get_jwks()
+        if jwks is None:
+            raise ApiNotFound(u"The tokens are not signed with public keys.")
+        return jwks
 
     def is_token_valid(self, token):
         """
@@ -239,49 +660,211 @@ class UserApi(object):
         Returns:
             (boolean): Return True if valid, else False.
         """
+        if self._revocation_list is not None:
+            return self.get_token_data(token) is not None
         return self._auth_manager.is_token_valid(token)
 
-    def list_users(self, customer_id: int, limit=20, offset=0, email=None, name=None):
+    @in_session_scope
+    def list_users(
+            self,
+            customer_id: int,
+            limit=20,
+            offset=0,
+            email=None,
+            name=None,
+            cursor=None,
+            total_count=False,
+            match=u"contains"
+        ):
         """
         List the users from the API.
         Args:
             customer_id (int): The corresponding customer.
             limit (int): The max number of returned users.
-            offset (int): The cursor.
+            offset (int): The number of users to skip (ignored if a cursor is given).
             email (unicode): An email to filter on.
             name (unicode): A name to filter on.
+            cursor (unicode): The next_cursor of the previous page, to page by ID instead of offset.
+            total_count (boolean): Also count all the users matching the filters (one more query).
+            match (unicode): How email and name are matched: "prefix", "contains" or "search"
+                (case insensitive substring).
 
         Returns:
-            (list of dict, boolean): A list of users representations. The boolean stands for if there is more to fetch.
+            (dict): The users representations, if there is more to fetch, and the cursor of the next page.
         """
-        users, has_next = self._db_user_manager.list_users(customer_id, limit, offset, email, name)
-        return {
-            u"users": users,
-            u"has_next": has_next
-        }
+        if match not in MATCH_MODES:
+            raise ApiUnprocessableEntity(u"Unknown match mode '{}'.".format(match))
 
-    def list_roles(self, limit=20, offset=0):
+        users, has_next = self._db_user_manager.list_users(
+            customer_id, limit, offset, email, name, after_id=self._decode_cursor(cursor), match=match
+        )
+        page = self._to_page(u"users", users, has_next)
+        if total_count:
+            page[u"total_count"] = self._db_user_manager.count_users(customer_id, email, name, match)
+        return page
+
+    def iter_users(self, customer_id: int, email=None, name=None, match=u"contains", with_roles=False):
+        """
+        Go through all the users of a customer, ordered by ID, without holding them all in memory (exports).
+        Args:
+            customer_id (int): The corresponding customer.
+            email (unicode): An email to filter on.
+            name (unicode): A name to filter on.
+            match (unicode): How email and name are matched: "prefix", "contains" or "search".
+            with_roles (boolean): Add the roles to the users.
+
+        Returns:
+            (generator of dict): The users representations.
+        """
+        if match not in MATCH_MODES:
+            raise ApiUnprocessableEntity(u"Unknown match mode '{}'.".format(match))
+
+        return self._db_user_manager.iter_users(customer_id, email, name, match, with_roles)
+
+    @in_session_scope
+    def list_roles(self, limit=20, offset=0, cursor=None, total_count=False):
         """
         List the roles from the API.
         Args:
             limit (int): The max number of returned roles.
-            offset (int): The cursor.
+            offset (int): The number of roles to skip (ignored if a cursor is given).
+            cursor (unicode): The next_cursor of the previous page, to page by ID instead of offset.
+            total_count (boolean): Also count all the roles (one more query).
+
+        Returns:
+            (dict): The roles representations, if there is more to fetch, and the cursor of the next page.
+        """
+        roles, has_next = self._db_role_manager.list_roles(
+            limit, offset, after_id=self._decode_cursor(cursor)
+        )
+        page = self._to_page(u"roles", roles, has_next)
+        if total_count:
+            page[u"total_count"] = self._db_role_manager.count_roles()
+        return page
+
+    @in_session_scope
+    def assign_role(self, customer_id: int, role_id: int, user_ids):
+        """
+        Give a role to users of a customer at once.
+        Args:
+            customer_id (int): The ID of the customer of the user requesting.
+            role_id (int): The ID of the role to give.
+            user_ids (list of int): The ids of the users (at most MAX_ROLE_BATCH_SIZE).
 
         Returns:
-            (list of dict, boolean): A list of roles representations. The boolean stands for if there is more to fetch.
+            (dict): The number of users who got the role.
         """
-        roles, has_next = self._db_role_manager.list_roles(limit, offset)
         return {
-            u"roles": roles,
+            u"assigned": self._change_role(self._db_role_manager.assign_role, customer_id, role_id, user_ids)
+        }
+
+    @in_session_scope
+    def revoke_role(self, customer_id: int, role_id: int, user_ids):
+        """
+        Remove a role from users of a customer at once.
+        Args:
+            customer_id (int): The ID of the customer of the user requesting.
+            role_id (int): The ID of the role to remove.
+            user_ids (list of int): The ids of the users (at most MAX_ROLE_BATCH_SIZE).
+
+        Returns:
+            (dict): The number of users who lost the role.
+        """
+        return {
+            u"revoked": self._change_role(self._db_role_manager.revoke_role, customer_id, role_id, user_ids)
+        }
+
+    def _change_role(self, change, customer_id, role_id, user_ids):
+        """
+        Run a bulk role change, and drop the cached profiles of the users.
+        Args:
+            change (callable): The DBRoleManager method applying the change.
+            customer_id (int): The customer the users must belong to.
+            role_id (int): The ID of the role.
+            user_ids (list of int): The ids of the users.
+
+        Returns:
+            (int): The number of users changed.
+        """
+        if len(user_ids) > MAX_ROLE_BATCH_SIZE:
+            raise ApiUnprocessableEntity(
+                u"At most {} users can be changed at once.".format(MAX_ROLE_BATCH_SIZE),
+                api_error_code=u"BATCH_TOO_LARGE"
+            )
+        try:
+            count = change(customer_id, role_id, user_ids)
+        except DBRoleNotFound:
+            raise ApiNotFound(u"Role '{}' doesn't exist.".format(role_id))
+        self._db_user_manager.invalidate_users(user_ids)
+        return count
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        """
+        Read a listing cursor.
+        Args:
+            cursor (unicode): The cursor, or None.
+
+        Returns:
+            (int): The ID to list after, or None.
+
+        Raises:
+            (ApiUnprocessableEntity): If the cursor is malformed.
+        """
+        if cursor is None:
+            return None
+        try:
+            return decode_cursor(cursor)
+        except ValueError as err:
+            raise ApiUnprocessableEntity(str(err), api_error_code=u"WRONG_CURSOR")
+
+    @staticmethod
+    def _to_page(key, items, has_next):
+        """
+        Build a listing result.
+        Args:
+            key (unicode): The key of the items in the result.
+            items (list of dict): The listed items.
+            has_next (boolean): If there is more to fetch.
+
+        Returns:
+            (dict): The listing result, with a next_cursor if there is more to fetch.
+        """
+        page = {
+            key: items,
             u"has_next": has_next
         }
+        if has_next and items:
+            page[u"next_cursor"] = encode_cursor(items[-1][u"id"])
+        return page
+
+    def get_cache_stats(self):
+        """
+        Get the hit / miss counters of the caches.
+
+        Returns:
+            (dict): The counters, by cache (None if a cache is disabled).
+        """
+        return self._db_user_manager.get_cache_stats()
+
+    def get_token_role_codes(self, token):
+        """
+        Get the codes of the roles in a token.
+        Args:
+            token (Dict): The token claims.
+
+        Returns:
+            (frozenset of unicode): The role codes.
+        """
+        return frozenset(role[u"code"] for role in token[u"roles"])
 
-    def token_has_roles(self, token, roles):
+    def token_has_roles(self, token, roles, any_of=False):
         """
         Check if a token is authorized for a role list.
         Args:
             token (Dict): The token to check.
-            roles (list of unicode): The list of roles code to check.
+            roles (iterable of unicode): The role codes to check (a frozenset avoids a copy).
+            any_of (boolean): Only require one of the roles instead of all of them.
 
         Returns:
             (boolean): Returns true if it has the roles.
@@ -289,12 +872,14 @@ class UserApi(object):
         Raises
             (ApiForbidden): Raised if the token doesn't have the expected roles.
         """
-        missing_roles = []
-        user_roles = [role[u"code"] for role in token[u"roles"]]
-        for required_role in roles:
-            if required_role not in user_roles:
-                missing_roles.append(required_role)
-        if len(missing_roles) > 0:
-            raise ApiForbidden(u"You don't have the {} role(s).".format(u", ".join(missing_roles)))
+        required_roles = roles if isinstance(roles, frozenset) else frozenset(roles)
+        user_roles = self.get_token_role_codes(token)
+        if any_of:
+            if required_roles and required_roles.isdisjoint(user_roles):
+                raise ApiForbidden(u"You need one of the {} role(s).".format(u", ".join(sorted(required_roles))))
+        else:
+            missing_roles = required_roles - user_roles
+            if missing_roles:
+                raise ApiForbidden(u"You don't have the {} role(s).".format(u", ".join(sorted(missing_roles))))
 
         return True
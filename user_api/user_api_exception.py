@@ -67,4 +67,11 @@ class ApiConflict(ApiException):
     Raised if the there is a conflict when updating resource.
     """
     def __init__(self, message=u"Conflict."):
-        ApiException.__init__(self, message, 409, u"CONFLICT")
\ No newline at end of file
+        ApiException.__init__(self, message, 409, u"CONFLICT")
+
+class ApiServiceUnavailable(ApiException):
+    """
+    Raised if the API is too busy to handle the request.
+    """
+    def __init__(self, message=u"Service unavailable."):
+        ApiException.__init__(self, message, 503, u"SERVICE_UNAVAILABLE")
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Contains the readers streaming the users to import from files.
+"""
+
+import csv
+import json
+from .user_api_exception import ApiUnprocessableEntity
+
+
+def wrong_row(message):
+    """
+    Build the marker yielded in place of a row which can't be read, so the import goes on
+    and reports it (see UserApi.register_many).
+    Args:
+        message (unicode): What is wrong with the row.
+
+    Returns:
+        (ApiUnprocessableEntity): The marker.
+    """
+    return ApiUnprocessableEntity(message, api_error_code=u"WRONG_ROW")
+
+
+def read_users_csv(stream):
+    """
+    Read users from a CSV file with a header line. The columns are email, name, password,
+    active (true / false, true if empty) and roles (role IDs separated by spaces).
+    Args:
+        stream (file): The opened CSV file.
+
+    Yields:
+        (dict|ApiUnprocessableEntity): The users, as register payloads, or a marker for a
+            row which can't be parsed.
+    """
+    rows = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as err:
+            yield wrong_row(u"Line {}: {}.".format(rows.line_num, err))
+            continue
+        active = (row.get(u"active") or u"true").strip().lower()
+        yield {
+            u"email": row.get(u"email"),
+            u"name": row.get(u"name"),
+            u"password": row.get(u"password"),
+            u"active": active in (u"1", u"true", u"yes"),
+            # A wrong role ID is kept as is, and rejected with the row by the validation.
+            u"roles": [
+                {u"id": int(role_id) if role_id.isdigit() else role_id}
+                for role_id in (row.get(u"roles") or u"").split()
+            ]
+        }
+
+
+def read_users_jsonl(stream):
+    """
+    Read users from a JSON lines file, one register payload per line.
+    Args:
+        stream (file): The opened JSON lines file.
+
+    Yields:
+        (dict|ApiUnprocessableEntity): The users, as register payloads, or a marker for a
+            line which is not a JSON object.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            user = json.loads(line)
+        except ValueError:
+            yield wrong_row(u"Line {} is not valid JSON.".format(line_number))
+            continue
+        if not isinstance(user, dict):
+            yield wrong_row(u"Line {} is not a JSON object.".format(line_number))
+            continue
+        yield user
+
+
+# Readers by file format.
+USER_READERS = {
+    u"csv": read_users_csv,
+    u"jsonl": read_users_jsonl
+}